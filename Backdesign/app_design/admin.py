@@ -0,0 +1,23 @@
+# admin.py
+from fastapi import APIRouter, Depends
+from db import pool_stats
+from core.passwords import password_hasher
+from core.startup import startup_timer
+from app_design.dependencies.deps import get_current_admin
+
+routeradmin = APIRouter()
+
+@routeradmin.get("/db-pool")
+async def get_db_pool_stats(current_admin: dict = Depends(get_current_admin)):
+    """查看数据库连接池状态（仅限管理员）"""
+    return pool_stats.snapshot()
+
+@routeradmin.get("/password-hashing")
+async def get_password_hashing_stats(current_admin: dict = Depends(get_current_admin)):
+    """查看密码哈希线程池的并发和排队情况（仅限管理员）"""
+    return password_hasher.snapshot()
+
+@routeradmin.get("/startup")
+async def get_startup_timings(current_admin: dict = Depends(get_current_admin)):
+    """查看本 worker 启动各阶段耗时（毫秒，仅限管理员）"""
+    return startup_timer.snapshot()
@@ -1,14 +1,31 @@
 # book.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile, status
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import Optional, List
 from pydantic import BaseModel
 from decimal import Decimal
 from datetime import date
-from db import get_db
+import csv
+import io
+import itertools
+import json
+import os
+from db import get_async_db, stream_partitions
+from app_design.dependencies.deps import get_token_principal
+from app_design.inventory import MAX_HOT_SLOTS, MIN_HOT_SLOTS, RESPLIT_HOT_STOCK_SQL, set_hot_mode
+from app_design.trending import popularity_tracker
+from app_design import recommendations
+from core.cache import book_cache
+from core.config import get_settings
+from core.pagination import decode_cursor, set_next_cursor
+from core.etag import compute_etag, etag_matches, not_modified, set_etag
+from core.serialization import FastJSONRoute, dumps
 
-routerbook = APIRouter()
+# 返回值均按 Book 字段构造，直接用 orjson 编码，跳过 response_model 的二次校验
+routerbook = APIRouter(route_class=FastJSONRoute)
 
 # Pydantic模型
 class BookBase(BaseModel):
@@ -24,6 +41,12 @@ class BookBase(BaseModel):
 class BookCreate(BookBase):
     pass
 
+class LowStockThresholdUpdate(BaseModel):
+    threshold: Optional[int] = None  # 为空时恢复默认阈值
+
+class HotModeUpdate(BaseModel):
+    slots: Optional[int] = None
+
 class BookUpdate(BaseModel):
     book_name: Optional[str] = None
     authors: Optional[str] = None
@@ -35,118 +58,547 @@ class Book(BookBase):
     class Config:
         from_attributes = True
 
+def escape_like(value: str) -> str:
+    """转义 LIKE/ILIKE 模式中的通配符"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+# 列表查询只选取 Book 的字段，行映射可直接编码为 JSON
+BOOK_COLUMNS = "isbn, book_name, authors, category, inventory, price, store_id, image_url"
+
+def row_to_dict(row) -> dict:
+    """列表接口的快速路径：行映射直接交给 orjson 编码，不构造 Book 模型"""
+    return dict(row._mapping)
+
+def row_to_book(row) -> Book:
+    """将 books 表的一行转换为 Book 模型"""
+    return Book(
+        isbn=row.isbn,
+        book_name=row.book_name,
+        authors=row.authors,
+        category=row.category,
+        inventory=row.inventory,
+        price=float(row.price),  # 将Decimal转换为float
+        store_id=row.store_id,
+        image_url=row.image_url
+    )
+
+def book_cursor_clause(cursor: Optional[str]):
+    """书籍按 isbn 升序的 keyset 分页条件"""
+    if not cursor:
+        return "", {}
+    try:
+        cursor_isbn = str(decode_cursor(cursor)["isbn"])
+    except (KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return "AND isbn > :cursor_isbn", {"cursor_isbn": cursor_isbn}
+
+def book_cursor_key(row) -> dict:
+    return {"isbn": row.isbn}
+
+# 流式输出时每次从服务端游标读取的行数
+STREAM_BATCH_SIZE = 500
+
+async def stream_books(fmt: str, cursor_clause: str, cursor_params: dict):
+    """通过服务端游标分批读取 books 并逐批输出，内存占用与目录大小无关
+
+    fmt 为 "ndjson" 时每行一本书，为 "json" 时输出一个分块发送的 JSON 数组。
+    """
+    if fmt == "json":
+        yield b"["
+    first = True
+    sql = f"SELECT {BOOK_COLUMNS} FROM books WHERE 1=1 {cursor_clause} ORDER BY isbn"
+    async for rows in stream_partitions(sql, cursor_params, STREAM_BATCH_SIZE):
+        if fmt == "ndjson":
+            yield b"".join(dumps(row_to_dict(row)) + b"\n" for row in rows)
+        else:
+            # 整批编码为一个数组后去掉方括号拼接
+            yield (b"" if first else b",") + dumps([row_to_dict(row) for row in rows])[1:-1]
+        first = False
+    if fmt == "json":
+        yield b"]"
+
+async def list_books(
+    response: Response,
+    limit: int,
+    cursor: Optional[str],
+    stream: Optional[str],
+    db: AsyncSession
+):
+    """书籍目录列表：默认按 isbn 分页，stream 指定格式时流式返回全部"""
+    cursor_clause, cursor_params = book_cursor_clause(cursor)
+    if stream:
+        media_type = "application/x-ndjson" if stream == "ndjson" else "application/json"
+        return StreamingResponse(stream_books(stream, cursor_clause, cursor_params), media_type=media_type)
+    try:
+        result = (await db.execute(
+            text(f"SELECT {BOOK_COLUMNS} FROM books WHERE 1=1 {cursor_clause} ORDER BY isbn LIMIT :limit"),
+            {"limit": limit, **cursor_params}
+        )).fetchall()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    set_next_cursor(response, result, limit, book_cursor_key)
+    return [row_to_dict(row) for row in result]
+
+def book_etag(versions) -> str:
+    """由 (isbn, 行版本号) 列表计算书籍或书籍列表的 ETag，行被更新时 xmin 必然变化"""
+    return compute_etag([[isbn, version] for isbn, version in versions])
+
+async def cached_book_list(
+    key: tuple,
+    where: str,
+    params: dict,
+    request: Request,
+    response: Response,
+    db: AsyncSession
+):
+    """按条件读取书籍列表（经过缓存），支持 If-None-Match 条件请求"""
+    books = book_cache.get_list(key)
+    versions = None
+    if books is not None:
+        versions = [(book.isbn, book_cache.get_version(book.isbn)) for book in books]
+        if any(version is None for _, version in versions):
+            books = None
+    if books is None and request.headers.get("if-none-match"):
+        # 只读取行版本号判断列表是否变化，未变化时不查询完整行
+        rows = (await db.execute(
+            text(f"SELECT isbn, xmin::text AS row_version FROM books WHERE {where} ORDER BY isbn"),
+            params
+        )).fetchall()
+        etag = book_etag(rows)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+    if books is None:
+        rows = (await db.execute(
+            text(f"SELECT *, xmin::text AS row_version FROM books WHERE {where} ORDER BY isbn"),
+            params
+        )).fetchall()
+        books = [row_to_book(row) for row in rows]
+        versions = [(row.isbn, row.row_version) for row in rows]
+        book_cache.put_list(key, books, [row.row_version for row in rows])
+    etag = book_etag(versions)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    return books
+
+def invalidate_book_cache(isbn: str, category: Optional[str] = None, store_id: Optional[int] = None):
+    """书籍变更后失效缓存中的书籍及其所在的分类/店铺列表"""
+    book_cache.invalidate_books([isbn])
+    if category is not None:
+        book_cache.invalidate_lists(("category", category))
+    if store_id is not None:
+        book_cache.invalidate_lists(("store", store_id))
+
 # API路由
 @routerbook.post("/", response_model=Book)
-async def create_book(book: BookCreate, db: Session = Depends(get_db)):
+async def create_book(book: BookCreate, db: AsyncSession = Depends(get_async_db)):
     """创建新书籍"""
     try:
         # 插入新书籍的 SQL 语句
-        sql = text("""
+        sql = text(f"""
             INSERT INTO books (isbn, book_name, authors, category, inventory, price, store_id,image_url)
             VALUES (:isbn, :book_name, :authors, :category, :inventory, :price, :store_id,:image_url)
-            RETURNING *
+            RETURNING {BOOK_COLUMNS}
         """)
         
         # 将 BookCreate 数据转换为字典并执行 SQL
-        result = db.execute(sql, book.dict())
-        db.commit()
+        result = (await db.execute(sql, book.dict())).fetchone()
+        await db.commit()
+        invalidate_book_cache(result.isbn, result.category, result.store_id)
         # 返回插入的书籍数据
-        return result.fetchone()
+        return result
     
     except Exception as e:
         # 发生异常时回滚事务
-        db.rollback()
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+
+# 批量导入：每批解析校验的行数，校验通过的行用 COPY 写入临时表
+IMPORT_BATCH_SIZE = 5000
+# 错误报告最多返回的条数
+MAX_IMPORT_ERRORS = 1000
+IMPORT_COLUMNS = ("line", "isbn", "book_name", "authors", "category", "inventory", "price", "store_id", "image_url")
+IMPORT_REQUIRED_FIELDS = ("isbn", "book_name", "authors", "category", "inventory", "price")
+MAX_PRICE = Decimal("99999999.99")  # NUMERIC(10, 2)
+
+def _import_text(record: dict, name: str, max_length: int, required: bool = True) -> Optional[str]:
+    value = record.get(name)
+    if value is None or str(value).strip() == "":
+        if required:
+            raise ValueError(f"{name} is required")
+        return None
+    value = str(value).strip()
+    if len(value) > max_length:
+        raise ValueError(f"{name} exceeds {max_length} characters")
+    return value
+
+def _import_int(record: dict, name: str) -> int:
+    value = record.get(name)
+    if isinstance(value, bool) or value is None or str(value).strip() == "":
+        raise ValueError(f"{name} must be an integer")
+    if isinstance(value, float):
+        if not value.is_integer():
+            raise ValueError(f"{name} must be an integer")
+        return int(value)
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        raise ValueError(f"{name} must be an integer")
+
+def validate_import_record(record: dict, store_id: Optional[int]) -> tuple:
+    """校验一行导入数据，返回按 IMPORT_COLUMNS（不含行号）排列的值，不合法时抛出 ValueError"""
+    isbn = _import_text(record, "isbn", 20)
+    book_name = _import_text(record, "book_name", 255)
+    authors = _import_text(record, "authors", 255)
+    category = _import_text(record, "category", 100)
+    inventory = _import_int(record, "inventory")
+    if inventory < 0:
+        raise ValueError("inventory must not be negative")
+    try:
+        price = Decimal(str(record.get("price")).strip())
+    except (ArithmeticError, ValueError):
+        raise ValueError("price must be a number")
+    if not price.is_finite() or price < 0 or price > MAX_PRICE or price != price.quantize(Decimal("0.01")):
+        raise ValueError("price must be between 0 and 99999999.99 with at most 2 decimals")
+    # 店铺导入时一律归属当前店铺
+    row_store_id = store_id if store_id is not None else _import_int(record, "store_id")
+    image_url = _import_text(record, "image_url", 255, required=False)
+    return (isbn, book_name, authors, category, inventory, price, row_store_id, image_url)
+
+def iter_import_rows(fileobj, fmt: str, store_id: Optional[int]):
+    """流式解析上传文件，逐行产出 (行号, 校验后的值或 None, (isbn, 错误信息) 或 None)"""
+    stream = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    required = IMPORT_REQUIRED_FIELDS + (() if store_id is not None else ("store_id",))
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        missing = [name for name in required if name not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"CSV header is missing columns: {', '.join(missing)}")
+        records = ((reader.line_num, record) for record in reader)
+    else:
+        records = ((line_no, line) for line_no, line in enumerate(stream, start=1) if line.strip())
+    for line_no, record in records:
+        try:
+            if fmt == "ndjson":
+                try:
+                    record = json.loads(record)
+                except ValueError:
+                    raise ValueError("invalid JSON")
+                if not isinstance(record, dict):
+                    raise ValueError("each line must be a JSON object")
+            yield line_no, (line_no,) + validate_import_record(record, store_id), None
+        except ValueError as e:
+            isbn = record.get("isbn") if isinstance(record, dict) else None
+            yield line_no, None, (str(isbn) if isbn is not None else None, str(e))
+
+@routerbook.post("/import")
+async def import_books(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|ndjson)$", description="默认按文件扩展名判断"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """批量导入书籍（CSV 或 NDJSON），按 ISBN 插入或更新
+
+    文件逐批解析校验，合法的行通过 COPY 写入临时表，最后用一条 INSERT ... ON CONFLICT
+    写入 books；店铺只能导入和更新自己的书籍。返回逐行的错误报告。
+    """
+    if current_user.type == "store":
+        store_id = current_user.id
+    elif current_user.type == "administrator":
+        store_id = None  # 管理员导入时每行必须提供 store_id
+    else:
+        raise HTTPException(status_code=403, detail="Only stores and administrators can import books")
+
+    if format is None:
+        extension = os.path.splitext(file.filename or "")[1].lower()
+        format = {".csv": "csv", ".ndjson": "ndjson", ".jsonl": "ndjson"}.get(extension)
+        if format is None:
+            raise HTTPException(status_code=400, detail="Unknown file format, pass format=csv or format=ndjson")
+
+    errors = []
+    error_count = 0
+    received = 0
+    isbns = set()
+
+    def add_error(line: int, isbn: Optional[str], message: str):
+        nonlocal error_count
+        error_count += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({"line": line, "isbn": isbn, "error": message})
+
+    rows = iter_import_rows(file.file, format, store_id)
+
+    def next_batch():
+        return list(itertools.islice(rows, IMPORT_BATCH_SIZE))
+
+    try:
+        conn = await db.connection()
+        await conn.execute(text("""
+            CREATE TEMP TABLE book_import (
+                line INTEGER NOT NULL,
+                isbn VARCHAR(20) NOT NULL,
+                book_name VARCHAR(255) NOT NULL,
+                authors VARCHAR(255) NOT NULL,
+                category VARCHAR(100) NOT NULL,
+                inventory INTEGER NOT NULL,
+                price NUMERIC(10, 2) NOT NULL,
+                store_id INTEGER NOT NULL,
+                image_url VARCHAR(255)
+            ) ON COMMIT DROP
+        """))
+        copy_connection = (await conn.get_raw_connection()).driver_connection
+
+        # 解析在线程池中进行，每批校验完成后立即 COPY，内存中只保留一批
+        try:
+            while batch := await run_in_threadpool(next_batch):
+                valid = []
+                for line, values, error in batch:
+                    received += 1
+                    if error:
+                        add_error(line, *error)
+                    else:
+                        valid.append(values)
+                        isbns.add(values[1])
+                if valid:
+                    await copy_connection.copy_records_to_table(
+                        "book_import", records=valid, columns=IMPORT_COLUMNS
+                    )
+        except UnicodeDecodeError:
+            raise HTTPException(status_code=400, detail="File must be UTF-8 encoded")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 管理员导入时 store_id 必须是已存在的店铺
+        if store_id is None:
+            invalid = (await db.execute(text("""
+                DELETE FROM book_import s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM participants p WHERE p.id = s.store_id AND p.type = 'store'
+                )
+                RETURNING line, isbn
+            """))).fetchall()
+            for row in invalid:
+                add_error(row.line, row.isbn, "store_id is not a store")
+
+        # 文件内重复的 ISBN 以最后一行为准
+        duplicates = (await db.execute(text("""
+            SELECT s.line, s.isbn FROM book_import s
+            WHERE EXISTS (SELECT 1 FROM book_import t WHERE t.isbn = s.isbn AND t.line > s.line)
+            ORDER BY s.line
+        """))).fetchall()
+        for row in duplicates:
+            add_error(row.line, row.isbn, "duplicate isbn in file, a later line is used")
+
+        # 已存在的书籍只有属于同一店铺时才更新（管理员不受限制）；未提供封面时保留原封面
+        summary = (await db.execute(text("""
+            WITH src AS (
+                SELECT DISTINCT ON (isbn) * FROM book_import ORDER BY isbn, line DESC
+            ),
+            upserted AS (
+                INSERT INTO books (isbn, book_name, authors, category, inventory, price, store_id, image_url)
+                SELECT isbn, book_name, authors, category, inventory, price, store_id, image_url FROM src
+                ON CONFLICT (isbn) DO UPDATE SET
+                    book_name = EXCLUDED.book_name,
+                    authors = EXCLUDED.authors,
+                    category = EXCLUDED.category,
+                    inventory = EXCLUDED.inventory,
+                    price = EXCLUDED.price,
+                    store_id = EXCLUDED.store_id,
+                    image_url = COALESCE(EXCLUDED.image_url, books.image_url)
+                WHERE books.store_id = EXCLUDED.store_id OR :is_admin
+                RETURNING isbn, (xmax = 0) AS inserted
+            )
+            SELECT
+                count(*) FILTER (WHERE u.inserted) AS inserted,
+                count(*) FILTER (WHERE NOT u.inserted) AS updated,
+                array_agg(src.line ORDER BY src.line) FILTER (WHERE u.isbn IS NULL) AS rejected_lines,
+                array_agg(src.isbn ORDER BY src.line) FILTER (WHERE u.isbn IS NULL) AS rejected_isbns,
+                array_agg(u.isbn) FILTER (WHERE u.isbn IS NOT NULL) AS upserted_isbns
+            FROM src LEFT JOIN upserted u ON u.isbn = src.isbn
+        """), {"is_admin": store_id is None})).fetchone()
+        for line, isbn in zip(summary.rejected_lines or [], summary.rejected_isbns or []):
+            add_error(line, isbn, "isbn belongs to another store")
+        # 只重新拆分本次确实写入了库存的书籍；被拒绝的行不能用可能滞后的 books.inventory 覆盖各槽
+        if summary.upserted_isbns:
+            await db.execute(text(RESPLIT_HOT_STOCK_SQL), {"isbns": summary.upserted_isbns})
+
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
+    except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
+    book_cache.invalidate_books(isbns)
+    book_cache.invalidate_list_kind("category")
+    book_cache.invalidate_list_kind("store")
+    errors.sort(key=lambda error: error["line"])
+    return {
+        "received": received,
+        "inserted": summary.inserted,
+        "updated": summary.updated,
+        "failed": error_count,
+        "errors": errors,
+        "errors_truncated": error_count > len(errors),
+    }
 
 
 @routerbook.get("/search", response_model=List[Book])
-async def search_books(q: Optional[str] = None, category: Optional[str] = None, db: Session = Depends(get_db)):
-    """搜索书籍"""
+async def search_books(
+    response: Response,
+    q: Optional[str] = None,
+    category: Optional[str] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """搜索书籍（模糊搜索按相关度排序；无条件时按 isbn 分页）"""
+    # cursor 只用于无搜索条件的全目录浏览，传入 cursor 时使用 keyset 分页，忽略 skip
+    browsing = not q and not category
+    cursor_clause, cursor_params = book_cursor_clause(cursor if browsing else None)
     try:
+        params = {"limit": limit, "skip": 0 if browsing and cursor else skip}
+        category_clause = ""
+        if category:
+            category_clause = "AND category = :category"
+            params["category"] = category
+
         if q and q.startswith('@'): # 精确搜索
-            search_term = q[1:]
-            if category:
-                result = db.execute(
-                    text("""
-                        SELECT * FROM books 
-                        WHERE (isbn = :term 
-                        OR book_name = :term 
-                        OR authors = :term)
-                        AND category = :category
-                    """),
-                    {"term": search_term, "category": category}
-                ).fetchall()
-            else:
-                result = db.execute(
-                    text("""
-                        SELECT * FROM books 
-                        WHERE isbn = :term 
-                        OR book_name = :term 
-                        OR authors = :term
-                    """),
-                    {"term": search_term}
-                ).fetchall()
+            params["term"] = q[1:]
+            sql = f"""
+                SELECT {BOOK_COLUMNS} FROM books 
+                WHERE (isbn = :term 
+                OR book_name = :term 
+                OR authors = :term)
+                {category_clause}
+                ORDER BY isbn
+                OFFSET :skip LIMIT :limit
+            """
         
-        elif q: # 模糊搜索
-            if category:
-                result = db.execute(
-                    text("""
-                        SELECT * FROM books 
-                        WHERE (book_name ILIKE :pattern 
-                        OR authors ILIKE :pattern)
-                        AND category = :category
-                    """),
-                    {"pattern": f"%{q}%", "category": category}
-                ).fetchall()
-            else:
-                result = db.execute(
-                    text("""
-                        SELECT * FROM books 
-                        WHERE book_name ILIKE :pattern 
-                        OR authors ILIKE :pattern
-                    """),
-                    {"pattern": f"%{q}%"}
-                ).fetchall()
+        elif q: # 模糊搜索：书名/作者上的 pg_trgm 索引，按相似度排序
+            params["q"] = q
+            params["pattern"] = f"%{escape_like(q)}%"
+            sql = f"""
+                SELECT {BOOK_COLUMNS} FROM books 
+                WHERE (book_name ILIKE :pattern 
+                OR authors ILIKE :pattern
+                OR :q <% book_name
+                OR :q <% authors)
+                {category_clause}
+                ORDER BY GREATEST(
+                    word_similarity(:q, book_name),
+                    word_similarity(:q, authors)
+                ) DESC, isbn
+                OFFSET :skip LIMIT :limit
+            """
         
         elif category: # 只按分类筛选
-            result = db.execute(
-                text("SELECT * FROM books WHERE category = :category"),
-                {"category": category}
-            ).fetchall()
+            sql = f"SELECT {BOOK_COLUMNS} FROM books WHERE category = :category ORDER BY isbn OFFSET :skip LIMIT :limit"
         
         else: # 获取所有书籍
-            result = db.execute(text("SELECT * FROM books")).fetchall()
-
-        # 处理返回结果
-        books = []
-        for row in result:
-            book_dict = {
-                "isbn": row.isbn,
-                "book_name": row.book_name,
-                "authors": row.authors,
-                "category": row.category,
-                "inventory": row.inventory,
-                "price": float(row.price),  # 将Decimal转换为float
-                "store_id": row.store_id,
-                "image_url": row.image_url  # 新增的图片URL字段
-            }
-            books.append(Book(**book_dict))
-        return books
+            params.update(cursor_params)
+            sql = f"SELECT {BOOK_COLUMNS} FROM books WHERE 1=1 {cursor_clause} ORDER BY isbn OFFSET :skip LIMIT :limit"
+
+        result = (await db.execute(text(sql), params)).fetchall()
+        if browsing:
+            set_next_cursor(response, result, limit, book_cursor_key)
+
+        return [row_to_dict(row) for row in result]
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+async def scored_books(db: AsyncSession, ranked) -> List[dict]:
+    """按 (isbn, 分数) 的顺序返回书籍信息和分数
+
+    书籍优先从缓存读取，未命中的一次批量查询；已删除的书籍不再展示。
+    """
+    missing = [isbn for isbn, _ in ranked if book_cache.get_book(isbn) is None]
+    if missing:
+        rows = (await db.execute(
+            text(f"SELECT {BOOK_COLUMNS} FROM books WHERE isbn = ANY(:isbns)"), {"isbns": missing}
+        )).fetchall()
+        for row in rows:
+            book_cache.put_book(row_to_book(row))
+    books = []
+    for isbn, score in ranked:
+        book = book_cache.get_book(isbn)
+        if book is not None:
+            books.append({**book.model_dump(), "score": round(score, 4)})
+    return books
+
+@routerbook.get("/trending")
+async def get_trending_books(
+    kind: str = Query("trending", pattern="^(trending|bestseller)$"),
+    category: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """热门书籍排行（trending：近期销量，bestseller：较长时间的销量），按衰减后的分数从高到低
+
+    排行直接读取内存中的前 K 名。
+    """
+    ranked = popularity_tracker.top_books(kind, limit, category)
+    return await scored_books(db, ranked)
+
+@routerbook.get("/trending/categories")
+async def get_trending_categories(
+    kind: str = Query("trending", pattern="^(trending|bestseller)$"),
+    limit: int = Query(20, ge=1, le=100)
+):
+    """热门分类排行"""
+    return [
+        {"category": category, "score": round(score, 4)}
+        for category, score in popularity_tracker.top_categories(kind, limit)
+    ]
+
 @routerbook.get("/{isbn}", response_model=Book)
-async def get_book(isbn: str, db: Session = Depends(get_db)):
-    """获取单本书籍详情"""
-    sql = text("SELECT * FROM books WHERE isbn = :isbn")
-    result = db.execute(sql, {"isbn": isbn}).fetchone()
-    if not result:
-        raise HTTPException(status_code=404, detail="Book not found")
-    return result
+async def get_book(isbn: str, request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """获取单本书籍详情，支持 If-None-Match 条件请求"""
+    book = book_cache.get_book(isbn)
+    version = book_cache.get_version(isbn)
+    if (book is None or version is None) and request.headers.get("if-none-match"):
+        # 只读取行版本号判断是否变化，未变化时不查询完整行
+        version = (await db.execute(
+            text("SELECT xmin::text FROM books WHERE isbn = :isbn"), {"isbn": isbn}
+        )).scalar()
+        if version is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+        etag = book_etag([(isbn, version)])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        book = None
+    if book is None or version is None:
+        sql = text("SELECT *, xmin::text AS row_version FROM books WHERE isbn = :isbn")
+        result = (await db.execute(sql, {"isbn": isbn})).fetchone()
+        if not result:
+            raise HTTPException(status_code=404, detail="Book not found")
+        book = row_to_book(result)
+        version = result.row_version
+        book_cache.put_book(book, version)
+    etag = book_etag([(isbn, version)])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
+    return book
+
+@routerbook.get("/{isbn}/also-bought")
+async def get_also_bought_books(
+    isbn: str,
+    limit: int = Query(10, ge=1, le=recommendations.TOP_NEIGHBOURS),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """购买了这本书的顾客也购买了：按共同购买的相似度从高到低，读取内存中预先计算的结果"""
+    ranked = recommendations.recommendation_index.lookup(isbn, limit)
+    return await scored_books(db, ranked)
 
 @routerbook.put("/{isbn}", response_model=Book)
-async def update_book(isbn: str, book_update: BookUpdate, db: Session = Depends(get_db)):
+async def update_book(isbn: str, book_update: BookUpdate, db: AsyncSession = Depends(get_async_db)):
     """更新书籍信息"""
     try:
         update_data = book_update.dict(exclude_unset=True)
@@ -159,113 +611,212 @@ async def update_book(isbn: str, book_update: BookUpdate, db: Session = Depends(
             UPDATE books 
             SET {set_clause}
             WHERE isbn = :isbn
-            RETURNING *
+            RETURNING {BOOK_COLUMNS}
         """)
         
         # 添加isbn到参数中
         update_data["isbn"] = isbn
-        result = db.execute(sql, update_data).fetchone()
+        result = (await db.execute(sql, update_data)).fetchone()
         
         if not result:
             raise HTTPException(status_code=404, detail="Book not found")
+        if "inventory" in update_data:
+            # 热门书籍按新库存重新拆分到各槽
+            await db.execute(text(RESPLIT_HOT_STOCK_SQL), {"isbns": [isbn]})
         
-        db.commit()
+        await db.commit()
+        invalidate_book_cache(isbn, result.category, result.store_id)
+        if "category" in update_data:
+            # 旧分类未知，失效全部分类列表
+            book_cache.invalidate_list_kind("category")
         return result
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routerbook.delete("/{isbn}")
-async def delete_book(isbn: str, db: Session = Depends(get_db)):
+async def delete_book(isbn: str, db: AsyncSession = Depends(get_async_db)):
     """删除书籍"""
     try:
-        sql = text("DELETE FROM books WHERE isbn = :isbn RETURNING isbn")
-        result = db.execute(sql, {"isbn": isbn}).fetchone()
+        sql = text("DELETE FROM books WHERE isbn = :isbn RETURNING isbn, category, store_id")
+        result = (await db.execute(sql, {"isbn": isbn})).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="Book not found")
-        db.commit()
+        await db.commit()
+        invalidate_book_cache(isbn, result.category, result.store_id)
         return {"message": "Book deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routerbook.get("/category/{category}")
-async def get_books_by_category(category: str, db: Session = Depends(get_db)):
+async def get_books_by_category(
+    category: str,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
     """按分类获取书籍"""
-    sql = text("SELECT * FROM books WHERE category = :category")
-    result = db.execute(sql, {"category": category})
-    # 处理返回结果
-    books = []
-    for row in result:
-            book_dict = {
-                "isbn": row.isbn,
-                "book_name": row.book_name,
-                "authors": row.authors,
-                "category": row.category,
-                "inventory": row.inventory,
-                "price": float(row.price),  # 将Decimal转换为float
-                "store_id": row.store_id,
-                "image_url": row.image_url  # 新增的图片URL字段
-            }
-            books.append(Book(**book_dict))
-    return books
+    return await cached_book_list(
+        ("category", category), "category = :category", {"category": category},
+        request, response, db
+    )
 @routerbook.get("/store/{store_id}")
-async def get_books_by_store(store_id: int, db: Session = Depends(get_db)):
+async def get_books_by_store(
+    store_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_db)
+):
     """获取店铺的所有书籍"""
-    sql = text("SELECT * FROM books WHERE store_id = :store_id")
-    result = db.execute(sql, {"store_id": store_id})
-    # 处理返回结果
-    books = []
-    for row in result:
-            book_dict = {
-                "isbn": row.isbn,
-                "book_name": row.book_name,
-                "authors": row.authors,
-                "category": row.category,
-                "inventory": row.inventory,
-                "price": float(row.price),  # 将Decimal转换为float
-                "store_id": row.store_id,
-                "image_url": row.image_url  # 新增的图片URL字段
-            }
-            books.append(Book(**book_dict))
-    return books
+    return await cached_book_list(
+        ("store", store_id), "store_id = :store_id", {"store_id": store_id},
+        request, response, db
+    )
 
 @routerbook.get("/inventory/low")
-async def get_low_inventory_books(threshold: int = 0, db: Session = Depends(get_db)):
+async def get_low_inventory_books(threshold: int = 0, db: AsyncSession = Depends(get_async_db)):
     """获取库存低的书籍"""
-    sql = text("SELECT * FROM books WHERE inventory <= :threshold")
-    result = db.execute(sql, {"threshold": threshold})
-    # 处理返回结果
-    books = []
-    for row in result:
-            book_dict = {
-                "isbn": row.isbn,
-                "book_name": row.book_name,
-                "authors": row.authors,
-                "category": row.category,
-                "inventory": row.inventory,
-                "price": float(row.price),  # 将Decimal转换为float
-                "store_id": row.store_id,
-                "image_url": row.image_url  # 新增的图片URL字段
-            }
-            books.append(Book(**book_dict))
-    return books
-# 在 books.py 中添加新接口
-# books.py
-# 确保有对应的路由处理函数
-@routerbook.get("/")  # 或 "/search"
-async def get_all_books(db: Session = Depends(get_db)):
-    """获取所有图书"""
+    sql = text(f"SELECT {BOOK_COLUMNS} FROM books WHERE inventory <= :threshold")
+    result = await db.execute(sql, {"threshold": threshold})
+    return [row_to_dict(row) for row in result]
+
+def low_stock_cursor_clause(cursor: Optional[str]):
+    """低库存列表按 (inventory, isbn) 升序的 keyset 分页条件，与 ix_books_store_inventory 索引顺序一致"""
+    if not cursor:
+        return "", {}
     try:
-        result = db.execute(text("SELECT * FROM books")).fetchall()
-        return result
+        data = decode_cursor(cursor)
+        params = {"cursor_inventory": int(data["inventory"]), "cursor_isbn": str(data["isbn"])}
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return "AND (inventory, isbn) > (:cursor_inventory, :cursor_isbn)", params
+
+def low_stock_cursor_key(row) -> dict:
+    return {"inventory": row.inventory, "isbn": row.isbn}
+
+def check_store_access(store_id: int, current_user):
+    """店铺只能访问自己的数据，管理员不受限制"""
+    if current_user.type == "administrator":
+        return
+    if current_user.type != "store" or current_user.id != store_id:
+        raise HTTPException(status_code=403, detail="Not authorized to access this store")
+
+@routerbook.get("/store/{store_id}/low-stock")
+async def get_store_low_stock_books(
+    store_id: int,
+    response: Response,
+    threshold: Optional[int] = Query(None, ge=0, description="默认使用店铺设置的阈值"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """店铺的低库存书籍，按库存从少到多分页；只扫描 (store_id, inventory) 索引中低于阈值的区间"""
+    check_store_access(store_id, current_user)
+    if threshold is None:
+        store = (await db.execute(
+            text("SELECT low_stock_threshold FROM participants WHERE id = :store_id AND type = 'store'"),
+            {"store_id": store_id}
+        )).fetchone()
+        if not store:
+            raise HTTPException(status_code=404, detail="Store not found")
+        threshold = store.low_stock_threshold
+        if threshold is None:
+            threshold = get_settings().LOW_STOCK_THRESHOLD
+
+    cursor_clause, cursor_params = low_stock_cursor_clause(cursor)
+    result = (await db.execute(text(f"""
+        SELECT {BOOK_COLUMNS} FROM books
+        WHERE store_id = :store_id AND inventory <= :threshold
+        {cursor_clause}
+        ORDER BY inventory, isbn
+        LIMIT :limit
+    """), {"store_id": store_id, "threshold": threshold, "limit": limit, **cursor_params})).fetchall()
+    set_next_cursor(response, result, limit, low_stock_cursor_key)
+    response.headers["X-Low-Stock-Threshold"] = str(threshold)
+    return [row_to_dict(row) for row in result]
+
+@routerbook.put("/store/{store_id}/low-stock-threshold")
+async def update_store_low_stock_threshold(
+    store_id: int,
+    body: LowStockThresholdUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """设置店铺的低库存阈值（threshold 为空时恢复默认值）"""
+    check_store_access(store_id, current_user)
+    if body.threshold is not None and body.threshold < 0:
+        raise HTTPException(status_code=400, detail="threshold must not be negative")
+    try:
+        result = (await db.execute(text("""
+            UPDATE participants SET low_stock_threshold = :threshold
+            WHERE id = :store_id AND type = 'store'
+            RETURNING id
+        """), {"store_id": store_id, "threshold": body.threshold})).fetchone()
+        if not result:
+            raise HTTPException(status_code=404, detail="Store not found")
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-@routerbook.get("/late/")
-async def get_all_books(db: Session = Depends(get_db)):
-    """获取所有图书"""
+    threshold = body.threshold if body.threshold is not None else get_settings().LOW_STOCK_THRESHOLD
+    return {"store_id": store_id, "threshold": threshold}
+@routerbook.put("/{isbn}/hot-mode")
+async def update_hot_mode(
+    isbn: str,
+    body: HotModeUpdate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """开启或关闭书籍的热门模式（抢购期间把库存拆到 slots 个槽中，slots 为空时合并回来）"""
+    if body.slots is not None and not MIN_HOT_SLOTS <= body.slots <= MAX_HOT_SLOTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"slots must be between {MIN_HOT_SLOTS} and {MAX_HOT_SLOTS}"
+        )
     try:
-        result = db.execute(text("SELECT * FROM books")).fetchall()
-        return result
+        book = (await db.execute(
+            text("SELECT store_id, category FROM books WHERE isbn = :isbn"), {"isbn": isbn}
+        )).fetchone()
+        if not book:
+            raise HTTPException(status_code=404, detail="Book not found")
+        check_store_access(book.store_id, current_user)
+        result = await set_hot_mode(db, isbn, body.slots)
+        if not result:
+            raise HTTPException(status_code=404, detail="Book not found")
+        await db.commit()
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
+    invalidate_book_cache(isbn, book.category, book.store_id)
+    return {"isbn": result.isbn, "inventory": result.inventory, "hot_slots": result.hot_slots}
+# 在 books.py 中添加新接口
+# books.py
+# 确保有对应的路由处理函数
+@routerbook.get("/")  # 或 "/search"
+async def get_all_books(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取所有图书（分页；stream=json/ndjson 时流式返回）"""
+    return await list_books(response, limit, cursor, stream, db)
+@routerbook.get("/late/")
+async def get_all_books_late(
+    response: Response,
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    stream: Optional[str] = Query(None, pattern="^(json|ndjson)$"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """获取所有图书（分页；stream=json/ndjson 时流式返回）"""
+    return await list_books(response, limit, cursor, stream, db)
\ No newline at end of file
@@ -1,12 +1,15 @@
 # cart_items.py
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import Optional, List, Dict, Any
 from pydantic import BaseModel
 from decimal import Decimal
-from db import get_db
-from app_design.dependencies.deps import get_current_user
+from db import get_async_db
+from app_design.dependencies.deps import get_token_principal
+from app_design.inventory import claim_hot_stock, lock_books_for_reservation
+from app_design.sales import record_new_orders
+from core.cache import book_cache
 
 routercart = APIRouter()
 
@@ -57,13 +60,13 @@ class MessageResponse(BaseModel):
 @routercart.post("/", response_model=CartItemResponse)
 async def add_to_cart(
     item: CartItemCreate,
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Dict[str, Any] = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """添加商品到购物车"""
     try:
         # 检查书籍是否存在且有足够库存
-        book = db.execute(text("""
+        book = (await db.execute(text("""
             SELECT b.*, p.name as store_name 
             FROM books b
             JOIN participants p ON b.store_id = p.id
@@ -71,22 +74,22 @@ async def add_to_cart(
         """), {
             "isbn": item.book_isbn,
             "quantity": item.quantity
-        }).fetchone()
+        })).fetchone()
         
         if not book:
             raise HTTPException(status_code=404, detail="Book not found or insufficient inventory")
 
         # 检查是否已在购物车中
-        existing = db.execute(text("""
+        existing = (await db.execute(text("""
             SELECT * FROM cart_items 
             WHERE user_id = :user_id AND book_isbn = :book_isbn
         """), {
             "user_id": current_user[0],
             "book_isbn": item.book_isbn
-        }).fetchone()
+        })).fetchone()
 
         if existing:
-            cart_item = db.execute(text("""
+            cart_item = (await db.execute(text("""
                 UPDATE cart_items 
                 SET quantity = quantity + :quantity 
                 WHERE cart_item_id = :cart_item_id
@@ -94,9 +97,9 @@ async def add_to_cart(
             """), {
                 "quantity": item.quantity,
                 "cart_item_id": existing.cart_item_id
-            }).fetchone()
+            })).fetchone()
         else:
-            cart_item = db.execute(text("""
+            cart_item = (await db.execute(text("""
                 INSERT INTO cart_items (user_id, book_isbn, quantity)
                 VALUES (:user_id, :book_isbn, :quantity)
                 RETURNING *
@@ -104,9 +107,9 @@ async def add_to_cart(
                 "user_id": current_user[0],
                 "book_isbn": item.book_isbn,
                 "quantity": item.quantity
-            }).fetchone()
+            })).fetchone()
 
-        db.commit()
+        await db.commit()
 
         return CartItemResponse(
             cart_item_id=cart_item.cart_item_id,
@@ -127,17 +130,17 @@ async def add_to_cart(
     except HTTPException as he:
         raise he
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routercart.get("/", response_model=List[CartItemResponse])
 async def get_cart_items(
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Dict[str, Any] = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取购物车所有商品"""
     try:
-        results = db.execute(text("""
+        results = (await db.execute(text("""
             SELECT 
                 ci.*,
                 b.book_name,
@@ -152,7 +155,7 @@ async def get_cart_items(
             WHERE ci.user_id = :user_id
         """), {
             "user_id": current_user[0]
-        }).fetchall()
+        })).fetchall()
 
         return [
             CartItemResponse(
@@ -180,13 +183,13 @@ async def get_cart_items(
 async def update_cart_item(
     cart_item_id: int,
     item_update: CartItemUpdate,
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Dict[str, Any] = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """更新购物车商品数量"""
     try:
         # 验证并更新
-        item = db.execute(text("""
+        item = (await db.execute(text("""
             SELECT ci.*, b.inventory, b.book_name, b.authors, b.price, b.store_id, p.name as store_name
             FROM cart_items ci
             JOIN books b ON ci.book_isbn = b.isbn
@@ -195,7 +198,7 @@ async def update_cart_item(
         """), {
             "cart_item_id": cart_item_id,
             "user_id": current_user[0]
-        }).fetchone()
+        })).fetchone()
         
         if not item:
             raise HTTPException(status_code=404, detail="Cart item not found")
@@ -203,7 +206,7 @@ async def update_cart_item(
         if item_update.quantity > item.inventory:
             raise HTTPException(status_code=400, detail="Insufficient inventory")
             
-        updated_item = db.execute(text("""
+        updated_item = (await db.execute(text("""
             UPDATE cart_items 
             SET quantity = :quantity 
             WHERE cart_item_id = :cart_item_id
@@ -211,9 +214,9 @@ async def update_cart_item(
         """), {
             "quantity": item_update.quantity,
             "cart_item_id": cart_item_id
-        }).fetchone()
+        })).fetchone()
         
-        db.commit()
+        await db.commit()
         
         return CartItemResponse(
             cart_item_id=updated_item.cart_item_id,
@@ -234,119 +237,160 @@ async def update_cart_item(
     except HTTPException as he:
         raise he
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routercart.delete("/{cart_item_id}", response_model=MessageResponse)
 async def remove_from_cart(
     cart_item_id: int,
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Dict[str, Any] = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """从购物车移除商品"""
     try:
-        result = db.execute(text("""
+        result = (await db.execute(text("""
             DELETE FROM cart_items 
             WHERE cart_item_id = :cart_item_id AND user_id = :user_id
             RETURNING cart_item_id
         """), {
             "cart_item_id": cart_item_id,
             "user_id": current_user[0]
-        }).fetchone()
+        })).fetchone()
         
         if not result:
             raise HTTPException(status_code=404, detail="Cart item not found")
             
-        db.commit()
+        await db.commit()
         return MessageResponse(message="Item removed from cart successfully")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routercart.delete("/", response_model=MessageResponse)
 async def clear_cart(
-    current_user: Dict[str, Any] = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Dict[str, Any] = Depends(get_token_principal),
+    db: AsyncSession = Depends(get_async_db)
 ):
     """清空购物车"""
     try:
-        db.execute(text("""
+        await db.execute(text("""
             DELETE FROM cart_items 
             WHERE user_id = :user_id
         """), {
             "user_id": current_user[0]
         })
-        db.commit()
+        await db.commit()
         return MessageResponse(message="Cart cleared successfully")
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routercart.post("/checkout", response_model=CheckoutResponse)
-async def checkout_cart(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
-    """购物车结算，创建订单"""
+async def checkout_cart(current_user: dict = Depends(get_token_principal), db: AsyncSession = Depends(get_async_db)):
+    """购物车结算，创建订单
+
+    语句数与购物车大小无关：先一次性扣减全部库存，再用多行
+    INSERT ... RETURNING 按店铺创建订单和订单详情并清空购物车，最后计入销售汇总。
+    """
     try:
-        # 获取购物车商品
-        cart_items = db.execute(text("""
-            SELECT ci.*, b.store_id, b.price
-            FROM cart_items ci
-            JOIN books b ON ci.book_isbn = b.isbn
-            WHERE ci.user_id = :user_id
+        cart_isbns = list((await db.execute(
+            text("SELECT DISTINCT book_isbn FROM cart_items WHERE user_id = :user_id"),
+            {"user_id": current_user.id}
+        )).scalars())
+        locked = await lock_books_for_reservation(db, cart_isbns)
+        # 按 ISBN 汇总购物车并扣减库存；库存不足的书不会被更新
+        items = (await db.execute(text("""
+            WITH cart AS (
+                SELECT book_isbn, SUM(quantity) AS quantity
+                FROM cart_items
+                WHERE user_id = :user_id
+                GROUP BY book_isbn
+            ),
+            reserved AS (
+                UPDATE books b
+                SET inventory = b.inventory - c.quantity
+                FROM cart c
+                WHERE b.isbn = c.book_isbn AND b.isbn = ANY(:locked)
+                AND b.inventory >= c.quantity
+                AND b.hot_slots IS NULL
+                RETURNING b.isbn, b.store_id, b.price
+            )
+            SELECT c.book_isbn, c.quantity,
+                   COALESCE(r.store_id, h.store_id) AS store_id,
+                   COALESCE(r.price, h.price) AS price,
+                   r.isbn IS NOT NULL AS reserved,
+                   h.isbn IS NOT NULL AS hot
+            FROM cart c
+            LEFT JOIN reserved r ON r.isbn = c.book_isbn
+            LEFT JOIN books h ON h.isbn = c.book_isbn AND h.hot_slots IS NOT NULL
         """), {
-            "user_id": current_user.id
-        }).fetchall()
+            "user_id": current_user.id,
+            "locked": locked
+        })).fetchall()
         
-        if not cart_items:
+        if not items:
             raise HTTPException(status_code=400, detail="购物车是空的")
 
-        # 按店铺分组
-        store_items = {}
-        for item in cart_items:
-            if item.store_id not in store_items:
-                store_items[item.store_id] = []
-            store_items[item.store_id].append(item)
+        # 热门书籍从库存槽中扣减
+        claimed = await claim_hot_stock(db, {item.book_isbn: item.quantity for item in items if item.hot})
+        failed = [
+            item.book_isbn for item in items
+            if not (item.reserved or item.book_isbn in claimed)
+        ]
+        if failed:
+            await db.rollback()
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient inventory for books: {', '.join(failed)}"
+            )
 
-        # 创建订单
-        order_ids = []
-        for store_id, items in store_items.items():
-            total_price = sum(float(item.price) * item.quantity for item in items)
-            
-            # 创建订单，状态为待付款
-            order = db.execute(text("""
+        # 按店铺创建订单（状态为待付款）和订单详情，并清空购物车
+        orders = (await db.execute(text("""
+            WITH items AS (
+                SELECT *
+                FROM unnest(
+                    CAST(:isbns AS VARCHAR[]),
+                    CAST(:quantities AS INTEGER[]),
+                    CAST(:prices AS NUMERIC[]),
+                    CAST(:store_ids AS INTEGER[])
+                ) AS t(book_isbn, quantity, unit_price, store_id)
+            ),
+            new_orders AS (
                 INSERT INTO orders (user_id, store_id, total_price, status, order_date)
-                VALUES (:user_id, :store_id, :total_price, 'pending', CURRENT_DATE)
-                RETURNING order_id
-            """), {
-                "user_id": current_user.id,
-                "store_id": store_id,
-                "total_price": total_price
-            }).fetchone()
-
-            for item in items:
-                # 创建订单详情
-                db.execute(text("""
-                    INSERT INTO order_details 
-                    (order_id, book_isbn, quantity, unit_price)
-                    VALUES (:order_id, :book_isbn, :quantity, :unit_price)
-                """), {
-                    "order_id": order.order_id,
-                    "book_isbn": item.book_isbn,
-                    "quantity": item.quantity,
-                    "unit_price": float(item.price)
-                })
-
-            order_ids.append(order.order_id)
-
-        # 清空购物车
-        db.execute(text("DELETE FROM cart_items WHERE user_id = :user_id"), {
-            "user_id": current_user.id
-        })
+                SELECT :user_id, store_id, SUM(unit_price * quantity), 'pending', CURRENT_DATE
+                FROM items
+                GROUP BY store_id
+                RETURNING order_id, store_id
+            ),
+            new_details AS (
+                INSERT INTO order_details (order_id, book_isbn, quantity, unit_price, category)
+                SELECT o.order_id, i.book_isbn, i.quantity, i.unit_price, b.category
+                FROM items i
+                JOIN new_orders o ON o.store_id = i.store_id
+                LEFT JOIN books b ON b.isbn = i.book_isbn
+            ),
+            cleared AS (
+                DELETE FROM cart_items WHERE user_id = :user_id
+            )
+            SELECT order_id FROM new_orders ORDER BY order_id
+        """), {
+            "user_id": current_user.id,
+            "isbns": [item.book_isbn for item in items],
+            "quantities": [item.quantity for item in items],
+            "prices": [item.price for item in items],
+            "store_ids": [item.store_id for item in items]
+        })).fetchall()
+        await record_new_orders(db, [order.order_id for order in orders])
         
-        db.commit()
+        await db.commit()
+        book_cache.invalidate_books(item.book_isbn for item in items)
         return CheckoutResponse(
             message="结算成功",
-            order_ids=order_ids
+            order_ids=[order.order_id for order in orders]
         )
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,11 +1,12 @@
 from fastapi import Depends, HTTPException, status  
 from fastapi.security import OAuth2PasswordBearer  
-from sqlalchemy.orm import Session  
+from sqlalchemy.ext.asyncio import AsyncSession  
 from sqlalchemy import text  
 from datetime import datetime, timedelta  
 import jwt  
-from typing import Optional  
-from db import get_db  
+from typing import NamedTuple, Optional  
+from db import get_async_db  
+from core.cache import principal_cache, token_version_cache  
 
 # JWT configuration  
 SECRET_KEY = "your-secret-key"  # Use environment variables in production  
@@ -21,30 +22,94 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode.update({"exp": expire})  
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)  
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):  
-    """Validate token and retrieve the user."""  
-    credentials_exception = HTTPException(  
+def create_user_token(user) -> str:  
+    """Create an access token carrying the user's id, role and token version."""  
+    return create_access_token(data={  
+        "sub": str(user.id),  
+        "role": user.type,  
+        "ver": user.token_version,  
+    })  
+
+class TokenPrincipal(NamedTuple):  
+    """Caller identity taken from verified token claims (index 0 is the id, like a participants row)."""  
+    id: int  
+    type: str  
+    token_version: int  
+
+def credentials_exception() -> HTTPException:  
+    return HTTPException(  
         status_code=status.HTTP_401_UNAUTHORIZED,  
         detail="Could not validate credentials",  
         headers={"WWW-Authenticate": "Bearer"},  
     )  
+
+def decode_access_token(token: str) -> dict:  
+    """Verify the token signature and expiry and return its claims."""  
     try:  
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])  
-        user_id: str = payload.get("sub")  
-        if user_id is None:  
-            raise credentials_exception  
-    except jwt.JWTError:  
-        raise credentials_exception  
-
-    sql = text("SELECT * FROM participants WHERE id = :user_id")  
-    user = db.execute(sql, {"user_id": user_id}).fetchone()  
-    
+        payload["sub"] = int(payload["sub"])  
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):  
+        raise credentials_exception()  
+    return payload  
+
+async def current_token_version(user_id: int, db: AsyncSession) -> int:  
+    """Return the participant's current token version.  
+
+    Cached per worker for TOKEN_VERSION_CACHE_TTL seconds; users.py invalidates  
+    the local entry on change, so a revoked token keeps working on other workers  
+    for at most that long.  
+    """  
+    current_version = token_version_cache.get(user_id)  
+    if current_version is None:  
+        sql = text("SELECT token_version FROM participants WHERE id = :user_id")  
+        row = (await db.execute(sql, {"user_id": user_id})).fetchone()  
+        if row is None:  
+            raise credentials_exception()  
+        current_version = row.token_version  
+        token_version_cache[user_id] = current_version  
+    return current_version  
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):  
+    """Validate token and retrieve the full participant row."""  
+    payload = decode_access_token(token)  
+    user_id = payload["sub"]  
+
+    # Resolved principals are cached per user id; users.py invalidates on change.  
+    # A cached row older than the current token version was changed on another worker.  
+    user = principal_cache.get(user_id)  
+    if user is not None and user.token_version != await current_token_version(user_id, db):  
+        user = None  
     if user is None:  
-        raise credentials_exception  
-        
+        sql = text("SELECT * FROM participants WHERE id = :user_id")  
+        user = (await db.execute(sql, {"user_id": user_id})).fetchone()  
+        if user is None:  
+            raise credentials_exception()  
+        principal_cache[user.id] = user  
+        token_version_cache[user.id] = user.token_version  
+
+    # Tokens issued before a role/password change are revoked by their version.  
+    if "ver" in payload and payload["ver"] != user.token_version:  
+        raise credentials_exception()  
     return user  
 
-async def get_current_admin(current_user = Depends(get_current_user)):  
+async def get_token_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)):  
+    """Validate token and return the caller's id and role from its claims.  
+
+    Only the participant's current token version is needed, and that is cached,  
+    so role checks normally need no database round trip. Tokens without role  
+    claims (issued before they existed) fall back to the full lookup.  
+    """  
+    payload = decode_access_token(token)  
+    if "role" not in payload or "ver" not in payload:  
+        user = await get_current_user(token, db)  
+        return TokenPrincipal(user.id, user.type, user.token_version)  
+
+    user_id = payload["sub"]  
+    if payload["ver"] != await current_token_version(user_id, db):  
+        raise credentials_exception()  
+    return TokenPrincipal(user_id, payload["role"], payload["ver"])  
+
+async def get_current_admin(current_user = Depends(get_token_principal)):  
     """Check if the current user is an administrator."""  
     if current_user.type != "administrator":  
         raise HTTPException(  
@@ -53,7 +118,7 @@ async def get_current_admin(current_user = Depends(get_current_user)):
         )  
     return current_user  
 
-async def get_current_store(current_user = Depends(get_current_user)):  
+async def get_current_store(current_user = Depends(get_token_principal)):  
     """Check if the current user is a store."""  
     if current_user.type != "store":  
         raise HTTPException(  
@@ -62,7 +127,7 @@ async def get_current_store(current_user = Depends(get_current_user)):
         )  
     return current_user  
 
-async def get_current_buyer(current_user = Depends(get_current_user)):  
+async def get_current_buyer(current_user = Depends(get_token_principal)):  
     """Check if the current user is a buyer."""  
     if current_user.type != "buyer":  
         raise HTTPException(  
@@ -71,7 +136,7 @@ async def get_current_buyer(current_user = Depends(get_current_user)):
         )  
     return current_user  
 
-async def verify_user_access(user_id: int, current_user = Depends(get_current_user)):  
+async def verify_user_access(user_id: int, current_user = Depends(get_token_principal)):  
     """Verify if the user has access to the specified user ID's resources."""  
     if current_user.id != user_id and current_user.type != "administrator":  
         raise HTTPException(  
@@ -80,7 +145,7 @@ async def verify_user_access(user_id: int, current_user = Depends(get_current_us
         )  
     return current_user  
 
-async def verify_store_access(store_id: int, current_user = Depends(get_current_user)):  
+async def verify_store_access(store_id: int, current_user = Depends(get_token_principal)):  
     """Verify if the user has access to the specified store's resources."""  
     if current_user.id != store_id and current_user.type != "administrator":  
         raise HTTPException(  
@@ -0,0 +1,157 @@
+# exports.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from typing import Optional
+from datetime import date
+from db import stream_partitions
+from app_design.dependencies.deps import get_token_principal
+
+routerexport = APIRouter()
+
+# 每批从服务端游标读取的行数，也是 Parquet 的行组大小；内存占用只与批大小有关
+EXPORT_BATCH_SIZE = 50000
+
+# 可导出的表：查询列、FROM 子句、店铺列、日期列（用于增量导出）、排序列
+EXPORT_TABLES = {
+    "books": {
+        "columns": "b.isbn, b.book_name, b.authors, b.category, b.inventory, b.price, b.store_id, b.image_url",
+        "from": "books b",
+        "store_column": "b.store_id",
+        "date_column": None,
+        "order_by": "b.isbn",
+    },
+    "orders": {
+        "columns": "o.order_id, o.user_id, o.store_id, o.total_price, o.status, o.order_date",
+        "from": "orders o",
+        "store_column": "o.store_id",
+        "date_column": "o.order_date",
+        "order_by": "o.order_id",
+    },
+    "order_details": {
+        "columns": "od.order_detail_id, od.order_id, od.book_isbn, od.quantity, od.unit_price, od.category",
+        "from": "order_details od JOIN orders o ON o.order_id = od.order_id",
+        "store_column": "o.store_id",
+        "date_column": "o.order_date",
+        "order_by": "od.order_detail_id",
+    },
+}
+
+EXPORT_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+def export_schema(table: str):
+    """各表的 Arrow schema；pyarrow 只在导出时才导入"""
+    import pyarrow as pa
+
+    money = pa.decimal128(10, 2)
+    schemas = {
+        "books": [
+            ("isbn", pa.string()), ("book_name", pa.string()), ("authors", pa.string()),
+            ("category", pa.string()), ("inventory", pa.int32()), ("price", money),
+            ("store_id", pa.int32()), ("image_url", pa.string()),
+        ],
+        "orders": [
+            ("order_id", pa.int32()), ("user_id", pa.int32()), ("store_id", pa.int32()),
+            ("total_price", money), ("status", pa.string()), ("order_date", pa.date32()),
+        ],
+        "order_details": [
+            ("order_detail_id", pa.int32()), ("order_id", pa.int32()), ("book_isbn", pa.string()),
+            ("quantity", pa.int32()), ("unit_price", money), ("category", pa.string()),
+        ],
+    }
+    return pa.schema(schemas[table])
+
+
+class ChunkSink:
+    """收集写入器输出的字节，每写完一批取出发送，不在内存中保留整个文件"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def write_rows(writer, schema, rows):
+    """把一批数据库行按列转换为 RecordBatch 并写入（在线程池中执行）"""
+    import pyarrow as pa
+
+    columns = [
+        pa.array([row[i] for row in rows], type=field.type)
+        for i, field in enumerate(schema)
+    ]
+    writer.write_batch(pa.record_batch(columns, schema=schema))
+
+async def export_stream(table: str, fmt: str, sql: str, params: dict):
+    """通过服务端游标分批读取并逐批编码输出"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = export_schema(table)
+    sink = ChunkSink()
+    output = pa.PythonFile(sink, mode="w")
+    if fmt == "parquet":
+        writer = pq.ParquetWriter(output, schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_stream(output, schema)
+    async for rows in stream_partitions(sql, params, EXPORT_BATCH_SIZE):
+        await run_in_threadpool(write_rows, writer, schema, rows)
+        yield sink.take()
+    await run_in_threadpool(writer.close)
+    yield sink.take()
+
+@routerexport.get("/{table}")
+async def export_table(
+    table: str,
+    format: str = Query("parquet", pattern="^(parquet|arrow)$"),
+    store_id: Optional[int] = None,
+    since: Optional[date] = Query(None, description="只导出该日期及之后的订单（orders/order_details）"),
+    current_user = Depends(get_token_principal)
+):
+    """以 Parquet 或 Arrow IPC 流导出 books/orders/order_details
+
+    管理员可导出全部数据或指定店铺；店铺只能导出自己的数据。
+    """
+    spec = EXPORT_TABLES.get(table)
+    if spec is None:
+        raise HTTPException(status_code=404, detail="Unknown export table")
+    if current_user.type == "store":
+        store_id = current_user.id
+    elif current_user.type != "administrator":
+        raise HTTPException(status_code=403, detail="Only stores and administrators can export data")
+
+    conditions = []
+    params = {}
+    if store_id is not None:
+        conditions.append(f"{spec['store_column']} = :store_id")
+        params["store_id"] = store_id
+    if since is not None:
+        if spec["date_column"] is None:
+            raise HTTPException(status_code=400, detail="since is only supported for orders and order_details")
+        conditions.append(f"{spec['date_column']} >= :since")
+        params["since"] = since
+    where = " AND ".join(conditions) or "TRUE"
+    sql = f"SELECT {spec['columns']} FROM {spec['from']} WHERE {where} ORDER BY {spec['order_by']}"
+
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(
+        export_stream(table, format, sql, params),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{table}.{extension}"'},
+    )
@@ -0,0 +1,241 @@
+# inventory.py
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from core.cache import book_cache
+from db import async_engine
+
+logger = logging.getLogger(__name__)
+
+# 热门模式：把一本书的库存拆到 inventory_slots 的多个槽中，下单时随机扣减一个槽，
+# 并发订单分散在不同的行锁上，不再全部排队等待 books 中同一行的锁。
+# books.hot_slots 为空表示普通模式；热门模式下 books.inventory 是各槽之和，由后台任务定期同步。
+# 所有修改库存的操作（下单、结算、取消、切换模式、整理）都先按 ISBN 顺序锁书籍行，
+# 再按 (isbn, 槽号) 顺序锁槽，彼此之间不会死锁。
+MIN_HOT_SLOTS = 2
+MAX_HOT_SLOTS = 64
+
+# 多个 worker 都会运行后台任务，同一时刻只需要一个执行
+REBALANCE_LOCK_KEY = 727_002
+
+async def lock_books_for_reservation(db: AsyncSession, isbns: List[str], store_id: Optional[int] = None) -> List[str]:
+    """按 ISBN 顺序锁定要扣减库存的普通模式书籍，返回锁定的 ISBN
+
+    多行 UPDATE 按执行计划访问行的顺序加锁，书籍有重叠的并发订单可能互相等待成环；
+    先在这里按顺序加锁，调用方随后的 UPDATE 只扣减返回的书籍，不再等待其他锁。
+    热门书籍不在这里加锁，它们的书籍行只加 KEY SHARE，见 claim_hot_stock。
+    """
+    if not isbns:
+        return []
+    params = {"isbns": sorted(set(isbns))}
+    store_clause = ""
+    if store_id is not None:
+        store_clause = "AND store_id = :store_id"
+        params["store_id"] = store_id
+    return list((await db.execute(text(f"""
+        SELECT isbn FROM books
+        WHERE isbn = ANY(:isbns) AND hot_slots IS NULL {store_clause}
+        ORDER BY isbn
+        FOR NO KEY UPDATE
+    """), params)).scalars())
+
+async def claim_hot_stock(db: AsyncSession, requested: Dict[str, int]) -> Set[str]:
+    """从热门书籍的库存槽中扣减，返回扣减成功的 ISBN
+
+    加锁顺序与其他修改热门库存的操作一致：先锁书籍行，再按 (isbn, 槽号) 顺序锁槽。
+    书籍行只加 FOR KEY SHARE（与写入订单明细时外键检查加的锁相同），只阻止删除书籍，
+    不阻止修改库存或切换模式。
+
+    先在保存点中用一条语句为每本书随机锁定一个库存足够且未被锁定的槽（SKIP LOCKED，不等待）；
+    任何一本书没有这样的槽时回滚到保存点，释放已锁定的槽，再按 ISBN 顺序逐本合并扣减。
+    快速路径从不等待槽锁，合并扣减时所有订单按相同顺序加锁，多本热门书籍的订单之间不会死锁。
+    扣减与订单在同一事务中，订单失败回滚时库存一并恢复。
+    """
+    if not requested:
+        return set()
+    isbns = sorted(requested)
+    await db.execute(text("""
+        SELECT isbn FROM books WHERE isbn = ANY(:isbns)
+        ORDER BY isbn
+        FOR KEY SHARE
+    """), {"isbns": isbns})
+
+    savepoint = await db.begin_nested()
+    claimed = set((await db.execute(text("""
+        WITH requested AS (
+            SELECT * FROM unnest(
+                CAST(:isbns AS VARCHAR[]),
+                CAST(:quantities AS INTEGER[])
+            ) AS t(isbn, quantity)
+        ),
+        picked AS (
+            SELECT r.isbn, r.quantity, p.slot
+            FROM requested r
+            CROSS JOIN LATERAL (
+                SELECT s.slot FROM inventory_slots s
+                WHERE s.isbn = r.isbn AND s.quantity >= r.quantity
+                ORDER BY random()
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ) p
+        )
+        UPDATE inventory_slots s
+        SET quantity = s.quantity - p.quantity
+        FROM picked p
+        WHERE s.isbn = p.isbn AND s.slot = p.slot
+        RETURNING s.isbn
+    """), {
+        "isbns": isbns,
+        "quantities": [requested[isbn] for isbn in isbns]
+    })).scalars())
+    if len(claimed) == len(isbns):
+        await savepoint.commit()
+        return claimed
+
+    await savepoint.rollback()
+    return {isbn for isbn in isbns if await drain_hot_slots(db, isbn, requested[isbn])}
+
+async def drain_hot_slots(db: AsyncSession, isbn: str, quantity: int) -> bool:
+    """按槽号顺序锁定一本书的全部槽，总量足够时从前往后依次扣减"""
+    result = (await db.execute(text("""
+        WITH locked AS (
+            SELECT slot, quantity FROM inventory_slots
+            WHERE isbn = :isbn
+            ORDER BY slot
+            FOR UPDATE
+        ),
+        plan AS (
+            SELECT slot, quantity,
+                   SUM(quantity) OVER (ORDER BY slot) - quantity AS before,
+                   SUM(quantity) OVER () AS total
+            FROM locked
+        ),
+        taken AS (
+            UPDATE inventory_slots s
+            SET quantity = s.quantity - LEAST(p.quantity, :quantity - p.before)
+            FROM plan p
+            WHERE s.isbn = :isbn AND s.slot = p.slot
+            AND p.total >= :quantity AND p.before < :quantity
+            RETURNING s.slot
+        )
+        SELECT COUNT(*) AS slots FROM taken
+    """), {"isbn": isbn, "quantity": quantity})).fetchone()
+    return result.slots > 0
+
+async def set_hot_mode(db: AsyncSession, isbn: str, slots: Optional[int]):
+    """开启（或重新拆分）热门模式，slots 为空时关闭
+
+    先把现有槽中的库存合并回 books.inventory，再按新的槽数平均拆分。
+    返回 (isbn, inventory, hot_slots)，书籍不存在时返回 None；由调用方提交事务。
+    """
+    # 先锁住书籍行再处理槽，同一本书的并发切换排队执行，且后续语句能看到前一次切换的结果；
+    # NO KEY UPDATE 与下单时的 KEY SHARE 不冲突，切换期间下单只会等待各自占用的槽
+    book = (await db.execute(
+        text("SELECT isbn FROM books WHERE isbn = :isbn FOR NO KEY UPDATE"), {"isbn": isbn}
+    )).fetchone()
+    if not book:
+        return None
+    return (await db.execute(text("""
+        WITH folded AS (
+            DELETE FROM inventory_slots WHERE isbn = :isbn
+            RETURNING quantity
+        ),
+        book AS (
+            UPDATE books b
+            SET inventory = CASE WHEN b.hot_slots IS NULL THEN b.inventory
+                                 ELSE (SELECT COALESCE(SUM(quantity), 0) FROM folded) END,
+                hot_slots = :slots
+            WHERE b.isbn = :isbn
+            RETURNING b.isbn, b.inventory, b.hot_slots
+        ),
+        split AS (
+            INSERT INTO inventory_slots (isbn, slot, quantity)
+            SELECT book.isbn, g.slot,
+                   book.inventory / book.hot_slots
+                   + CASE WHEN g.slot < book.inventory % book.hot_slots THEN 1 ELSE 0 END
+            FROM book, generate_series(0, COALESCE(book.hot_slots, 0) - 1) AS g(slot)
+        )
+        SELECT isbn, inventory, hot_slots FROM book
+    """), {"isbn": isbn, "slots": slots})).fetchone()
+
+# 把热门书籍的库存按 books.inventory 重新平均拆分到各槽，用于直接设置库存的写入（修改书籍、批量导入）
+RESPLIT_HOT_STOCK_SQL = """
+    UPDATE inventory_slots s
+    SET quantity = b.inventory / b.hot_slots
+                   + CASE WHEN s.slot < b.inventory % b.hot_slots THEN 1 ELSE 0 END
+    FROM books b
+    WHERE s.isbn = b.isbn AND b.hot_slots IS NOT NULL AND b.isbn = ANY(:isbns)
+"""
+
+async def rebalance_hot_stock(conn) -> list:
+    """把各槽库存相差超过 1 的热门书籍重新平均分配，并把各槽之和写回 books.inventory
+
+    与其他操作一样先锁书籍行再锁槽，且都用 SKIP LOCKED：正在切换模式或修改库存的书籍、
+    正在被订单占用的槽本轮跳过，不阻塞下单；返回 books.inventory 有变化的 ISBN。
+    """
+    got_lock = (await conn.execute(
+        text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": REBALANCE_LOCK_KEY}
+    )).scalar()
+    if not got_lock:
+        return []
+    isbns = list((await conn.execute(text("""
+        SELECT isbn FROM books
+        WHERE hot_slots IS NOT NULL
+        ORDER BY isbn
+        FOR NO KEY UPDATE SKIP LOCKED
+    """))).scalars())
+    if not isbns:
+        return []
+    await conn.execute(text("""
+        WITH locked AS (
+            SELECT isbn, slot, quantity FROM inventory_slots
+            WHERE isbn IN (
+                SELECT isbn FROM inventory_slots
+                WHERE isbn = ANY(:isbns)
+                GROUP BY isbn
+                HAVING MAX(quantity) - MIN(quantity) > 1
+            )
+            ORDER BY isbn, slot
+            FOR UPDATE SKIP LOCKED
+        ),
+        target AS (
+            SELECT isbn, slot,
+                   SUM(quantity) OVER w / COUNT(*) OVER w
+                   + CASE WHEN ROW_NUMBER() OVER (w ORDER BY slot) <= SUM(quantity) OVER w % COUNT(*) OVER w
+                          THEN 1 ELSE 0 END AS quantity
+            FROM locked
+            WINDOW w AS (PARTITION BY isbn)
+        )
+        UPDATE inventory_slots s
+        SET quantity = t.quantity
+        FROM target t
+        WHERE s.isbn = t.isbn AND s.slot = t.slot AND s.quantity <> t.quantity
+    """), {"isbns": isbns})
+    # 只写回上面已锁定的书籍行，这里不会等待锁
+    synced = await conn.execute(text("""
+        UPDATE books b
+        SET inventory = t.total
+        FROM (
+            SELECT isbn, SUM(quantity) AS total FROM inventory_slots
+            WHERE isbn = ANY(:isbns)
+            GROUP BY isbn
+        ) t
+        WHERE b.isbn = t.isbn AND b.inventory <> t.total
+        RETURNING b.isbn
+    """), {"isbns": isbns})
+    return list(synced.scalars())
+
+async def run_hot_stock_rebalancer(interval: float):
+    """后台任务：每隔 interval 秒整理一次热门书籍的库存槽"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with async_engine.begin() as conn:
+                changed = await rebalance_hot_stock(conn)
+            book_cache.invalidate_books(changed)
+        except Exception as e:
+            logger.warning(f"Hot stock rebalance failed: {e}")
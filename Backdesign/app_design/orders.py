@@ -1,14 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
-from typing import Optional, List
+from typing import Optional, List, Dict
 from pydantic import BaseModel
 from decimal import Decimal
 from datetime import date
-from db import get_db
-from app_design.dependencies.deps import get_current_user
+from db import get_async_db
+from app_design.dependencies.deps import get_token_principal
+from app_design.inventory import claim_hot_stock, lock_books_for_reservation
+from app_design.sales import ORDER_STATUSES, record_new_orders, sales_rollup_ctes
+from core.cache import book_cache
+from core.pagination import decode_cursor, set_next_cursor
+from core.serialization import FastJSONRoute
 
-routerbookorders = APIRouter()
+# 返回值均按 Order 字段构造，直接用 orjson 编码，跳过 response_model 的二次校验
+routerbookorders = APIRouter(route_class=FastJSONRoute)
 
 # Pydantic 模型
 class OrderDetailBase(BaseModel):
@@ -43,6 +49,10 @@ class OrderCreate(BaseModel):
 class OrderUpdate(BaseModel):
     status: Optional[str] = None
 
+class BulkCancelRequest(BaseModel):
+    order_ids: Optional[List[int]] = None
+    pending_before: Optional[date] = None  # 取消下单日期早于该日期的待付款订单
+
 class Order(BaseModel):
     order_id: int
     user_id: int
@@ -55,62 +65,183 @@ class Order(BaseModel):
 
     class Config:
         from_attributes = True
+
+def order_cursor_clause(cursor: Optional[str], alias: str):
+    """订单按 (order_date, order_id) 倒序的 keyset 分页条件"""
+    if not cursor:
+        return "", {}
+    values = decode_cursor(cursor)
+    try:
+        params = {
+            "cursor_date": date.fromisoformat(values["order_date"]),
+            "cursor_id": int(values["order_id"]),
+        }
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    clause = f"AND ({alias}.order_date, {alias}.order_id) < (:cursor_date, :cursor_id)"
+    return clause, params
+
+def order_cursor_key(row) -> dict:
+    return {"order_date": row.order_date, "order_id": row.order_id}
+
+async def load_order_details(db: AsyncSession, order_ids: List[int]) -> Dict[int, List[dict]]:
+    """一次查询加载一页订单的全部明细，并按订单号分组"""
+    details = {order_id: [] for order_id in order_ids}
+    if not order_ids:
+        return details
+    result = (await db.execute(text("""
+        SELECT od.*, b.book_name, b.authors, b.image_url
+        FROM order_details od
+        LEFT JOIN books b ON od.book_isbn = b.isbn
+        WHERE od.order_id = ANY(:order_ids)
+        ORDER BY od.order_id, od.order_detail_id
+    """), {"order_ids": list(order_ids)})).fetchall()
+    for detail in result:
+        details[detail.order_id].append({
+            "order_detail_id": detail.order_detail_id,
+            "order_id": detail.order_id,
+            "book_isbn": detail.book_isbn,
+            "quantity": detail.quantity,
+            "unit_price": float(detail.unit_price),
+            "book_name": detail.book_name,
+            "authors": detail.authors,
+            "image_url": detail.image_url
+        })
+    return details
+
+async def cancel_pending_orders(
+    db: AsyncSession,
+    order_ids: Optional[List[int]] = None,
+    user_id: Optional[int] = None,
+    pending_before: Optional[date] = None
+):
+    """取消一批待付款订单：按书汇总归还库存、从销售汇总中扣除后删除订单
+
+    语句数与订单数无关。加锁顺序与下单一致：先锁订单，再按 ISBN 顺序锁书籍行，最后按 ISBN 顺序锁热门书籍的 0 号槽。
+    归还到书籍还是 0 号槽由锁定后书籍行的 hot_slots 决定；切换热门模式同样要锁书籍行，
+    因此两者不会交错，归还的库存不会丢失。
+    返回 (被取消的订单号, 库存有变化的 ISBN)，由调用方提交事务。
+    """
+    conditions = ["status = 'pending'"]
+    params = {}
+    if order_ids is not None:
+        conditions.append("order_id = ANY(:order_ids)")
+        params["order_ids"] = list(order_ids)
+    if user_id is not None:
+        conditions.append("user_id = :user_id")
+        params["user_id"] = user_id
+    if pending_before is not None:
+        conditions.append("order_date < :pending_before")
+        params["pending_before"] = pending_before
+
+    target = list((await db.execute(text(f"""
+        SELECT order_id FROM orders
+        WHERE {" AND ".join(conditions)}
+        ORDER BY order_id
+        FOR UPDATE
+    """), params)).scalars())
+    if not target:
+        return [], []
+
+    restock = (await db.execute(text("""
+        SELECT od.book_isbn, SUM(od.quantity) AS quantity
+        FROM order_details od
+        WHERE od.order_id = ANY(:order_ids)
+        GROUP BY od.book_isbn
+    """), {"order_ids": target})).fetchall()
+    quantities = {row.book_isbn: row.quantity for row in restock}
+
+    # 锁定后读到的是最新提交的 hot_slots
+    books = (await db.execute(text("""
+        SELECT isbn, hot_slots IS NOT NULL AS hot FROM books
+        WHERE isbn = ANY(:isbns)
+        ORDER BY isbn
+        FOR NO KEY UPDATE
+    """), {"isbns": sorted(quantities)})).fetchall()
+    cold = [book.isbn for book in books if not book.hot]
+    hot = [book.isbn for book in books if book.hot]
+
+    if cold:
+        await db.execute(text("""
+            UPDATE books b
+            SET inventory = b.inventory + r.quantity
+            FROM unnest(CAST(:isbns AS VARCHAR[]), CAST(:quantities AS INTEGER[])) AS r(isbn, quantity)
+            WHERE b.isbn = r.isbn
+        """), {"isbns": cold, "quantities": [quantities[isbn] for isbn in cold]})
+    if hot:
+        # 热门书籍归还到 0 号槽，由后台任务重新平均分配
+        await db.execute(text("""
+            SELECT isbn FROM inventory_slots
+            WHERE isbn = ANY(:isbns) AND slot = 0
+            ORDER BY isbn
+            FOR UPDATE
+        """), {"isbns": hot})
+        await db.execute(text("""
+            UPDATE inventory_slots s
+            SET quantity = s.quantity + r.quantity
+            FROM unnest(CAST(:isbns AS VARCHAR[]), CAST(:quantities AS INTEGER[])) AS r(isbn, quantity)
+            WHERE s.isbn = r.isbn AND s.slot = 0
+        """), {"isbns": hot, "quantities": [quantities[isbn] for isbn in hot]})
+
+    result = (await db.execute(text(f"""
+        WITH cancelled AS (
+            SELECT order_id, 'pending' AS status, -1 AS sign FROM orders
+            WHERE order_id = ANY(:order_ids)
+        ),
+        {sales_rollup_ctes("cancelled")},
+        deleted AS (
+            DELETE FROM orders o
+            WHERE o.order_id = ANY(:order_ids)
+            RETURNING o.order_id
+        )
+        SELECT array_agg(order_id ORDER BY order_id) AS order_ids FROM deleted
+    """), {"order_ids": target})).fetchone()
+    return result.order_ids or [], cold + hot
+
+async def assemble_orders(db: AsyncSession, order_rows, model=Order) -> List[dict]:
+    """把订单行和批量加载的明细组装成订单数据
+
+    只保留 model 中的字段（查询里多出的列不会输出），路由器跳过了 response_model 校验，
+    因此这里构造的数据就是最终响应。
+    """
+    fields = [name for name in model.model_fields if name != "details"]
+    details = await load_order_details(db, [row.order_id for row in order_rows])
+    orders = []
+    for row in order_rows:
+        mapping = row._mapping
+        order_data = {name: mapping.get(name) for name in fields}
+        order_data["total_price"] = float(order_data["total_price"])
+        order_data["details"] = details[row.order_id]
+        orders.append(order_data)
+    return orders
+
 @routerbookorders.get("/my-orders", response_model=List[Order])
 async def get_my_orders(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
+    # 传入 cursor 时使用 keyset 分页，忽略 skip
+    cursor_clause, cursor_params = order_cursor_clause(cursor, "orders")
     try:
-        orders_result = db.execute(text("""
+        orders_result = (await db.execute(text(f"""
             SELECT * FROM orders 
             WHERE user_id = :user_id 
-            ORDER BY order_date DESC
+            {cursor_clause}
+            ORDER BY order_date DESC, order_id DESC
             OFFSET :skip LIMIT :limit
         """), {
             "user_id": current_user.id,
-            "skip": skip,
-            "limit": limit
-        }).fetchall()
-
-        orders = []
-        for row in orders_result:
-            # 直接使用属性访问
-            order_data = {
-    "order_id": row[0],  # Access by index
-    "user_id": row[1],
-    "store_id": row[2],
-    "total_price": float(row[3]),
-    "status": row[4],
-    "order_date": row[5],
-    "details": []
-}
-
-
-            details_result = db.execute(text("""
-                SELECT od.*, b.book_name, b.authors 
-                FROM order_details od
-                LEFT JOIN books b ON od.book_isbn = b.isbn
-                WHERE od.order_id = :order_id
-            """), {"order_id": order_data["order_id"]}).fetchall()
-
-            for detail in details_result:
-               detail_data = {
-    "order_detail_id": detail[0],  # Access by index
-    "order_id": detail[1],
-    "book_isbn": detail[2],
-    "quantity": detail[3],
-    "unit_price": float(detail[4]),
-    "book_name": detail[5],
-    "authors": detail[6]
-    }
-
-            order_data["details"].append(OrderDetail(**detail_data))
-
-            orders.append(Order(**order_data))
-
-        return orders
+            "skip": 0 if cursor else skip,
+            "limit": limit,
+            **cursor_params
+        })).fetchall()
+        set_next_cursor(response, orders_result, limit, order_cursor_key)
+
+        return await assemble_orders(db, orders_result)
 
     except Exception as e:
         print(f"Error in get_my_orders: {str(e)}")
@@ -118,48 +249,109 @@ async def get_my_orders(
 @routerbookorders.post("/", response_model=Order)
 async def create_order(
     order: OrderCreate,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
+    """创建订单
+
+    所有商品的库存校验和扣减在一条带 inventory >= 数量 条件的 UPDATE 中完成，
+    并发下单不会超卖；任何一本书不满足条件时整单回滚并返回失败的 ISBN。
+    开启热门模式的书籍从库存槽中扣减，见 claim_hot_stock。
+    """
     try:
-        total_price = Decimal('0.0')
-        for item in order.items:
-            book = db.execute(text("""
-                SELECT price, inventory FROM books 
-                WHERE isbn = :isbn AND store_id = :store_id
-            """), {
-                "isbn": item.book_isbn,
-                "store_id": order.store_id
-            }).fetchone()
-            
-            if not book:
-                raise HTTPException(status_code=404, detail=f"Book {item.book_isbn} not found")
-            
-            if book.inventory < item.quantity:
-                raise HTTPException(status_code=400, detail=f"Insufficient inventory for book {item.book_isbn}")
-            
-            total_price += Decimal(str(book.price)) * item.quantity
-
-            # 更新库存
-            db.execute(text("""
-                UPDATE books 
-                SET inventory = inventory - :quantity 
-                WHERE isbn = :isbn
-            """), {
-                "quantity": item.quantity,
-                "isbn": item.book_isbn
-            })
-
-        order_result = db.execute(text("""
-            INSERT INTO orders (user_id, store_id, total_price, status, order_date)
-            VALUES (:user_id, :store_id, :total_price, 'pending', CURRENT_DATE)
-            RETURNING *
+        isbns = [item.book_isbn for item in order.items]
+        locked = await lock_books_for_reservation(db, isbns, order.store_id)
+        reserved = (await db.execute(text("""
+            WITH requested AS (
+                SELECT book_isbn, SUM(quantity) AS quantity
+                FROM unnest(
+                    CAST(:isbns AS VARCHAR[]),
+                    CAST(:quantities AS INTEGER[])
+                ) AS t(book_isbn, quantity)
+                GROUP BY book_isbn
+            ),
+            updated AS (
+                UPDATE books b
+                SET inventory = b.inventory - r.quantity
+                FROM requested r
+                WHERE b.isbn = r.book_isbn
+                AND b.isbn = ANY(:locked)
+                AND b.store_id = :store_id
+                AND b.inventory >= r.quantity
+                AND b.hot_slots IS NULL
+                RETURNING b.isbn, b.price
+            )
+            SELECT r.book_isbn, r.quantity, COALESCE(u.price, h.price) AS price,
+                   u.isbn IS NOT NULL AS reserved,
+                   h.isbn IS NOT NULL AS hot,
+                   EXISTS (
+                       SELECT 1 FROM books b
+                       WHERE b.isbn = r.book_isbn AND b.store_id = :store_id
+                   ) AS found
+            FROM requested r
+            LEFT JOIN updated u ON u.isbn = r.book_isbn
+            LEFT JOIN books h ON h.isbn = r.book_isbn AND h.store_id = :store_id AND h.hot_slots IS NOT NULL
         """), {
-            "user_id": current_user.id,
+            "isbns": isbns,
+            "quantities": [item.quantity for item in order.items],
             "store_id": order.store_id,
-            "total_price": total_price
-        }).fetchone()
+            "locked": locked
+        })).fetchall()
+
+        not_found = [row.book_isbn for row in reserved if not row.found]
+        if not_found:
+            raise HTTPException(status_code=404, detail=f"Books not found: {', '.join(not_found)}")
+
+        # 热门书籍不在上面的 UPDATE 中扣减，改为从库存槽中扣减
+        claimed = await claim_hot_stock(db, {row.book_isbn: row.quantity for row in reserved if row.hot})
+        insufficient = [
+            row.book_isbn for row in reserved
+            if not (row.reserved or row.book_isbn in claimed)
+        ]
+        if insufficient:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Insufficient inventory for books: {', '.join(insufficient)}"
+            )
 
+        total_price = sum((row.price * row.quantity for row in reserved), Decimal('0.0'))
+
+        # 一条语句写入订单和全部订单详情；单价取扣减库存时读到的书籍价格，与订单总价一致，
+        # 不使用客户端提交的 unit_price
+        rows = (await db.execute(text("""
+            WITH new_order AS (
+                INSERT INTO orders (user_id, store_id, total_price, status, order_date)
+                VALUES (:user_id, :store_id, :total_price, 'pending', CURRENT_DATE)
+                RETURNING *
+            ),
+            new_details AS (
+                INSERT INTO order_details (order_id, book_isbn, quantity, unit_price, category)
+                SELECT o.order_id, t.book_isbn, t.quantity, t.unit_price, b.category
+                FROM new_order o
+                CROSS JOIN unnest(
+                    CAST(:isbns AS VARCHAR[]),
+                    CAST(:quantities AS INTEGER[]),
+                    CAST(:unit_prices AS NUMERIC[])
+                ) AS t(book_isbn, quantity, unit_price)
+                LEFT JOIN books b ON b.isbn = t.book_isbn
+                RETURNING order_detail_id, book_isbn, quantity, unit_price
+            )
+            SELECT o.*,
+                   d.order_detail_id, d.book_isbn, d.quantity, d.unit_price
+            FROM new_order o
+            LEFT JOIN new_details d ON TRUE
+            ORDER BY d.order_detail_id
+        """), {
+            "user_id": current_user.id,
+            "store_id": order.store_id,
+            "total_price": total_price,
+            "isbns": [row.book_isbn for row in reserved],
+            "quantities": [row.quantity for row in reserved],
+            "unit_prices": [row.price for row in reserved]
+        })).fetchall()
+
+        order_result = rows[0]
+        await record_new_orders(db, [order_result.order_id])
         order_data = Order(
             order_id=order_result.order_id,
             user_id=order_result.user_id,
@@ -167,92 +359,58 @@ async def create_order(
             total_price=float(order_result.total_price),
             status=order_result.status,
             order_date=order_result.order_date,
-            details=[]
+            details=[
+                OrderDetail(
+                    order_detail_id=row.order_detail_id,
+                    order_id=row.order_id,
+                    book_isbn=row.book_isbn,
+                    quantity=row.quantity,
+                    unit_price=float(row.unit_price)
+                )
+                for row in rows
+                if row.order_detail_id is not None
+            ]
         )
 
-        for item in order.items:
-            detail_result = db.execute(text("""
-                INSERT INTO order_details (order_id, book_isbn, quantity, unit_price)
-                VALUES (:order_id, :book_isbn, :quantity, :unit_price)
-                RETURNING *
-            """), {
-                "order_id": order_data.order_id,
-                "book_isbn": item.book_isbn,
-                "quantity": item.quantity,
-                "unit_price": float(item.unit_price)
-            }).fetchone()
-            
-            detail_data = OrderDetail(
-                order_detail_id=detail_result.order_detail_id,
-                order_id=detail_result.order_id,
-                book_isbn=detail_result.book_isbn,
-                quantity=detail_result.quantity,
-                unit_price=float(detail_result.unit_price)
-            )
-            order_data.details.append(detail_data)
-
-        db.commit()
+        await db.commit()
+        book_cache.invalidate_books(item.book_isbn for item in order.items)
         return order_data
 
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 @routerbookorders.get("/store-orders", response_model=List[Order])
 async def get_store_orders(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
+    # 传入 cursor 时使用 keyset 分页，忽略 skip
+    cursor_clause, cursor_params = order_cursor_clause(cursor, "o")
     try:
-        orders_result = db.execute(text("""
-            SELECT o.*, p.name as buyer_name
+        orders_result = (await db.execute(text(f"""
+            SELECT o.*, p.name as buyer_name, p.name as store_name  -- 店铺订单列表中 store_name 显示买家名
             FROM orders o
             JOIN participants p ON o.user_id = p.id
             WHERE o.store_id = :user_id 
-            ORDER BY order_date DESC
+            {cursor_clause}
+            ORDER BY o.order_date DESC, o.order_id DESC
             OFFSET :skip LIMIT :limit
         """), {
             "user_id": current_user.id,
-            "skip": skip,
-            "limit": limit
-        }).fetchall()
-
-        orders = []
-        for row in orders_result:
-            order_data = Order(
-                order_id=row.order_id,
-                user_id=row.user_id,
-                store_id=row.store_id,
-                total_price=float(row.total_price),
-                status=row.status,
-                order_date=row.order_date,
-                store_name=row.buyer_name,
-                details=[]
-            )
-
-            details_result = db.execute(text("""
-                SELECT od.*, b.book_name, b.authors 
-                FROM order_details od
-                LEFT JOIN books b ON od.book_isbn = b.isbn
-                WHERE od.order_id = :order_id
-            """), {"order_id": order_data.order_id}).fetchall()
-
-            for detail in details_result:
-                detail_data = OrderDetail(
-                    order_detail_id=detail.order_detail_id,
-                    order_id=detail.order_id,
-                    book_isbn=detail.book_isbn,
-                    quantity=detail.quantity,
-                    unit_price=float(detail.unit_price),
-                    book_name=detail.book_name,
-                    authors=detail.authors
-                )
-                order_data.details.append(detail_data)
-
-            orders.append(order_data)
+            "skip": 0 if cursor else skip,
+            "limit": limit,
+            **cursor_params
+        })).fetchall()
+        set_next_cursor(response, orders_result, limit, order_cursor_key)
 
-        return orders
+        return await assemble_orders(db, orders_result)
 
     except Exception as e:
         print(f"Error in get_store_orders: {str(e)}")
@@ -262,125 +420,115 @@ async def get_store_orders(
 async def update_order_status(
     order_id: int,
     order_update: OrderUpdate,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
+    """店铺更新自己订单的状态，并把订单在销售汇总中从旧状态移到新状态
+
+    订单首次离开待付款状态时分配 confirmed_seq，此后才计入热度排行。
+    """
     try:
         if current_user.type != "store":
             raise HTTPException(status_code=403, detail="Only stores can update order status")
+        if order_update.status not in ORDER_STATUSES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"status must be one of: {', '.join(ORDER_STATUSES)}"
+            )
+
+        changed = (await db.execute(text(f"""
+            WITH target AS (
+                SELECT order_id, status FROM orders
+                WHERE order_id = :order_id AND store_id = :store_id
+                FOR UPDATE
+            ),
+            updated AS (
+                UPDATE orders o
+                SET status = :status,
+                    confirmed_seq = COALESCE(
+                        o.confirmed_seq,
+                        CASE WHEN :status <> 'pending' THEN nextval('orders_confirmed_seq') END
+                    )
+                FROM target t
+                WHERE o.order_id = t.order_id AND t.status <> :status
+                RETURNING o.order_id
+            ),
+            moved AS (
+                SELECT t.order_id, t.status, -1 AS sign FROM target t JOIN updated u USING (order_id)
+                UNION ALL
+                SELECT order_id, CAST(:status AS VARCHAR), 1 FROM updated
+            ),
+            {sales_rollup_ctes("moved")}
+            SELECT order_id FROM target
+        """), {
+            "order_id": order_id,
+            "store_id": current_user.id,
+            "status": order_update.status
+        })).fetchone()
 
-        updated  = db.execute(text("""
+        if not changed:
+            raise HTTPException(status_code=404, detail="Order not found")
+
+        updated  = (await db.execute(text("""
             SELECT o.*, b.address as shipping_address, s.address as store_address
             FROM orders o
             JOIN participants b ON o.user_id = b.id
             JOIN participants s ON o.store_id = s.id
             WHERE o.order_id = :order_id
-        """), {"order_id": order_id}).fetchone()
+        """), {"order_id": order_id})).fetchone()
 
-        if not updated:
-            raise HTTPException(status_code=404, detail="Order not found")
+        order_data = (await assemble_orders(db, [updated]))[0]
 
-        order_data = Order(
-            order_id=updated.order_id,
-            user_id=updated.user_id,
-            store_id=updated.store_id,
-            total_price=float(updated.total_price),
-            status=updated.status,
-            order_date=updated.order_date,
-            details=[]
-        )
-
-        details_result = db.execute(text("""
-            SELECT od.*, b.book_name, b.authors
-            FROM order_details od
-            JOIN books b ON od.book_isbn = b.isbn
-            WHERE od.order_id = :order_id
-        """), {"order_id": order_id}).fetchall()
-
-        for detail in details_result:
-            detail_data = OrderDetail(
-                order_detail_id=detail.order_detail_id,
-                order_id=detail.order_id,
-                book_isbn=detail.book_isbn,
-                quantity=detail.quantity,
-                unit_price=float(detail.unit_price),
-                book_name=detail.book_name,
-                authors=detail.authors
-            )
-            order_data.details.append(detail_data)
-
-        db.commit()
+        await db.commit()
         return order_data
 
+    except HTTPException:
+        await db.rollback()
+        raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routerbookorders.delete("/{order_id}")
 async def cancel_order(
     order_id: int,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
     try:
-        order = db.execute(text("""
-            SELECT * FROM orders 
-            WHERE order_id = :order_id 
-            AND user_id = :user_id 
-            AND status = 'pending'
-        """), {
-            "order_id": order_id,
-            "user_id": current_user.id
-        }).fetchone()
+        cancelled, isbns = await cancel_pending_orders(
+            db, order_ids=[order_id], user_id=current_user.id
+        )
 
-        if not order:
+        if not cancelled:
             raise HTTPException(
                 status_code=404,
                 detail="Order not found or cannot be cancelled"
             )
 
-        details = db.execute(text("""
-            SELECT * FROM order_details 
-            WHERE order_id = :order_id
-        """), {
-            "order_id": order_id
-        }).fetchall()
-
-        for detail in details:
-            db.execute(text("""
-                UPDATE books 
-                SET inventory = inventory + :quantity 
-                WHERE isbn = :isbn
-            """), {
-                "quantity": detail.quantity,
-                "isbn": detail.book_isbn
-            })
-
-        db.execute(text("""
-            DELETE FROM orders 
-            WHERE order_id = :order_id
-        """), {
-            "order_id": order_id
-        })
-
-        db.commit()
+        await db.commit()
+        book_cache.invalidate_books(isbns)
         return {"message": "Order cancelled successfully"}
 
+    except HTTPException:
+        await db.rollback()
+        raise
+
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 from app_design.dependencies.deps  import get_current_admin
 # 修改获取单个订单详情的查询
 @routerbookorders.get("/{order_id}", response_model=Order)
 async def get_order(
     order_id: int,
-    db: Session = Depends(get_db),
-    current_user: dict = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+    current_user: dict = Depends(get_token_principal)
 ):
     """获取订单详情"""
     try:
         # 先查询订单基本信息
-        order_result = db.execute(text("""
+        order_result = (await db.execute(text("""
             SELECT o.*,
                    b.name as buyer_name,
                    b.address as shipping_address,
@@ -392,7 +540,7 @@ async def get_order(
             WHERE o.order_id = :order_id
         """), {
             "order_id": order_id
-        }).fetchone()
+        })).fetchone()
 
         if not order_result:
             raise HTTPException(
@@ -409,46 +557,8 @@ async def get_order(
                 detail="Not authorized to access this order"
             )
 
-        # 查询订单详情
-        details_result = db.execute(text("""
-            SELECT od.*, 
-                   b.book_name,
-                   b.authors,
-                   b.image_url
-            FROM order_details od
-            JOIN books b ON od.book_isbn = b.isbn
-            WHERE od.order_id = :order_id
-        """), {
-            "order_id": order_id
-        }).fetchall()
-
         # 构建返回数据
-        order_data = {
-            "order_id": order_result.order_id,
-            "user_id": order_result.user_id,
-            "store_id": order_result.store_id,
-            "buyer_name": order_result.buyer_name,
-            "shipping_address": order_result.shipping_address,
-            "store_name": order_result.store_name,
-            "store_address": order_result.store_address,
-            "total_price": float(order_result.total_price),
-            "status": order_result.status,
-            "order_date": order_result.order_date,
-            "details": []
-        }
-
-        for detail in details_result:
-            detail_data = {
-                "order_detail_id": detail.order_detail_id,
-                "order_id": detail.order_id,
-                "book_isbn": detail.book_isbn,
-                "quantity": detail.quantity,
-                "unit_price": float(detail.unit_price),
-                "book_name": detail.book_name,
-                "authors": detail.authors,
-                "image_url": detail.image_url
-            }
-            order_data["details"].append(detail_data)
+        order_data = (await assemble_orders(db, [order_result]))[0]
 
         # 打印调试信息
         print(f"Order data: {order_data}")
@@ -463,7 +573,7 @@ async def get_order(
             detail=str(e)
         )
 # 在 orders.py 中修改获取订单列表的查询
-class Order(BaseModel):
+class AdminOrder(BaseModel):
     order_id: int
     user_id: int
     store_id: int
@@ -478,16 +588,20 @@ class Order(BaseModel):
 
     class Config:
         from_attributes = True
-@routerbookorders.get("/", response_model=List[Order])
+@routerbookorders.get("/", response_model=List[AdminOrder])
 async def get_all_orders(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_admin: dict = Depends(get_current_admin)  # 确保只有管理员可以访问
 ):
     """获取所有订单"""
+    # 传入 cursor 时使用 keyset 分页，忽略 skip
+    cursor_clause, cursor_params = order_cursor_clause(cursor, "o")
     try:
-        orders_result = db.execute(text("""
+        orders_result = (await db.execute(text(f"""
             SELECT o.*,
                    b.name as buyer_name,
                    b.address as shipping_address,
@@ -496,53 +610,40 @@ async def get_all_orders(
             FROM orders o
             JOIN participants b ON o.user_id = b.id
             JOIN participants s ON o.store_id = s.id
-            ORDER BY o.order_date DESC
+            WHERE 1=1
+            {cursor_clause}
+            ORDER BY o.order_date DESC, o.order_id DESC
             OFFSET :skip LIMIT :limit
         """), {
-            "skip": skip,
-            "limit": limit
-        }).fetchall()
-
-        orders = []
-        for order in orders_result:
-            # 获取订单详情
-            details = db.execute(text("""
-                SELECT od.*, b.book_name, b.authors, b.image_url
-                FROM order_details od
-                JOIN books b ON od.book_isbn = b.isbn
-                WHERE od.order_id = :order_id
-            """), {"order_id": order.order_id}).fetchall()
-
-            order_details = []
-            for detail in details:
-                detail_data = {
-                    "order_detail_id": detail.order_detail_id,
-                    "order_id": detail.order_id,
-                    "book_isbn": detail.book_isbn,
-                    "quantity": detail.quantity,
-                    "unit_price": float(detail.unit_price),
-                    "book_name": detail.book_name,
-                    "authors": detail.authors,
-                    "image_url": detail.image_url
-                }
-                order_details.append(detail_data)
-
-            order_data = {
-                "order_id": order.order_id,
-                "user_id": order.user_id,
-                "store_id": order.store_id,
-                "buyer_name": order.buyer_name,
-                "shipping_address": order.shipping_address,
-                "store_name": order.store_name,
-                "store_address": order.store_address,
-                "total_price": float(order.total_price),
-                "status": order.status,
-                "order_date": order.order_date,
-                "details": order_details
-            }
-            orders.append(order_data)
-
-        return orders
+            "skip": 0 if cursor else skip,
+            "limit": limit,
+            **cursor_params
+        })).fetchall()
+        set_next_cursor(response, orders_result, limit, order_cursor_key)
+
+        return await assemble_orders(db, orders_result, AdminOrder)
     except Exception as e:
         print(f"Error in get_all_orders: {str(e)}")  # 添加日志
         raise HTTPException(status_code=500, detail=str(e))
+@routerbookorders.post("/cancel")
+async def bulk_cancel_orders(
+    request: BulkCancelRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_admin: dict = Depends(get_current_admin)
+):
+    """批量取消待付款订单（管理员用，也用于超时未付款订单的清理）"""
+    if request.order_ids is None and request.pending_before is None:
+        raise HTTPException(status_code=400, detail="order_ids or pending_before is required")
+    try:
+        cancelled, isbns = await cancel_pending_orders(
+            db, order_ids=request.order_ids, pending_before=request.pending_before
+        )
+        await db.commit()
+        book_cache.invalidate_books(isbns)
+        return {
+            "message": f"{len(cancelled)} orders cancelled",
+            "order_ids": cancelled
+        }
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,249 @@
+# recommendations.py
+import asyncio
+import csv
+import io
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from starlette.concurrency import run_in_threadpool
+
+from db import async_engine
+
+logger = logging.getLogger(__name__)
+
+# 每本书保留的相似书籍数
+TOP_NEIGHBOURS = 20
+# 至少被这么多个订单同时购买才算相关，过滤偶然的组合
+MIN_CO_PURCHASES = 2
+# 单个订单的书籍种数超过该值时不参与计算：k 种书产生 k^2 个组合，批量采购会淹没真实的关联
+MAX_ORDER_TITLES = 50
+# 读取订单明细时每组包含的订单号范围，每组作为两个整数数组返回
+LOAD_ORDER_BUCKET = 100000
+
+# 多个 worker 中同一时刻只有一个执行重建
+REBUILD_LOCK_KEY = 727_004
+
+
+def co_purchase_neighbours(order_codes, item_codes, n_items: int, top_n: int, min_support: int):
+    """由 (订单, 书籍) 编号对计算每本书的前 top_n 个共同购买书籍（在线程池中执行）
+
+    A 为订单 x 书籍的 0/1 稀疏矩阵，C = A^T A 的 (i, j) 是同时购买 i 和 j 的订单数，
+    对角线是购买 i 的订单数。相似度取余弦 C_ij / sqrt(C_ii * C_jj)，降低畅销书对所有书籍的影响。
+    返回 (书籍编号, 相似书籍编号, 相似度) 三个数组，按书籍编号、相似度从高到低排列。
+    """
+    import numpy as np
+    import scipy.sparse as sp
+
+    _, orders = np.unique(order_codes, return_inverse=True)
+    n_orders = int(orders.max()) + 1 if len(orders) else 0
+    a = sp.csr_matrix(
+        (np.ones(len(orders), dtype=np.float32), (orders, item_codes)),
+        shape=(n_orders, n_items)
+    )
+    a.sum_duplicates()
+    a.data[:] = 1  # 同一订单中重复的书只算一次
+    titles = np.diff(a.indptr)
+    if (titles > MAX_ORDER_TITLES).any():
+        a = a[titles <= MAX_ORDER_TITLES]
+
+    c = (a.T @ a).tocoo()
+    counts = np.asarray(a.sum(axis=0)).ravel()
+    keep = (c.row != c.col) & (c.data >= min_support)
+    rows, cols, co = c.row[keep], c.col[keep], c.data[keep]
+    scores = co / np.sqrt(counts[rows] * counts[cols])
+
+    # 按 (书籍, 相似度降序, 共同购买次数降序) 排序后，每本书取前 top_n 个
+    order = np.lexsort((-co, -scores, rows))
+    rows, cols, scores = rows[order], cols[order], scores[order]
+    starts = np.searchsorted(rows, rows, side="left")
+    within = np.arange(len(rows)) - starts
+    keep = within < top_n
+    return rows[keep], cols[keep], scores[keep].astype(np.float32)
+
+
+def recommendation_rows_csv(rows, cols, scores, isbns: List[str]) -> bytes:
+    """把 co_purchase_neighbours 的结果编码为 book_recommendations 的 CSV 行（在线程池中执行）
+
+    结果按书籍编号排列，同一本书的相似书籍连续，排名为在该书中的序号（从 1 开始）。
+    """
+    import numpy as np
+
+    starts = np.searchsorted(rows, rows, side="left")
+    ranks = np.arange(len(rows)) - starts + 1
+    names = np.array(isbns, dtype=object)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(zip(names[rows], ranks.tolist(), names[cols], scores.tolist()))
+    return buffer.getvalue().encode()
+
+
+def build_index_arrays(isbns: List[str], recommended: List[str], scores: List[float], built_at: Optional[float]):
+    """由按 (isbn, rank) 排序的相似书籍行构造 RecommendationIndex（在线程池中执行）"""
+    import numpy as np
+
+    codes: Dict[str, int] = {}
+    sources = np.fromiter((codes.setdefault(isbn, len(codes)) for isbn in isbns), dtype=np.int32, count=len(isbns))
+    neighbours = np.fromiter(
+        (codes.setdefault(isbn, len(codes)) for isbn in recommended), dtype=np.int32, count=len(recommended)
+    )
+    # 结果按 isbn 排序，相同 isbn 的行连续；offsets[i]..offsets[i+1] 是第 i 本书的相似书籍
+    offsets = np.zeros(len(codes) + 1, dtype=np.int64)
+    np.add.at(offsets, sources + 1, 1)
+    np.cumsum(offsets, out=offsets)
+    return RecommendationIndex(list(codes), offsets, neighbours, np.asarray(scores, dtype=np.float32), built_at)
+
+
+class RecommendationIndex:
+    """内存中的相似书籍表：每本书的相似书籍按行连续存放在 numpy 数组中"""
+
+    def __init__(self, isbns: List[str], offsets, neighbours, scores, built_at: Optional[float]):
+        self.isbns = isbns
+        self.positions = {isbn: i for i, isbn in enumerate(isbns)}
+        self.offsets = offsets
+        self.neighbours = neighbours
+        self.scores = scores
+        self.built_at = built_at
+
+    @classmethod
+    def empty(cls) -> "RecommendationIndex":
+        return cls([], None, None, None, None)
+
+    def lookup(self, isbn: str, limit: int) -> List[Tuple[str, float]]:
+        position = self.positions.get(isbn)
+        if position is None or self.offsets is None:
+            return []
+        start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+        end = min(end, start + limit)
+        return [
+            (self.isbns[j], float(score))
+            for j, score in zip(self.neighbours[start:end], self.scores[start:end])
+        ]
+
+
+recommendation_index = RecommendationIndex.empty()
+
+async def load_order_lines():
+    """读取全部 (订单号, 书籍编号)，书籍编号为 ISBN 排序后的序号，返回 (订单号数组, 书籍编号数组, ISBN 列表)
+
+    编号在数据库中完成，并按订单号分组聚合成整数数组传输，避免逐行构造 Python 对象；
+    两条查询在同一个 REPEATABLE READ 快照中执行，编号和 ISBN 列表一致。
+    """
+    import numpy as np
+
+    order_parts, item_parts = [], []
+    async with async_engine.connect() as conn:
+        await conn.execution_options(isolation_level="REPEATABLE READ")
+        isbns = list((await conn.execute(text("SELECT isbn FROM books ORDER BY isbn"))).scalars())
+        result = await conn.stream(text("""
+            WITH codes AS (
+                SELECT isbn, (row_number() OVER (ORDER BY isbn) - 1)::int AS code FROM books
+            )
+            SELECT array_agg(od.order_id) AS orders, array_agg(c.code) AS items
+            FROM order_details od
+            JOIN codes c ON c.isbn = od.book_isbn
+            GROUP BY od.order_id / :bucket
+        """), {"bucket": LOAD_ORDER_BUCKET})
+        async for row in result:
+            order_parts.append(np.array(row.orders, dtype=np.int64))
+            item_parts.append(np.array(row.items, dtype=np.int32))
+    if not order_parts:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), isbns
+    return np.concatenate(order_parts), np.concatenate(item_parts), isbns
+
+async def build_recommendations() -> Optional[dict]:
+    """重建 book_recommendations 表；其他 worker 或进程正在重建时返回 None"""
+    started = time.perf_counter()
+    async with async_engine.connect() as lock_conn:
+        # 会话级锁：读取和计算期间不占用事务，只有最后替换结果时才开启短事务
+        got_lock = (await lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": REBUILD_LOCK_KEY}
+        )).scalar()
+        await lock_conn.commit()
+        if not got_lock:
+            return None
+        try:
+            order_codes, item_codes, isbns = await load_order_lines()
+            rows, cols, scores = await run_in_threadpool(
+                co_purchase_neighbours, order_codes, item_codes, len(isbns), TOP_NEIGHBOURS, MIN_CO_PURCHASES
+            )
+            # 逐行编码在线程池中完成，事件循环只负责把结果发送给 COPY
+            payload = await run_in_threadpool(recommendation_rows_csv, rows, cols, scores, isbns)
+
+            # 在同一事务中替换整张表，读取方要么看到旧结果，要么看到新结果
+            async with async_engine.begin() as conn:
+                await conn.execute(text("DELETE FROM book_recommendations"))
+                copy_connection = (await conn.get_raw_connection()).driver_connection
+                await copy_connection.copy_to_table(
+                    "book_recommendations", source=io.BytesIO(payload), format="csv",
+                    columns=("isbn", "rank", "recommended_isbn", "score")
+                )
+                await conn.execute(text("""
+                    INSERT INTO recommendation_builds (id, built_at, order_lines, pairs)
+                    VALUES (1, now(), :order_lines, :pairs)
+                    ON CONFLICT (id) DO UPDATE SET
+                        built_at = EXCLUDED.built_at,
+                        order_lines = EXCLUDED.order_lines,
+                        pairs = EXCLUDED.pairs
+                """), {"order_lines": len(order_codes), "pairs": len(rows)})
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": REBUILD_LOCK_KEY})
+            await lock_conn.commit()
+    stats = {
+        "order_lines": len(order_codes),
+        "books": len(isbns),
+        "pairs": len(rows),
+        "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    logger.info(f"Rebuilt book recommendations: {stats}")
+    return stats
+
+async def get_built_at(conn) -> Optional[float]:
+    return (await conn.execute(
+        text("SELECT extract(epoch FROM built_at) FROM recommendation_builds WHERE id = 1")
+    )).scalar()
+
+async def load_recommendation_index() -> RecommendationIndex:
+    """把 book_recommendations 表读入内存
+
+    三列各聚合为一个数组在一行中返回，避免逐行构造 Python 对象；编号和构造数组在线程池中执行。
+    """
+    async with async_engine.connect() as conn:
+        built_at = await get_built_at(conn)
+        row = (await conn.execute(text("""
+            SELECT array_agg(isbn ORDER BY isbn, rank) AS isbns,
+                   array_agg(recommended_isbn ORDER BY isbn, rank) AS recommended,
+                   array_agg(score ORDER BY isbn, rank) AS scores
+            FROM book_recommendations
+        """))).one()
+    return await run_in_threadpool(
+        build_index_arrays, row.isbns or [], row.recommended or [], row.scores or [],
+        float(built_at) if built_at else None
+    )
+
+async def refresh_recommendations():
+    """有更新的构建结果时重新加载到内存"""
+    global recommendation_index
+    async with async_engine.connect() as conn:
+        built_at = await get_built_at(conn)
+    if built_at is not None and float(built_at) != recommendation_index.built_at:
+        recommendation_index = await load_recommendation_index()
+
+async def run_recommendation_refresher(reload_interval: float, rebuild_interval: float):
+    """后台任务：定期加载最新的相似书籍表；rebuild_interval > 0 时结果过期后在本进程中重建"""
+    while True:
+        try:
+            await refresh_recommendations()
+            built_at = recommendation_index.built_at
+            if rebuild_interval > 0 and (built_at is None or time.time() - built_at >= rebuild_interval):
+                if await build_recommendations():
+                    await refresh_recommendations()
+        except Exception as e:
+            logger.warning(f"Refreshing book recommendations failed: {e}")
+        await asyncio.sleep(reload_interval)
+
+
+if __name__ == "__main__":
+    # 离线重建：python -m app_design.recommendations（例如由 cron 每小时执行）
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(build_recommendations())
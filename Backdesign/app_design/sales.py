@@ -0,0 +1,226 @@
+# sales.py
+import asyncio
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from typing import List, Optional
+from datetime import date, timedelta
+from db import async_engine, get_async_db
+from app_design.dependencies.deps import get_token_principal
+from app_design.books import check_store_access
+from core.serialization import FastJSONRoute
+
+logger = logging.getLogger(__name__)
+
+routersales = APIRouter(route_class=FastJSONRoute)
+
+# 销售汇总按店铺、下单日期和订单状态记录营业额、销量和订单数，分类汇总另加一列分类。
+# 订单写入时只向 sales_deltas 追加增量行，不更新汇总行：同一店铺同一天的并发订单不会在同一汇总行上排队。
+# 后台任务定期把增量合并进汇总表；报表接口按 (store_id, sales_date) 区间读取汇总表和尚未合并的增量。
+ORDER_STATUSES = ("pending", "shipped", "completed")
+
+# 默认统计最近 30 天
+DEFAULT_SALES_DAYS = 30
+
+# 每次合并的增量行数
+ROLLUP_BATCH_SIZE = 10000
+
+# 多个 worker 都会运行合并任务，同一时刻只需要一个执行
+ROLLUP_LOCK_KEY = 727_005
+
+def sales_rollup_ctes(source: str) -> str:
+    """把订单计入销售汇总的 CTE 片段，拼接在调用方的 WITH 子句之后
+
+    source 是调用方定义的 CTE 名称，列为 (order_id, status, sign)：sign 为 1 时按 status 计入，
+    为 -1 时从 status 中扣除。订单和明细按语句开始时的快照读取，因此可以和删除订单放在同一条语句中。
+    每个订单追加一行店铺增量（category 为空）和每个分类一行分类增量，只插入新行，不与其他订单争用锁。
+    """
+    return f"""
+        sales_orders AS (
+            SELECT o.order_id, o.store_id, o.order_date, c.status, c.sign, o.total_price,
+                   (SELECT COALESCE(SUM(od.quantity), 0) FROM order_details od
+                    WHERE od.order_id = o.order_id) AS units
+            FROM {source} c
+            JOIN orders o ON o.order_id = c.order_id
+        ),
+        sales_items AS (
+            SELECT so.store_id, so.order_date, so.status, so.sign,
+                   COALESCE(od.category, '') AS category,
+                   SUM(od.quantity) AS units,
+                   SUM(od.quantity * od.unit_price) AS revenue
+            FROM sales_orders so
+            JOIN order_details od ON od.order_id = so.order_id
+            GROUP BY so.order_id, so.store_id, so.order_date, so.status, so.sign, od.category
+        ),
+        sales_delta AS (
+            INSERT INTO sales_deltas (store_id, sales_date, category, status, revenue, units, order_count)
+            SELECT store_id, order_date, NULL, status, sign * total_price, sign * units, sign
+            FROM sales_orders
+            UNION ALL
+            SELECT store_id, order_date, category, status, sign * revenue, sign * units, sign
+            FROM sales_items
+        )
+    """
+
+async def record_new_orders(db: AsyncSession, order_ids: List[int]):
+    """把刚创建的订单计入销售汇总，由调用方提交事务"""
+    await db.execute(text(f"""
+        WITH new_orders AS (
+            SELECT order_id, status, 1 AS sign FROM orders
+            WHERE order_id = ANY(:order_ids)
+        ),
+        {sales_rollup_ctes("new_orders")}
+        SELECT 1
+    """), {"order_ids": list(order_ids)})
+
+async def fold_sales_deltas(conn) -> int:
+    """把一批已提交的增量合并进每日汇总表，返回合并的行数
+
+    删除增量和更新汇总在同一条语句中，报表读取时一行增量要么还在增量表中，要么已计入汇总表。
+    汇总行按主键顺序更新，只有合并任务写汇总表，与订单写入互不阻塞。
+    """
+    got_lock = (await conn.execute(
+        text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK_KEY}
+    )).scalar()
+    if not got_lock:
+        return 0
+    return (await conn.execute(text("""
+        WITH folded AS (
+            DELETE FROM sales_deltas
+            WHERE delta_id IN (
+                SELECT delta_id FROM sales_deltas ORDER BY delta_id LIMIT :batch
+            )
+            RETURNING store_id, sales_date, category, status, revenue, units, order_count
+        ),
+        store_rollup AS (
+            INSERT INTO store_sales_daily AS t (store_id, sales_date, status, revenue, units, order_count)
+            SELECT store_id, sales_date, status, SUM(revenue), SUM(units), SUM(order_count)
+            FROM folded
+            WHERE category IS NULL
+            GROUP BY store_id, sales_date, status
+            ORDER BY store_id, sales_date, status
+            ON CONFLICT (store_id, sales_date, status) DO UPDATE SET
+                revenue = t.revenue + EXCLUDED.revenue,
+                units = t.units + EXCLUDED.units,
+                order_count = t.order_count + EXCLUDED.order_count
+        ),
+        category_rollup AS (
+            INSERT INTO category_sales_daily AS t (store_id, sales_date, category, status, revenue, units, order_count)
+            SELECT store_id, sales_date, category, status, SUM(revenue), SUM(units), SUM(order_count)
+            FROM folded
+            WHERE category IS NOT NULL
+            GROUP BY store_id, sales_date, category, status
+            ORDER BY store_id, sales_date, category, status
+            ON CONFLICT (store_id, sales_date, category, status) DO UPDATE SET
+                revenue = t.revenue + EXCLUDED.revenue,
+                units = t.units + EXCLUDED.units,
+                order_count = t.order_count + EXCLUDED.order_count
+        )
+        SELECT COUNT(*) FROM folded
+    """), {"batch": ROLLUP_BATCH_SIZE})).scalar()
+
+async def run_sales_rollup(interval: float):
+    """后台任务：每隔 interval 秒把销售增量合并进每日汇总表"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            while True:
+                async with async_engine.begin() as conn:
+                    folded = await fold_sales_deltas(conn)
+                if folded < ROLLUP_BATCH_SIZE:
+                    break
+        except Exception as e:
+            logger.warning(f"Folding sales deltas failed: {e}")
+
+def sales_range(start: Optional[date], end: Optional[date]):
+    """统计区间（含首尾），默认截止今天的最近 DEFAULT_SALES_DAYS 天"""
+    end = end or date.today()
+    start = start or end - timedelta(days=DEFAULT_SALES_DAYS - 1)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    return start, end
+
+def status_filter(status: Optional[str]):
+    if status is None:
+        return "", {}
+    if status not in ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail=f"status must be one of: {', '.join(ORDER_STATUSES)}")
+    return "AND status = :status", {"status": status}
+
+def sales_totals(row) -> dict:
+    return {"revenue": row.revenue, "units": row.units, "order_count": row.order_count}
+
+@routersales.get("/store/{store_id}")
+async def get_store_sales(
+    store_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    period: str = Query("day", pattern="^(day|month)$"),
+    status: Optional[str] = Query(None, description="只统计该状态的订单，默认统计全部"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """店铺销售报表：区间合计和按日/按月的营业额、销量、订单数"""
+    check_store_access(store_id, current_user)
+    start, end = sales_range(start, end)
+    status_clause, status_params = status_filter(status)
+    rows = (await db.execute(text(f"""
+        SELECT date_trunc(:period, sales_date)::date AS period,
+               SUM(revenue) AS revenue, SUM(units) AS units, SUM(order_count) AS order_count
+        FROM (
+            SELECT sales_date, status, revenue, units, order_count FROM store_sales_daily
+            WHERE store_id = :store_id AND sales_date BETWEEN :start AND :end
+            UNION ALL
+            SELECT sales_date, status, revenue, units, order_count FROM sales_deltas
+            WHERE store_id = :store_id AND sales_date BETWEEN :start AND :end AND category IS NULL
+        ) s
+        WHERE TRUE {status_clause}
+        GROUP BY 1
+        HAVING SUM(order_count) <> 0
+        ORDER BY 1
+    """), {"store_id": store_id, "start": start, "end": end, "period": period, **status_params})).fetchall()
+    return {
+        "store_id": store_id,
+        "start": start,
+        "end": end,
+        "totals": {
+            "revenue": sum(row.revenue for row in rows),
+            "units": sum(row.units for row in rows),
+            "order_count": sum(row.order_count for row in rows),
+        },
+        "series": [{"period": row.period, **sales_totals(row)} for row in rows],
+    }
+
+@routersales.get("/store/{store_id}/categories")
+async def get_store_category_sales(
+    store_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    status: Optional[str] = Query(None, description="只统计该状态的订单，默认统计全部"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user = Depends(get_token_principal)
+):
+    """店铺各分类的销售合计，按营业额从高到低排列
+
+    分类为下单时书籍所属的分类；订单数为包含该分类书籍的订单数，各分类之和可能大于订单总数。
+    """
+    check_store_access(store_id, current_user)
+    start, end = sales_range(start, end)
+    status_clause, status_params = status_filter(status)
+    rows = (await db.execute(text(f"""
+        SELECT category,
+               SUM(revenue) AS revenue, SUM(units) AS units, SUM(order_count) AS order_count
+        FROM (
+            SELECT category, status, revenue, units, order_count FROM category_sales_daily
+            WHERE store_id = :store_id AND sales_date BETWEEN :start AND :end
+            UNION ALL
+            SELECT category, status, revenue, units, order_count FROM sales_deltas
+            WHERE store_id = :store_id AND sales_date BETWEEN :start AND :end AND category IS NOT NULL
+        ) s
+        WHERE TRUE {status_clause}
+        GROUP BY category
+        HAVING SUM(order_count) <> 0
+        ORDER BY revenue DESC, category
+    """), {"store_id": store_id, "start": start, "end": end, **status_params})).fetchall()
+    return [{"category": row.category, **sales_totals(row)} for row in rows]
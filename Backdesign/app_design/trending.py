@@ -0,0 +1,348 @@
+# trending.py
+import asyncio
+import heapq
+import logging
+import math
+import time
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timezone
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from sqlalchemy import text
+
+from core.config import get_settings
+from db import async_engine
+
+logger = logging.getLogger(__name__)
+
+# 热度按指数衰减：trending 半衰期短，反映最近的销量；bestseller 半衰期长，反映一段时间内的销量
+POPULARITY_KINDS = ("trending", "bestseller")
+
+# 热度只计入已离开待付款状态的订单：待付款的订单可能被取消（删除），计入后无法准确扣除，
+# 而分数只增不减时前 K 名才能增量维护。订单首次离开待付款状态时分配 confirmed_seq，按该编号增量读取。
+
+# 每次读取的订单数
+POLL_BATCH_SIZE = 5000
+# 每次轮询都回看最近这么多个 confirmed_seq：序列号按分配顺序递增，
+# 但事务提交顺序可能不同，编号较小的订单可能晚于较大的订单出现
+POLL_OVERLAP = 1000
+# 衰减后低于该值的分数在保存检查点时丢弃，内存和检查点表的大小只与近期有销量的书籍数有关
+MIN_SCORE = 0.01
+# 权重超过该值时整体换算到新的基准时间，避免浮点溢出
+RESCALE_LIMIT = 1e100
+
+# 多个 worker 各自维护一份热度，同一时刻只需要一个保存检查点
+CHECKPOINT_LOCK_KEY = 727_003
+
+
+class TopK:
+    """分数只增不减时的前 K 名：成员字典 + 惰性删除的最小堆
+
+    分数只会增加，因此不在前 K 名中的键只有超过当前第 K 名时才可能进入，
+    每次更新只需和堆顶比较，不需要对全部键排序。
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        self.members: Dict[Hashable, float] = {}
+        self._heap: List[Tuple[float, Hashable]] = []
+
+    def offer(self, key: Hashable, score: float):
+        if key in self.members:
+            self.members[key] = score
+            self._push(score, key)
+            return
+        if len(self.members) < self.k:
+            self.members[key] = score
+            self._push(score, key)
+            return
+        lowest, lowest_key = self._peek()
+        if score > lowest:
+            heapq.heappop(self._heap)
+            del self.members[lowest_key]
+            self.members[key] = score
+            self._push(score, key)
+
+    def scale(self, factor: float):
+        self.members = {key: score * factor for key, score in self.members.items()}
+        self._rebuild()
+
+    def ranked(self, limit: int) -> List[Tuple[Hashable, float]]:
+        return heapq.nlargest(limit, self.members.items(), key=lambda item: item[1])
+
+    def _push(self, score: float, key: Hashable):
+        heapq.heappush(self._heap, (score, key))
+        # 更新过的键在堆中留有旧分数，过多时重建
+        if len(self._heap) > 4 * self.k:
+            self._rebuild()
+
+    def _peek(self) -> Tuple[float, Hashable]:
+        # 跳过已被更新或移出的旧记录
+        while self.members.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0]
+
+    def _rebuild(self):
+        self._heap = [(score, key) for key, score in self.members.items()]
+        heapq.heapify(self._heap)
+
+
+class DecayedScores:
+    """按半衰期指数衰减的书籍和分类热度
+
+    使用前向衰减：每次销量按 exp(rate * (发生时间 - 基准时间)) 放大后累加为权重，
+    任意时刻的分数都是权重乘以同一个衰减系数，因此权重的排序不随时间变化，
+    前 K 名只需在有新销量时更新。
+    """
+
+    def __init__(self, half_life: float, top_k: int, epoch: float):
+        self.half_life = half_life
+        self.rate = math.log(2) / half_life
+        self.top_k = top_k
+        self.epoch = epoch
+        self.weights: Dict[str, float] = {}
+        self.categories: Dict[str, str] = {}
+        self.category_weights: Dict[str, float] = defaultdict(float)
+        self.top = TopK(top_k)
+        self.category_top: Dict[str, TopK] = {}
+
+    def add(self, isbn: str, category: str, quantity: float, at: float):
+        amount = quantity * math.exp(self.rate * (at - self.epoch))
+        weight = self.weights.get(isbn, 0.0) + amount
+        self.weights[isbn] = weight
+        self.categories[isbn] = category
+        self.category_weights[category] += amount
+        self.top.offer(isbn, weight)
+        if category not in self.category_top:
+            self.category_top[category] = TopK(self.top_k)
+        self.category_top[category].offer(isbn, weight)
+        if weight > RESCALE_LIMIT:
+            self.rescale(at)
+
+    def decay(self, now: float) -> float:
+        return math.exp(-self.rate * (now - self.epoch))
+
+    def rescale(self, now: float):
+        """把全部权重换算到新的基准时间 now，排序不变"""
+        factor = self.decay(now)
+        self.weights = {isbn: weight * factor for isbn, weight in self.weights.items()}
+        self.category_weights = defaultdict(float, {
+            category: weight * factor for category, weight in self.category_weights.items()
+        })
+        self.top.scale(factor)
+        for top in self.category_top.values():
+            top.scale(factor)
+        self.epoch = now
+
+    def top_books(self, now: float, limit: int, category: Optional[str] = None) -> List[Tuple[str, float]]:
+        top = self.top if category is None else self.category_top.get(category)
+        if top is None:
+            return []
+        factor = self.decay(now)
+        return [(isbn, weight * factor) for isbn, weight in top.ranked(limit)]
+
+    def top_categories(self, now: float, limit: int) -> List[Tuple[str, float]]:
+        factor = self.decay(now)
+        ranked = heapq.nlargest(limit, self.category_weights.items(), key=lambda item: item[1])
+        return [(category, weight * factor) for category, weight in ranked]
+
+    def snapshot(self, now: float) -> List[Tuple[str, str, float]]:
+        """当前时刻的 (isbn, 分类, 分数)，丢弃已衰减到 MIN_SCORE 以下的书籍"""
+        factor = self.decay(now)
+        return [
+            (isbn, self.categories[isbn], weight * factor)
+            for isbn, weight in self.weights.items()
+            if weight * factor >= MIN_SCORE
+        ]
+
+
+def event_time(order_date: date, now: float) -> float:
+    """订单只记录日期：当天的订单按读取时间计，更早的订单按当天零点计"""
+    if order_date >= date.today():
+        return now
+    return datetime.combine(order_date, dt_time(), tzinfo=timezone.utc).timestamp()
+
+
+class PopularityTracker:
+    """增量读取新确认的订单，在内存中维护各类热度排行，并定期保存检查点
+
+    每个 worker 各自读取全部已确认订单的明细，排行互相一致；重启时从检查点继续读取，
+    不需要重新汇总全部订单明细。
+    """
+
+    def __init__(self, half_lives: Dict[str, float], top_k: int):
+        self.half_lives = half_lives
+        self.top_k = top_k
+        self.ready = False
+        # 读取新明细和保存检查点都会替换内存中的状态，不能交错执行
+        self._lock = asyncio.Lock()
+        self.reset(time.time(), 0)
+
+    def reset(self, epoch: float, last_seq: int):
+        self.scores = {
+            kind: DecayedScores(half_life, self.top_k, epoch)
+            for kind, half_life in self.half_lives.items()
+        }
+        self.last_seq = last_seq
+        # 检查点之前的订单已计入，不再回看
+        self.horizon = last_seq
+        self.recent = set()
+
+    async def load(self):
+        """从检查点恢复；没有检查点时从头读取已确认的订单"""
+        async with self._lock:
+            async with async_engine.connect() as conn:
+                # 检查点和分数在同一条语句中读取，避免读到其他 worker 保存到一半的两次检查点
+                rows = (await conn.execute(text("""
+                    SELECT c.last_confirmed_seq, extract(epoch FROM c.checkpointed_at) AS checkpointed_at,
+                           s.kind, s.isbn, s.category, s.score
+                    FROM popularity_checkpoint c
+                    LEFT JOIN popularity_scores s ON TRUE
+                    WHERE c.id = 1
+                """))).fetchall()
+            if rows:
+                self.reset(float(rows[0].checkpointed_at), rows[0].last_confirmed_seq)
+                for row in rows:
+                    if row.kind in self.scores:
+                        scores = self.scores[row.kind]
+                        scores.add(row.isbn, row.category, row.score, scores.epoch)
+            await self._poll()
+            self.ready = True
+
+    async def poll(self) -> int:
+        """读取上次之后新确认的订单并计入热度，返回新计入的订单数"""
+        async with self._lock:
+            return await self._poll()
+
+    async def _poll(self) -> int:
+        applied = 0
+        async with async_engine.connect() as conn:
+            floor = max(self.horizon, self.last_seq - POLL_OVERLAP)
+            while True:
+                # 按订单分批，同一订单的明细总在同一批中；没有明细的订单也返回一行，用于推进编号
+                rows = (await conn.execute(text("""
+                    WITH confirmed AS (
+                        SELECT order_id, confirmed_seq, order_date FROM orders
+                        WHERE confirmed_seq > :floor
+                        ORDER BY confirmed_seq
+                        LIMIT :limit
+                    )
+                    SELECT c.confirmed_seq, c.order_date, od.book_isbn, od.quantity,
+                           COALESCE(od.category, '') AS category
+                    FROM confirmed c
+                    LEFT JOIN order_details od ON od.order_id = c.order_id
+                    ORDER BY c.confirmed_seq
+                """), {"floor": floor, "limit": POLL_BATCH_SIZE})).fetchall()
+                now = time.time()
+                batch = set()
+                for row in rows:
+                    batch.add(row.confirmed_seq)
+                    if row.confirmed_seq in self.recent or row.book_isbn is None:
+                        continue
+                    at = event_time(row.order_date, now)
+                    for scores in self.scores.values():
+                        scores.add(row.book_isbn, row.category, row.quantity, at)
+                new_orders = batch - self.recent
+                applied += len(new_orders)
+                self.recent |= new_orders
+                if batch:
+                    self.last_seq = max(self.last_seq, max(batch))
+                if len(batch) < POLL_BATCH_SIZE:
+                    break
+                floor = max(batch)
+        cutoff = max(self.horizon, self.last_seq - POLL_OVERLAP)
+        self.recent = {seq for seq in self.recent if seq > cutoff}
+        return applied
+
+    async def checkpoint(self) -> bool:
+        """保存当前分数和已读取到的订单编号；其他 worker 正在保存时跳过"""
+        async with self._lock:
+            return await self._checkpoint()
+
+    async def _checkpoint(self) -> bool:
+        now = time.time()
+        # 在同一时刻取分数和编号，两者保持一致
+        last_seq = self.last_seq
+        rows = [
+            (kind, isbn, category, score)
+            for kind, scores in self.scores.items()
+            for isbn, category, score in scores.snapshot(now)
+        ]
+        async with async_engine.begin() as conn:
+            got_lock = (await conn.execute(
+                text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": CHECKPOINT_LOCK_KEY}
+            )).scalar()
+            if not got_lock:
+                return False
+            await conn.execute(text("DELETE FROM popularity_scores"))
+            if rows:
+                kinds, isbns, categories, values = zip(*rows)
+                await conn.execute(text("""
+                    INSERT INTO popularity_scores (kind, isbn, category, score)
+                    SELECT * FROM unnest(
+                        CAST(:kinds AS VARCHAR[]),
+                        CAST(:isbns AS VARCHAR[]),
+                        CAST(:categories AS VARCHAR[]),
+                        CAST(:scores AS DOUBLE PRECISION[])
+                    )
+                """), {
+                    "kinds": list(kinds),
+                    "isbns": list(isbns),
+                    "categories": list(categories),
+                    "scores": list(values)
+                })
+            await conn.execute(text("""
+                INSERT INTO popularity_checkpoint (id, last_confirmed_seq, checkpointed_at)
+                VALUES (1, :last_seq, to_timestamp(:now))
+                ON CONFLICT (id) DO UPDATE SET
+                    last_confirmed_seq = EXCLUDED.last_confirmed_seq,
+                    checkpointed_at = EXCLUDED.checkpointed_at
+            """), {"last_seq": last_seq, "now": now})
+        # 内存中也丢弃已衰减掉的书籍
+        for kind, scores in self.scores.items():
+            scores.rescale(now)
+            kept = {isbn for k, isbn, _, _ in rows if k == kind}
+            if len(kept) < len(scores.weights):
+                self.scores[kind] = self._rebuilt(scores, kept, now)
+        return True
+
+    def _rebuilt(self, scores: DecayedScores, kept: set, now: float) -> DecayedScores:
+        fresh = DecayedScores(scores.half_life, self.top_k, now)
+        for isbn in kept:
+            fresh.add(isbn, scores.categories[isbn], scores.weights[isbn], now)
+        return fresh
+
+    def top_books(self, kind: str, limit: int, category: Optional[str] = None):
+        return self.scores[kind].top_books(time.time(), limit, category)
+
+    def top_categories(self, kind: str, limit: int):
+        return self.scores[kind].top_categories(time.time(), limit)
+
+
+_settings = get_settings()
+popularity_tracker = PopularityTracker(
+    {
+        "trending": _settings.TRENDING_HALF_LIFE,
+        "bestseller": _settings.BESTSELLER_HALF_LIFE,
+    },
+    _settings.TRENDING_TOP_K,
+)
+
+async def run_popularity_tracker(poll_interval: float, checkpoint_interval: float):
+    """后台任务：启动时从检查点恢复，之后定期读取新确认的订单并保存检查点"""
+    while not popularity_tracker.ready:
+        try:
+            await popularity_tracker.load()
+        except Exception as e:
+            logger.warning(f"Loading popularity scores failed: {e}")
+            await asyncio.sleep(poll_interval)
+    last_checkpoint = time.monotonic()
+    while True:
+        await asyncio.sleep(poll_interval)
+        try:
+            await popularity_tracker.poll()
+            if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                await popularity_tracker.checkpoint()
+                last_checkpoint = time.monotonic()
+        except Exception as e:
+            logger.warning(f"Updating popularity scores failed: {e}")
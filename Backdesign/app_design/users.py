@@ -1,21 +1,21 @@
 # user.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 from typing import Optional, List
 from pydantic import BaseModel, EmailStr
-from passlib.context import CryptContext
 from datetime import date
-from db import get_db
+from db import get_async_db
 from app_design.dependencies.deps import oauth2_scheme,get_current_user
 from app_design.dependencies.deps import get_current_admin
 from core.security import create_token,verify_token
+from core.pagination import decode_cursor, set_next_cursor
+from core.cache import invalidate_principal
+from core.passwords import hash_password_async
+from core.etag import PRIVATE_CACHE_CONTROL, compute_etag, etag_matches, not_modified, set_etag
 
 routeruser = APIRouter()
 
-# 密码加密配置
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 class UserBase(BaseModel):
     name: str
     email: EmailStr
@@ -35,13 +35,28 @@ class User(UserBase):
     id: int
     class Config:
         from_attributes = True
+
+def user_cursor_clause(cursor: Optional[str]):
+    """用户按 id 升序的 keyset 分页条件"""
+    if not cursor:
+        return "", {}
+    try:
+        cursor_id = int(decode_cursor(cursor)["id"])
+    except (KeyError, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return "AND id > :cursor_id", {"cursor_id": cursor_id}
+
+def user_cursor_key(row) -> dict:
+    return {"id": row.id}
 # API路由
 @routeruser.get("/me", response_model=User)
 async def get_current_user_info(
+    request: Request,
+    response: Response,
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    """获取当前用户信息的API endpoint"""
+    """获取当前用户信息的API endpoint，支持 If-None-Match 条件请求"""
     user = await get_current_user(token, db)
     user_data = {
         "id": user.id,
@@ -50,11 +65,16 @@ async def get_current_user_info(
         "type": user.type,
         "address": user.address,
     }
+    # 用户行来自 principal 缓存，按内容计算 ETag 无需额外查询
+    etag = compute_etag(user_data)
+    if etag_matches(request, etag):
+        return not_modified(etag, PRIVATE_CACHE_CONTROL)
+    set_etag(response, etag, PRIVATE_CACHE_CONTROL)
     return user_data
 @routeruser.put("/me", response_model=User)  
 async def update_user(  
     user_update: UserUpdate,  
-    db: Session = Depends(get_db),  
+    db: AsyncSession = Depends(get_async_db),  
     token: str = Depends(oauth2_scheme)  
 ):  
     """更新当前用户信息"""  
@@ -78,7 +98,7 @@ async def update_user(
         # 将更新的数据转换为序列（元组、列表）  
         update_data = user_update.dict(exclude_unset=True)  
         if 'password' in update_data:  
-            update_data['password'] = pwd_context.hash(update_data['password'])  
+            update_data['password'] = await hash_password_async(update_data['password'])  
             
         if not update_data:  
             raise HTTPException(status_code=400, detail="No fields to update")  
@@ -86,25 +106,28 @@ async def update_user(
         # 检查邮箱是否已存在  
         if 'email' in update_data :  
             check_sql = text("SELECT id FROM participants WHERE email = :email AND id != :id")  
-            existing = db.execute(check_sql, {  
+            existing = (await db.execute(check_sql, {  
                 "email": update_data['email'],  
                 "id": user_data["id"]  # Use user_data["id"] instead of user_data.id  
-            }).fetchone()  
+            })).fetchone()  
             if existing and 'email'!=user_data["email"]:  
                 raise HTTPException(status_code=400, detail="Email already registered")  
 
         # 如果要更新name，检查是否已存在  
         if 'name' in update_data:  
             check_sql = text("SELECT id FROM participants WHERE name = :name AND id != :id")  
-            existing = db.execute(check_sql, {  
+            existing = (await db.execute(check_sql, {  
                 "name": update_data['name'],  
                 "id": user_data["id"]  # Use user_data["id"] instead of user_data.id  
-            }).fetchone()  
+            })).fetchone()  
             if existing:  
                 raise HTTPException(status_code=400, detail="Username already taken")  
 
         # 构建UPDATE语句  
         set_clause = ", ".join(f"{k} = :{k}" for k in update_data.keys())  
+        if 'password' in update_data:  
+            # 修改密码后吊销已签发的令牌  
+            set_clause += ", token_version = token_version + 1"  
         sql = text(f"""  
             UPDATE participants   
             SET {set_clause}  
@@ -114,12 +137,13 @@ async def update_user(
         
         # 添加user_id到参数中  
         update_data["id"] = user_data["id"]  
-        result = db.execute(sql, update_data).fetchone()  
+        result = (await db.execute(sql, update_data)).fetchone()  
         
         if not result:  
             raise HTTPException(status_code=404, detail="User not found")  
         
-        db.commit()  
+        await db.commit()  
+        invalidate_principal(user_data["id"])  
         
         # 返回更新后的用户信息，保持格式一致  
         return {  
@@ -130,10 +154,10 @@ async def update_user(
             "address": result[4],  
         }  
     except Exception as e:  
-        db.rollback()  
+        await db.rollback()  
         raise HTTPException(status_code=500, detail=str(e))
 @routeruser.delete("/me")
-async def delete_user(db: Session = Depends(get_db), token: str = Depends(oauth2_scheme)):
+async def delete_user(db: AsyncSession = Depends(get_async_db), token: str = Depends(oauth2_scheme)):
     """删除当前用户账号"""
     try:
         user = await get_current_user(token, db)
@@ -150,21 +174,34 @@ async def delete_user(db: Session = Depends(get_db), token: str = Depends(oauth2
             detail="Invalid token or expired",
          )
         sql = text("DELETE FROM participants WHERE id = :id RETURNING id")
-        result = db.execute(sql, {"id":user_data["id"]}).fetchone()
+        result = (await db.execute(sql, {"id":user_data["id"]})).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="User not found")
         
-        db.commit()
+        await db.commit()
+        invalidate_principal(user_data["id"])
         return {"message": "User account deleted successfully"}
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 
 @routeruser.get("/stores")
-async def get_all_stores(db: Session = Depends(get_db)):
-    """获取所有商家用户"""
-    sql = text("SELECT * FROM participants WHERE type = 'store'")
-    result = db.execute(sql)
+async def get_all_stores(request: Request, response: Response, db: AsyncSession = Depends(get_async_db)):
+    """获取所有商家用户，ETag 由各行的版本号（xmin）计算，支持 If-None-Match 条件请求"""
+    if request.headers.get("if-none-match"):
+        # 只读取行版本号判断是否变化，未变化时不查询完整行
+        versions = (await db.execute(text(
+            "SELECT id, xmin::text AS row_version FROM participants WHERE type = 'store' ORDER BY id"
+        ))).fetchall()
+        etag = compute_etag([[row.id, row.row_version] for row in versions])
+        if etag_matches(request, etag):
+            return not_modified(etag)
+    sql = text("SELECT *, xmin::text AS row_version FROM participants WHERE type = 'store' ORDER BY id")
+    result = (await db.execute(sql)).fetchall()
+    etag = compute_etag([[row.id, row.row_version] for row in result])
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    set_etag(response, etag)
     stores = []
     for user in result:
             store_list = {
@@ -179,11 +216,11 @@ async def get_all_stores(db: Session = Depends(get_db)):
     
 
 @routeruser.get("/{user_id}", response_model=User)
-async def get_user(user_id: int, db: Session = Depends(get_db)):
+async def get_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
     """获取指定用户信息（管理员用）"""
     try:
         sql = text("SELECT * FROM participants WHERE id = :id")
-        result = db.execute(sql, {"id": user_id}).fetchone()
+        result = (await db.execute(sql, {"id": user_id})).fetchone()
         if not result:
             raise HTTPException(status_code=404, detail="User not found")
         return result
@@ -191,21 +228,32 @@ async def get_user(user_id: int, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 @routeruser.get("/")
 async def get_all_users(
+    response: Response,
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db)
 ):
     """获取所有用户（管理员用）"""
+    # 传入 cursor 时使用 keyset 分页，忽略 skip
+    cursor_clause, cursor_params = user_cursor_clause(cursor)
     try:
         # 使用参数化查询
-        sql = text("""
+        sql = text(f"""
             SELECT id, name, email, type, address 
             FROM participants 
+            WHERE 1=1
+            {cursor_clause}
             ORDER BY id  -- 添加排序确保结果一致
             OFFSET :skip LIMIT :limit
         """)
         
-        result = db.execute(sql, {"skip": skip, "limit": limit})
+        result = (await db.execute(sql, {
+            "skip": 0 if cursor else skip,
+            "limit": limit,
+            **cursor_params
+        })).fetchall()
+        set_next_cursor(response, result, limit, user_cursor_key)
         users_data = []
         
         for row in result:
@@ -226,19 +274,19 @@ async def get_all_users(
 @routeruser.post("/admin/create", response_model=User)
 async def create_admin(
     user: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: User = Depends(get_current_admin)
 ):
     """创建新管理员（仅限管理员）"""
     try:
         # 检查email是否已存在
         check_sql = text("SELECT id FROM participants WHERE email = :email")
-        if db.execute(check_sql, {"email": user.email}).fetchone():
+        if (await db.execute(check_sql, {"email": user.email})).fetchone():
             raise HTTPException(status_code=400, detail="Email already registered")
 
         # 检查昵称是否已存在
         check_sql = text("SELECT id FROM participants WHERE name = :name")
-        if db.execute(check_sql, {"name": user.name}).fetchone():
+        if (await db.execute(check_sql, {"name": user.name})).fetchone():
             raise HTTPException(status_code=400, detail="Username already taken")
 
         # 创建新管理员
@@ -248,51 +296,52 @@ async def create_admin(
             RETURNING *
         """)
         
-        hashed_password = pwd_context.hash(user.password)
-        result = db.execute(sql, {
+        hashed_password = await hash_password_async(user.password)
+        result = (await db.execute(sql, {
             "name": user.name,
             "email": user.email,
             "password": hashed_password,
             "address": user.address
-        }).fetchone()
+        })).fetchone()
         
-        db.commit()
+        await db.commit()
         return result
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
 # 管理员更新用户
 @routeruser.delete("/{user_id}")
 async def delete_user_by_admin(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: dict = Depends(get_current_admin)
 ):
     """管理员删除用户"""
     try:
         # 首先检查用户是否存在
         check_sql = text("SELECT id FROM participants WHERE id = :id")
-        existing_user = db.execute(check_sql, {"id": user_id}).first()
+        existing_user = (await db.execute(check_sql, {"id": user_id})).first()
         
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # 执行删除操作
         sql = text("DELETE FROM participants WHERE id = :id")
-        result = db.execute(sql, {"id": user_id})
+        result = await db.execute(sql, {"id": user_id})
         
         if result.rowcount == 0:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=404, detail="User not found or already deleted")
         
-        db.commit()
+        await db.commit()
+        invalidate_principal(user_id)
         return {"message": "User deleted successfully", "user_id": user_id}
         
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error deleting user: {str(e)}")
 class UserUpdate2(BaseModel):
     name: Optional[str] = None
@@ -303,14 +352,14 @@ class UserUpdate2(BaseModel):
 async def update_user_by_admin(
     user_id: int,
     user_update: UserUpdate2,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: dict = Depends(get_current_admin)
 ):
     """管理员更新用户信息"""
     try:
         # 首先检查用户是否存在
         check_sql = text("SELECT * FROM participants WHERE id = :id")
-        existing_user = db.execute(check_sql, {"id": user_id}).first()
+        existing_user = (await db.execute(check_sql, {"id": user_id})).first()
         
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
@@ -325,10 +374,10 @@ async def update_user_by_admin(
                 SELECT id FROM participants 
                 WHERE name = :name AND id != :id
             """)
-            if db.execute(check_sql, {
+            if (await db.execute(check_sql, {
                 "name": user_update.name, 
                 "id": user_id
-            }).first():
+            })).first():
                 raise HTTPException(status_code=400, detail="Username already taken")
             update_data['name'] = user_update.name
 
@@ -344,13 +393,16 @@ async def update_user_by_admin(
 
         if user_update.password is not None and user_update.password.strip():
             # 对密码进行哈希处理
-            update_data['password'] = pwd_context.hash(user_update.password)
+            update_data['password'] = await hash_password_async(user_update.password)
 
         if not update_data:
             raise HTTPException(status_code=400, detail="No valid fields to update")
 
         # 构建更新语句
         set_clause = ", ".join(f"{k} = :{k}" for k in update_data.keys())
+        if 'type' in update_data or 'password' in update_data:
+            # 角色或密码变更后吊销已签发的令牌
+            set_clause += ", token_version = token_version + 1"
         sql = text(f"""
             UPDATE participants 
             SET {set_clause}
@@ -360,13 +412,14 @@ async def update_user_by_admin(
         
         # 添加user_id到更新数据中
         update_data['id'] = user_id
-        result = db.execute(sql, update_data).first()
+        result = (await db.execute(sql, update_data)).first()
         
         if not result:
-            db.rollback()
+            await db.rollback()
             raise HTTPException(status_code=404, detail="Update failed")
             
-        db.commit()
+        await db.commit()
+        invalidate_principal(user_id)
         
         # 返回更新后的用户数据
         return {
@@ -378,29 +431,34 @@ async def update_user_by_admin(
         }
 
     except HTTPException:
-        db.rollback()
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Error updating user: {str(e)}")
 
 # 管理员搜索用户
 @routeruser.get("/search/")
 async def search_users(
+    response: Response,
     query: str = "",
     type: str = "",
     skip: int = 0,
     limit: int = 10,
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = None,
+    db: AsyncSession = Depends(get_async_db),
     current_admin: dict = Depends(get_current_admin)
 ):
     """搜索用户"""
+    # 传入 cursor 时使用 keyset 分页，忽略 skip
+    cursor_clause, cursor_params = user_cursor_clause(cursor)
     try:
-        sql = """
-            SELECT * FROM participants
+        sql = f"""
+            SELECT id, name, email, type, address FROM participants
             WHERE 1=1
+            {cursor_clause}
         """
-        params = {}
+        params = dict(cursor_params)
         
         if query:
             sql += " AND (name ILIKE :query OR email ILIKE :query)"
@@ -410,30 +468,31 @@ async def search_users(
             sql += " AND type = :type"
             params['type'] = type
             
-        sql += " LIMIT :limit OFFSET :skip"
-        params.update({'limit': limit, 'skip': skip})
+        sql += " ORDER BY id LIMIT :limit OFFSET :skip"
+        params.update({'limit': limit, 'skip': 0 if cursor else skip})
         
-        result = db.execute(text(sql), params).fetchall()
+        result = (await db.execute(text(sql), params)).fetchall()
+        set_next_cursor(response, result, limit, user_cursor_key)
         
-        return result
+        return [dict(row._mapping) for row in result]
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 @routeruser.post("/", response_model=User)
 async def create_user(
     user: UserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_admin: dict = Depends(get_current_admin)  # 确保是管理员权限
 ):
     """创建新用户（仅限管理员）"""
     try:
         # 检查email是否已存在
         check_sql = text("SELECT id FROM participants WHERE email = :email")
-        if db.execute(check_sql, {"email": user.email}).fetchone():
+        if (await db.execute(check_sql, {"email": user.email})).fetchone():
             raise HTTPException(status_code=400, detail="Email already registered")
 
         # 检查昵称是否已存在
         check_sql = text("SELECT id FROM participants WHERE name = :name")
-        if db.execute(check_sql, {"name": user.name}).fetchone():
+        if (await db.execute(check_sql, {"name": user.name})).fetchone():
             raise HTTPException(status_code=400, detail="Username already taken")
 
         # 创建新用户
@@ -443,17 +502,17 @@ async def create_user(
             RETURNING id, name, email, type, address
         """)
         
-        hashed_password = pwd_context.hash(user.password)
-        result = db.execute(sql, {
+        hashed_password = await hash_password_async(user.password)
+        result = (await db.execute(sql, {
             "name": user.name,
             "email": user.email,
             "password": hashed_password,
             "address": user.address,
             "type": user.type
-        }).fetchone()
+        })).fetchone()
         
-        db.commit()
+        await db.commit()
         return result
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
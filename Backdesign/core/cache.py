@@ -0,0 +1,82 @@
+# core/cache.py
+from itertools import repeat
+from typing import Hashable, Iterable, List, Optional
+
+from cachetools import TTLCache
+
+from .config import get_settings
+
+
+class BookCache:
+    """进程内书籍缓存（LRU + TTL）
+
+    单本书籍按 ISBN 缓存；分类/店铺列表只缓存 ISBN 列表，读取时再从单本缓存
+    组装，因此库存等字段变化时只需失效对应的书籍，列表本身不受影响。
+    每本书同时保存读取时的行版本号（xmin），用于计算 ETag。
+    每个 worker 各有一份缓存，其它 worker 的写入最多在 TTL 之后可见。
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self._books = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lists = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_book(self, isbn: str):
+        entry = self._books.get(isbn)
+        return entry[0] if entry is not None else None
+
+    def get_version(self, isbn: str) -> Optional[str]:
+        entry = self._books.get(isbn)
+        return entry[1] if entry is not None else None
+
+    def put_book(self, book, version: Optional[str] = None):
+        self._books[book.isbn] = (book, version)
+
+    def get_list(self, key: Hashable) -> Optional[list]:
+        """返回列表中的全部书籍；列表未缓存或有书籍已失效时返回 None"""
+        isbns = self._lists.get(key)
+        if isbns is None:
+            return None
+        books = []
+        for isbn in isbns:
+            book = self.get_book(isbn)
+            if book is None:
+                return None
+            books.append(book)
+        return books
+
+    def put_list(self, key: Hashable, books: List, versions: Optional[List[str]] = None):
+        for book, version in zip(books, versions if versions is not None else repeat(None)):
+            self.put_book(book, version)
+        self._lists[key] = tuple(book.isbn for book in books)
+
+    def invalidate_books(self, isbns: Iterable[str]):
+        for isbn in isbns:
+            self._books.pop(isbn, None)
+
+    def invalidate_lists(self, *keys: Hashable):
+        for key in keys:
+            self._lists.pop(key, None)
+
+    def invalidate_list_kind(self, kind: str):
+        """失效某一类的全部列表，例如所有分类列表"""
+        for key in [k for k in list(self._lists.keys()) if k[0] == kind]:
+            self._lists.pop(key, None)
+
+    def clear(self):
+        self._books.clear()
+        self._lists.clear()
+
+
+_settings = get_settings()
+book_cache = BookCache(maxsize=_settings.BOOK_CACHE_SIZE, ttl=_settings.BOOK_CACHE_TTL)
+
+# 按用户 id 缓存 get_current_user 查到的 participants 行
+principal_cache = TTLCache(maxsize=_settings.PRINCIPAL_CACHE_SIZE, ttl=_settings.PRINCIPAL_CACHE_TTL)
+
+# 按用户 id 缓存 participants.token_version，用于校验令牌中的版本号；
+# TTL 单独配置且短于 principal_cache，决定吊销令牌在其它 worker 上生效的最长延迟
+token_version_cache = TTLCache(maxsize=_settings.PRINCIPAL_CACHE_SIZE, ttl=_settings.TOKEN_VERSION_CACHE_TTL)
+
+def invalidate_principal(user_id: int):
+    principal_cache.pop(user_id, None)
+    token_version_cache.pop(user_id, None)
@@ -8,9 +8,60 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
 
+    # 连接池配置（按单个 worker 计算）
+    DB_POOL_SIZE: int = 5
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_PRE_PING: bool = True
+    DB_POOL_RECYCLE: int = 1800  # 秒，-1 表示不回收
+    DB_POOL_TIMEOUT: float = 30.0  # 等待空闲连接的最长秒数
+
+    # 书籍缓存配置
+    BOOK_CACHE_SIZE: int = 10000
+    BOOK_CACHE_TTL: float = 60.0  # 秒
+
+    # 已认证用户缓存配置（其它 worker 上的用户变更最多在 TTL 之后生效）
+    PRINCIPAL_CACHE_SIZE: int = 10000
+    PRINCIPAL_CACHE_TTL: float = 30.0  # 秒
+
+    # 令牌版本号缓存 TTL（秒）：角色变更、修改密码后，旧令牌在其它 worker 上最多还能使用这么久
+    TOKEN_VERSION_CACHE_TTL: float = 5.0
+
+    # 店铺未设置低库存阈值时使用的默认值
+    LOW_STOCK_THRESHOLD: int = 5
+
+    # 热门书籍库存槽的整理间隔（秒），books.inventory 最多延迟这么久反映各槽之和
+    HOT_STOCK_REBALANCE_INTERVAL: float = 2.0
+
+    # 订单写入的销售增量合并进每日汇总表的间隔（秒）；报表同时读取尚未合并的增量，结果不受影响
+    SALES_ROLLUP_INTERVAL: float = 5.0
+
+    # 热度排行：trending/bestseller 的半衰期（秒）、保留的前 K 名、读取新确认的订单和保存检查点的间隔（秒）
+    TRENDING_HALF_LIFE: float = 24 * 3600
+    BESTSELLER_HALF_LIFE: float = 30 * 24 * 3600
+    TRENDING_TOP_K: int = 100
+    TRENDING_POLL_INTERVAL: float = 5.0
+    TRENDING_CHECKPOINT_INTERVAL: float = 300.0
+
+    # 相似书籍表的重新加载间隔和重建间隔（秒）；重建间隔为 0 时不在服务进程中重建，
+    # 由离线任务（python -m app_design.recommendations，例如 cron 每小时执行）重建
+    RECOMMENDATION_RELOAD_INTERVAL: float = 60.0
+    RECOMMENDATION_REBUILD_INTERVAL: float = 0.0
+
+    # bcrypt 线程池大小，即同时进行的密码哈希/校验数量上限
+    PASSWORD_HASH_WORKERS: int = 2
+
+    # 封面缩略图生成进程数
+    IMAGE_WORKERS: int = 2
+    # 按需缩放的封面缓存目录和总大小上限
+    IMAGE_CACHE_DIR: str = "cache/images"
+    IMAGE_CACHE_MAX_BYTES: int = 256 * 1024 * 1024
+    # 被替换的封面保留多久（秒，不短于 BOOK_CACHE_TTL）后删除，以及检查的间隔（秒）
+    COVER_RETIRE_GRACE: float = 300.0
+    COVER_SWEEP_INTERVAL: float = 60.0
+
     class Config:
         env_file = ".env"
 
 @lru_cache()
 def get_settings():
-    return Settings()
\ No newline at end of file
+    return Settings()
@@ -0,0 +1,32 @@
+# core/etag.py
+import hashlib
+import json
+
+from fastapi import Request, Response
+
+# 公共目录数据：允许缓存，但每次使用前必须带 If-None-Match 重新验证
+CATALOG_CACHE_CONTROL = "no-cache"
+# 用户私有数据：只允许浏览器缓存
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+def compute_etag(value) -> str:
+    """根据行版本号或内容计算强 ETag，value 需可 JSON 序列化"""
+    canonical = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+    return '"%s"' % hashlib.blake2b(canonical.encode(), digest_size=16).hexdigest()
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """If-None-Match 使用弱比较：忽略 W/ 前缀，* 匹配任何存在的资源"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    return etag in (tag.strip().removeprefix("W/") for tag in header.split(","))
+
+def set_etag(response: Response, etag: str, cache_control: str = CATALOG_CACHE_CONTROL):
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = cache_control
+
+def not_modified(etag: str, cache_control: str = CATALOG_CACHE_CONTROL) -> Response:
+    """304 响应，不包含响应体"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
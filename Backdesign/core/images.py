@@ -0,0 +1,151 @@
+# core/images.py
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from .config import get_settings
+
+# 封面缩略图规格：名称 -> 最大宽度（像素），高度按比例缩放
+IMAGE_VARIANTS = {
+    "thumb": 160,
+    "medium": 480,
+}
+# 每个规格同时生成 WebP 和 JPEG（兼容不支持 WebP 的客户端）
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpg": ("JPEG", {"quality": 85, "optimize": True, "progressive": True}),
+}
+
+# 文件名带内容哈希（{isbn}.{哈希前 12 位}），内容变化即换 URL，可以长期缓存
+CONTENT_HASH_LENGTH = 12
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "public, max-age=300"
+_HASHED_STEM = re.compile(r"\.[0-9a-f]{%d}$" % CONTENT_HASH_LENGTH)
+
+# 按需缩放只生成这些宽度，请求的宽度向上取整，限制缓存文件数量
+RESIZE_WIDTHS = (80, 160, 240, 320, 480, 640, 960, 1280)
+
+def content_hashed_name(isbn: str, digest: str, ext: str) -> str:
+    return f"{isbn}.{digest[:CONTENT_HASH_LENGTH]}{ext}"
+
+def variant_name(stem: str, variant: str, ext: str) -> str:
+    return f"{stem}_{variant}.{ext}"
+
+def cover_stem(file_name: str) -> str:
+    """原图和各规格缩略图共用的前缀，如 isbn.0123abcd4567_medium.webp -> isbn.0123abcd4567"""
+    stem = os.path.splitext(file_name)[0]
+    for variant in IMAGE_VARIANTS:
+        if stem.endswith(f"_{variant}"):
+            return stem[:-len(variant) - 1]
+    return stem
+
+def cache_control_for(file_name: str) -> str:
+    """带内容哈希的文件不会变化，旧的 {isbn}{ext} 文件名会被覆盖，只能短期缓存"""
+    if _HASHED_STEM.search(cover_stem(file_name)):
+        return IMMUTABLE_CACHE_CONTROL
+    return REVALIDATE_CACHE_CONTROL
+
+def snap_width(width: int) -> int:
+    for allowed in RESIZE_WIDTHS:
+        if width <= allowed:
+            return allowed
+    return RESIZE_WIDTHS[-1]
+
+def _save_atomic(image, dest_path: str, ext: str):
+    fmt, options = VARIANT_FORMATS[ext]
+    if fmt == "JPEG":
+        image = image.convert("RGB")
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    image.save(tmp_path, fmt, **options)
+    # 先写临时文件再替换，避免读到写了一半的图片
+    os.replace(tmp_path, dest_path)
+
+def generate_variants(source_path: str, dest_dir: str, stem: str) -> dict:
+    """在子进程中生成各规格缩略图，返回 {规格: {扩展名: 文件名}}
+
+    只依赖文件路径，不涉及数据库或事件循环，可以安全地交给进程池执行。
+    """
+    # Pillow 只在图片处理进程中导入
+    from PIL import Image, ImageOps
+
+    results = {}
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        for variant, width in IMAGE_VARIANTS.items():
+            resized = image.copy()
+            resized.thumbnail((width, width * 2), Image.LANCZOS)
+            results[variant] = {}
+            for ext in VARIANT_FORMATS:
+                file_name = variant_name(stem, variant, ext)
+                _save_atomic(resized, os.path.join(dest_dir, file_name), ext)
+                results[variant][ext] = file_name
+    return results
+
+def resize_image(source_path: str, dest_path: str, width: int, ext: str):
+    """在子进程中把图片缩放到指定宽度（不放大）"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source_path) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        image.thumbnail((width, width * 2), Image.LANCZOS)
+        _save_atomic(image, dest_path, ext)
+
+
+class DiskLRUCache:
+    """按总字节数限制大小的磁盘缓存，命中时更新 mtime，超出上限时删除最久未用的文件"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def ensure_directory(self):
+        """创建缓存目录，在应用启动时调用，导入模块时不创建任何目录"""
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def touch(self, path: str) -> bool:
+        try:
+            os.utime(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+    def evict(self) -> int:
+        """删除最久未用的文件直到总大小不超过上限，返回删除的文件数"""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        removed = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+
+@lru_cache()
+def get_image_executor() -> ProcessPoolExecutor:
+    """图片处理进程池，首次上传时才创建"""
+    return ProcessPoolExecutor(max_workers=get_settings().IMAGE_WORKERS)
+
+def shutdown_image_executor():
+    if get_image_executor.cache_info().currsize:
+        get_image_executor().shutdown(wait=False, cancel_futures=True)
+        get_image_executor.cache_clear()
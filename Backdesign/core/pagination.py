@@ -0,0 +1,38 @@
+# core/pagination.py
+import base64
+import json
+from typing import Callable, Optional, Sequence
+
+from fastapi import HTTPException, Response
+
+# 下一页游标通过响应头返回，列表接口的响应体保持不变
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+def encode_cursor(values: dict) -> str:
+    """将排序键编码为不透明的游标字符串"""
+    raw = json.dumps(values, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> dict:
+    """解析游标字符串，格式错误时返回 400"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, dict):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def set_next_cursor(
+    response: Response,
+    rows: Sequence,
+    limit: int,
+    key: Callable[[object], dict],
+) -> Optional[str]:
+    """当前页已满时，用最后一行的排序键生成下一页游标并写入响应头"""
+    if not rows or len(rows) < limit:
+        return None
+    cursor = encode_cursor(key(rows[-1]))
+    response.headers[NEXT_CURSOR_HEADER] = cursor
+    return cursor
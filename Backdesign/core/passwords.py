@@ -0,0 +1,87 @@
+# core/passwords.py
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from .config import get_settings
+
+@lru_cache()
+def get_pwd_context():
+    """加密配置；passlib/bcrypt 在首次使用时才导入，缩短 worker 启动时间"""
+    from passlib.context import CryptContext
+
+    return CryptContext(
+        schemes=["bcrypt"],
+        deprecated="auto",
+        bcrypt__rounds=12
+    )
+
+def hash_password(password: str) -> str:
+    """安全的密码哈希函数（同步，会占用调用线程约 250ms）"""
+    return get_pwd_context().hash(password)
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """验证密码（同步）"""
+    return get_pwd_context().verify(plain_password, hashed_password)
+
+
+class PasswordHasher:
+    """在独立的有界线程池中执行 bcrypt，避免阻塞事件循环
+
+    bcrypt 计算时会释放 GIL，因此线程池即可并行；线程数就是并发上限，
+    超出的请求在线程池队列中等待，queued 即当前排队深度。
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.max_queued = 0
+
+    def _call(self, fn, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+        future = self._executor.submit(self._call, fn, args)
+        try:
+            return await asyncio.wrap_future(future)
+        finally:
+            # 等待的请求被取消（客户端断开、超时）时，仍在队列中的任务不会再执行 _call，在这里出队；
+            # 已开始或已完成的任务 cancel() 返回 False，由 _call 计数
+            if future.cancel():
+                with self._lock:
+                    self.queued -= 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "max_queued": self.max_queued,
+            }
+
+
+password_hasher = PasswordHasher(workers=get_settings().PASSWORD_HASH_WORKERS)
+
+async def hash_password_async(password: str) -> str:
+    return await password_hasher.run(hash_password, password)
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await password_hasher.run(verify_password, plain_password, hashed_password)
@@ -0,0 +1,68 @@
+# core/serialization.py
+import asyncio
+import functools
+from collections.abc import Mapping
+from decimal import Decimal
+from typing import Callable
+
+import orjson
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+
+
+def _default(obj):
+    """orjson 不直接支持的类型：金额、Pydantic 模型和数据库行"""
+    if isinstance(obj, Decimal):
+        return float(obj)
+    if isinstance(obj, BaseModel):
+        return obj.model_dump()
+    if hasattr(obj, "_mapping"):
+        return dict(obj._mapping)
+    if isinstance(obj, Mapping):
+        return dict(obj)
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+def dumps(content) -> bytes:
+    return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class FastJSONResponse(JSONResponse):
+    """用 orjson 编码的 JSON 响应"""
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """返回值直接用 orjson 编码的路由，通过 APIRouter(route_class=FastJSONRoute) 按路由器启用
+
+    路由函数返回普通数据（dict/list/模型/数据库行）时直接编码为 JSON 字节，
+    不再按 response_model 校验、也不经过 jsonable_encoder；response_model 仍用于 OpenAPI 文档。
+    因此只适用于返回值已由服务端按模型字段构造、不含需要过滤的列的路由器。
+    """
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        status_code = kwargs.get("status_code") or 200
+        is_coroutine = asyncio.iscoroutinefunction(endpoint)
+
+        @functools.wraps(endpoint)
+        async def fast_endpoint(**values):
+            if is_coroutine:
+                content = await endpoint(**values)
+            else:
+                content = await run_in_threadpool(endpoint, **values)
+            if isinstance(content, Response):
+                return content
+            response = FastJSONResponse(content, status_code=status_code)
+            # 合并路由函数通过 Response 参数设置的响应头和状态码（如 ETag、X-Next-Cursor）
+            for value in values.values():
+                if isinstance(value, Response):
+                    response.headers.raw.extend(value.headers.raw)
+                    if value.status_code:
+                        response.status_code = value.status_code
+            return response
+
+        super().__init__(path, fast_endpoint, **kwargs)
@@ -0,0 +1,35 @@
+# core/startup.py
+import logging
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """记录启动各阶段耗时（毫秒），用于排查滚动发布时的冷启动时间"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds * 1000, 3)
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - started)
+
+    def finish(self):
+        self.record("total", time.perf_counter() - self.started)
+        logger.info("Startup timings (ms): %s", self.phases)
+
+    def snapshot(self) -> dict:
+        return dict(self.phases)
+
+
+startup_timer = StartupTimer()
@@ -0,0 +1,117 @@
+# core/uploads.py
+import hashlib
+from typing import Awaitable, Callable, NamedTuple, Optional
+
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+# 请求体中除文件内容外的 multipart 开销（分隔符、各部分的头）上限，用于按 Content-Length 提前拒绝
+MULTIPART_OVERHEAD = 16 * 1024
+
+class StreamedFile(NamedTuple):
+    filename: str
+    content_type: str
+    size: int
+    sha256: str
+
+class _FilePart:
+    """解析过程中的当前部分"""
+
+    def __init__(self):
+        self.headers = {}
+        self.field = b""
+        self.value = b""
+        self.name: Optional[str] = None
+        self.filename: Optional[str] = None
+        self.content_type = ""
+
+def upload_too_large() -> HTTPException:
+    return HTTPException(status_code=413, detail="文件大小超过限制")
+
+def check_content_length(request: Request, max_size: int):
+    """请求体声明的大小超过上限时直接拒绝，不读取请求体"""
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise upload_too_large()
+
+async def receive_multipart_file(
+    request: Request,
+    field: str,
+    write: Callable[[bytes], Awaitable[object]],
+    max_size: int,
+    check_part: Callable[[str, str], None],
+) -> StreamedFile:
+    """边读取请求体边解析 multipart，把字段 field 的文件内容直接交给 write
+
+    不经过 FastAPI 的表单解析（它会先把整个请求体写入临时文件），内存中只保留一个数据块；
+    文件部分的头解析完成后先调用 check_part(文件名, Content-Type) 校验，文件内容超过 max_size、
+    或请求体超过 max_size 加上 multipart 开销时立即中止读取。
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=400, detail="请使用 multipart/form-data 上传文件")
+
+    part = _FilePart()
+    target: Optional[_FilePart] = None
+    pending = []
+
+    def on_part_begin():
+        nonlocal part
+        part = _FilePart()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part.field += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part.value += data[start:end]
+
+    def on_header_end():
+        part.headers[part.field.lower()] = part.value
+        part.field, part.value = b"", b""
+
+    def on_headers_finished():
+        nonlocal target
+        _, options = parse_options_header(part.headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("latin-1")
+        filename = options.get(b"filename")
+        # 只接收第一个同名文件部分，其余部分（普通字段、多余的文件）的内容丢弃
+        if name == field and filename is not None and target is None:
+            part.filename = filename.decode("utf-8", "replace")
+            part.content_type = part.headers.get(b"content-type", b"").decode("latin-1")
+            check_part(part.filename, part.content_type)
+            target = part
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if part is target:
+            pending.append(data[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+
+    received = 0
+    size = 0
+    digest = hashlib.sha256()
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > max_size + MULTIPART_OVERHEAD:
+            raise upload_too_large()
+        parser.write(chunk)
+        for data in pending:
+            size += len(data)
+            if size > max_size:
+                raise upload_too_large()
+            digest.update(data)
+            await write(data)
+        pending.clear()
+    parser.finalize()
+
+    if target is None:
+        raise HTTPException(status_code=400, detail="缺少上传文件")
+    return StreamedFile(target.filename, target.content_type, size, digest.hexdigest())
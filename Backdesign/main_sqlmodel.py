@@ -1,15 +1,17 @@
 # main_sqlmodel.py
+import time
+from core.startup import startup_timer
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from sqlalchemy import create_engine, Column, Integer, String, Text, Enum, ForeignKey, Numeric, Date, text, inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import create_engine, Column, BigInteger, Integer, SmallInteger, String, Text, Enum, ForeignKey, Numeric, Date, DateTime, Float, CheckConstraint, text, inspect, select
+from sqlalchemy.exc import ProgrammingError
 from sqlalchemy.orm import declarative_base, sessionmaker
 from pydantic import BaseModel, EmailStr, ConfigDict
-from passlib.context import CryptContext
-import bcrypt
 import enum
-from typing import AsyncGenerator, Optional
+from typing import AsyncGenerator, List, Optional
 import logging
 from datetime import date
 from fastapi.middleware.cors import CORSMiddleware
@@ -18,14 +20,23 @@ from app_design.books import routerbook
 from app_design.cart_items import routercart
 from app_design.orders import routerbookorders
 from app_design.users import routeruser 
-
-from db import get_db
+from app_design.admin import routeradmin
+from app_design.exports import routerexport
+from app_design.sales import routersales, run_sales_rollup
+from app_design.inventory import run_hot_stock_rebalancer
+from app_design.trending import run_popularity_tracker
+from app_design.recommendations import run_recommendation_refresher
+
+from db import get_db, get_async_db
+from core.cache import book_cache
+from core.passwords import hash_password, hash_password_async, verify_password_async
 # 在 main_sqlmodel.py 中
 from db import engine
 from db import SessionLocal
 from app_design.dependencies.deps import ACCESS_TOKEN_EXPIRE_MINUTES
 from app_design.dependencies.deps import timedelta
 from app_design.dependencies.deps import create_access_token
+from app_design.dependencies.deps import create_user_token
 # 设置日志
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -33,12 +44,6 @@ logger = logging.getLogger(__name__)
 
 Base = declarative_base()
 
-# 加密配置
-pwd_context = CryptContext(
-    schemes=["bcrypt"],
-    deprecated="auto",
-    bcrypt__rounds=12
-)
 
 
 
@@ -71,6 +76,7 @@ class OrderDetailModel(Base):
     book_isbn = Column(String(20), ForeignKey('books.isbn', ondelete='CASCADE'))
     quantity = Column(Integer, nullable=False)
     unit_price = Column(Numeric(10, 2), nullable=False)
+    category = Column(String(100), nullable=True)  # 下单时书籍所属的分类，用于分类销售汇总
 
 class OrderModel(Base):
     __tablename__ = "orders"
@@ -81,6 +87,7 @@ class OrderModel(Base):
     total_price = Column(Numeric(10, 2), nullable=False)
     status = Column(String(50), nullable=False)
     order_date = Column(Date, nullable=False)
+    confirmed_seq = Column(BigInteger, nullable=True)  # 首次离开待付款状态时分配，热度按该编号增量读取
 
 class BookModel(Base):
     __tablename__ = "books"
@@ -88,12 +95,91 @@ class BookModel(Base):
     isbn = Column(String(20), primary_key=True)
     book_name = Column(String(255), nullable=False)
     authors = Column(String(255), nullable=False)
-    category = Column(String(100))
+    category = Column(String(100), index=True)
     inventory = Column(Integer, nullable=False)
     price = Column(Numeric(10, 2), nullable=False)
     store_id = Column(Integer, ForeignKey('participants.id', ondelete='CASCADE'))
     image_url = Column(String(255)) 
-    
+    hot_slots = Column(SmallInteger, nullable=True)  # 热门模式的库存槽数，为空表示普通模式
+
+class InventorySlotModel(Base):
+    __tablename__ = "inventory_slots"
+    __table_args__ = (CheckConstraint("quantity >= 0", name="ck_inventory_slots_quantity"),)
+
+    isbn = Column(String(20), ForeignKey('books.isbn', ondelete='CASCADE'), primary_key=True)
+    slot = Column(SmallInteger, primary_key=True)
+    quantity = Column(Integer, nullable=False)
+
+class StoreSalesDailyModel(Base):
+    __tablename__ = "store_sales_daily"
+
+    store_id = Column(Integer, primary_key=True)
+    sales_date = Column(Date, primary_key=True)
+    status = Column(String(50), primary_key=True)
+    revenue = Column(Numeric(14, 2), nullable=False)
+    units = Column(Integer, nullable=False)
+    order_count = Column(Integer, nullable=False)
+
+class CategorySalesDailyModel(Base):
+    __tablename__ = "category_sales_daily"
+
+    store_id = Column(Integer, primary_key=True)
+    sales_date = Column(Date, primary_key=True)
+    category = Column(String(100), primary_key=True)
+    status = Column(String(50), primary_key=True)
+    revenue = Column(Numeric(14, 2), nullable=False)
+    units = Column(Integer, nullable=False)
+    order_count = Column(Integer, nullable=False)
+
+class SalesDeltaModel(Base):
+    __tablename__ = "sales_deltas"
+
+    delta_id = Column(BigInteger, primary_key=True, autoincrement=True)
+    store_id = Column(Integer, nullable=False)
+    sales_date = Column(Date, nullable=False)
+    category = Column(String(100), nullable=True)  # 为空时是店铺汇总的增量，否则是该分类的增量
+    status = Column(String(50), nullable=False)
+    revenue = Column(Numeric(14, 2), nullable=False)
+    units = Column(Integer, nullable=False)
+    order_count = Column(Integer, nullable=False)
+
+class PopularityScoreModel(Base):
+    __tablename__ = "popularity_scores"
+
+    kind = Column(String(20), primary_key=True)
+    isbn = Column(String(20), primary_key=True)
+    category = Column(String(100), nullable=False)
+    score = Column(Float, nullable=False)
+
+class PopularityCheckpointModel(Base):
+    __tablename__ = "popularity_checkpoint"
+
+    id = Column(Integer, primary_key=True)
+    last_confirmed_seq = Column(BigInteger, nullable=False)
+    checkpointed_at = Column(DateTime(timezone=True), nullable=False)
+
+class BookRecommendationModel(Base):
+    __tablename__ = "book_recommendations"
+
+    isbn = Column(String(20), primary_key=True)
+    rank = Column(SmallInteger, primary_key=True)
+    recommended_isbn = Column(String(20), nullable=False)
+    score = Column(Float, nullable=False)
+
+class RecommendationBuildModel(Base):
+    __tablename__ = "recommendation_builds"
+
+    id = Column(Integer, primary_key=True)
+    built_at = Column(DateTime(timezone=True), nullable=False)
+    order_lines = Column(BigInteger, nullable=False)
+    pairs = Column(Integer, nullable=False)
+
+class RetiredCoverModel(Base):
+    __tablename__ = "retired_covers"
+
+    stem = Column(String(255), primary_key=True)  # 被替换封面的文件名前缀，原图和各缩略图共用
+    isbn = Column(String(20), nullable=False)
+    retired_at = Column(DateTime(timezone=True), nullable=False)
 
 class ParticipantModel(Base):
     __tablename__ = "participants"
@@ -104,6 +190,8 @@ class ParticipantModel(Base):
     email = Column(String(255), unique=True, nullable=False)
     address = Column(Text, nullable=True)
     type = Column(String(50), nullable=False)
+    token_version = Column(Integer, nullable=False, default=0, server_default="0")  # 角色或密码变更时递增，使旧令牌失效
+    low_stock_threshold = Column(Integer, nullable=True)  # 店铺的低库存阈值，为空时使用默认值
 
 # Pydantic 模型
 class ParticipantBase(BaseModel):
@@ -134,13 +222,195 @@ class Token(BaseModel):
     token_type: str
     user_type: str
 
-def hash_password(password: str) -> str:
-    """安全的密码哈希函数"""
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
-    return pwd_context.verify(plain_password, hashed_password)
+# 数据库迁移：第 N 项即版本 N，按顺序执行，当前版本记录在 schema_version 表中。
+# 只能在末尾追加新版本，语句保持幂等，以便从没有版本记录的旧库升级。
+MIGRATIONS = [
+    # 1: 令牌版本号，用于吊销角色或密码变更前签发的令牌
+    [
+        "ALTER TABLE participants ADD COLUMN IF NOT EXISTS token_version INTEGER NOT NULL DEFAULT 0",
+    ],
+    # 2: 书籍搜索：pg_trgm 的 GIN 索引支持 ILIKE 子串匹配和相似度排序，
+    #    category 上的 B-tree 索引可与之做 BitmapAnd
+    [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS ix_books_book_name_trgm ON books USING gin (book_name gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_books_authors_trgm ON books USING gin (authors gin_trgm_ops)",
+        "CREATE INDEX IF NOT EXISTS ix_books_category ON books (category)",
+    ],
+    # 3: 订单列表按 (order_date, order_id) 倒序做 keyset 分页，订单明细按订单批量加载
+    [
+        "CREATE INDEX IF NOT EXISTS ix_orders_user_date ON orders (user_id, order_date DESC, order_id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_store_date ON orders (store_id, order_date DESC, order_id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_orders_date ON orders (order_date DESC, order_id DESC)",
+        "CREATE INDEX IF NOT EXISTS ix_order_details_order_id ON order_details (order_id)",
+    ],
+    # 4: 店铺低库存视图：按店铺设置阈值，(store_id, inventory, isbn) 索引随库存更新维护，
+    #    按店铺查询低于阈值的书籍只扫描索引中的对应区间
+    [
+        "ALTER TABLE participants ADD COLUMN IF NOT EXISTS low_stock_threshold INTEGER",
+        "CREATE INDEX IF NOT EXISTS ix_books_store_inventory ON books (store_id, inventory, isbn)",
+    ],
+    # 5: 热门书籍的库存槽：抢购时订单分散扣减不同的槽，books.inventory 由后台任务同步为各槽之和
+    [
+        "ALTER TABLE books ADD COLUMN IF NOT EXISTS hot_slots SMALLINT",
+        """CREATE TABLE IF NOT EXISTS inventory_slots (
+            isbn VARCHAR(20) NOT NULL REFERENCES books (isbn) ON DELETE CASCADE,
+            slot SMALLINT NOT NULL,
+            quantity INTEGER NOT NULL,
+            PRIMARY KEY (isbn, slot),
+            CONSTRAINT ck_inventory_slots_quantity CHECK (quantity >= 0)
+        )""",
+    ],
+    # 6: 按 (店铺, 日期, [分类,] 状态) 的每日销售汇总，随订单创建、取消和状态变更增量更新；
+    #    订单明细记录下单时的分类。已有订单在这里一次性补录
+    [
+        "ALTER TABLE order_details ADD COLUMN IF NOT EXISTS category VARCHAR(100)",
+        """UPDATE order_details od SET category = b.category
+           FROM books b
+           WHERE b.isbn = od.book_isbn AND od.category IS NULL""",
+        """CREATE TABLE IF NOT EXISTS store_sales_daily (
+            store_id INTEGER NOT NULL,
+            sales_date DATE NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            units INTEGER NOT NULL,
+            order_count INTEGER NOT NULL,
+            PRIMARY KEY (store_id, sales_date, status)
+        )""",
+        """CREATE TABLE IF NOT EXISTS category_sales_daily (
+            store_id INTEGER NOT NULL,
+            sales_date DATE NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            status VARCHAR(50) NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            units INTEGER NOT NULL,
+            order_count INTEGER NOT NULL,
+            PRIMARY KEY (store_id, sales_date, category, status)
+        )""",
+        """INSERT INTO store_sales_daily (store_id, sales_date, status, revenue, units, order_count)
+           SELECT o.store_id, o.order_date, o.status, SUM(o.total_price),
+                  COALESCE(SUM(d.units), 0), COUNT(*)
+           FROM orders o
+           LEFT JOIN (
+               SELECT order_id, SUM(quantity) AS units FROM order_details GROUP BY order_id
+           ) d ON d.order_id = o.order_id
+           GROUP BY o.store_id, o.order_date, o.status
+           ON CONFLICT DO NOTHING""",
+        """INSERT INTO category_sales_daily (store_id, sales_date, category, status, revenue, units, order_count)
+           SELECT o.store_id, o.order_date, COALESCE(od.category, ''), o.status,
+                  SUM(od.quantity * od.unit_price), SUM(od.quantity), COUNT(DISTINCT o.order_id)
+           FROM orders o
+           JOIN order_details od ON od.order_id = o.order_id
+           GROUP BY o.store_id, o.order_date, COALESCE(od.category, ''), o.status
+           ON CONFLICT DO NOTHING""",
+    ],
+    # 7: 热度排行的检查点：各书籍当时的分数和已读取到的订单明细编号
+    [
+        """CREATE TABLE IF NOT EXISTS popularity_scores (
+            kind VARCHAR(20) NOT NULL,
+            isbn VARCHAR(20) NOT NULL,
+            category VARCHAR(100) NOT NULL,
+            score DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (kind, isbn)
+        )""",
+        """CREATE TABLE IF NOT EXISTS popularity_checkpoint (
+            id INTEGER PRIMARY KEY,
+            last_detail_id INTEGER NOT NULL,
+            checkpointed_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )""",
+    ],
+    # 8: 共同购买推荐：每本书按相似度排名的相似书籍，由订单明细定期整体重建
+    [
+        """CREATE TABLE IF NOT EXISTS book_recommendations (
+            isbn VARCHAR(20) NOT NULL,
+            rank SMALLINT NOT NULL,
+            recommended_isbn VARCHAR(20) NOT NULL,
+            score DOUBLE PRECISION NOT NULL,
+            PRIMARY KEY (isbn, rank)
+        )""",
+        """CREATE TABLE IF NOT EXISTS recommendation_builds (
+            id INTEGER PRIMARY KEY,
+            built_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            order_lines BIGINT NOT NULL,
+            pairs INTEGER NOT NULL
+        )""",
+    ],
+    # 9: 被替换的封面，超过宽限期后由后台任务删除文件
+    [
+        """CREATE TABLE IF NOT EXISTS retired_covers (
+            stem VARCHAR(255) PRIMARY KEY,
+            isbn VARCHAR(20) NOT NULL,
+            retired_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )""",
+    ],
+    # 10: 销售汇总改为先追加增量，由后台任务合并进每日汇总，订单之间不再争用同一汇总行
+    [
+        """CREATE TABLE IF NOT EXISTS sales_deltas (
+            delta_id BIGSERIAL PRIMARY KEY,
+            store_id INTEGER NOT NULL,
+            sales_date DATE NOT NULL,
+            category VARCHAR(100),
+            status VARCHAR(50) NOT NULL,
+            revenue NUMERIC(14, 2) NOT NULL,
+            units INTEGER NOT NULL,
+            order_count INTEGER NOT NULL
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_sales_deltas_store_date ON sales_deltas (store_id, sales_date)",
+    ],
+    # 11: 热度只计入已离开待付款状态的订单，取消的订单不会计入；旧检查点按订单明细编号记录，丢弃后从头重新计算
+    [
+        "CREATE SEQUENCE IF NOT EXISTS orders_confirmed_seq",
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS confirmed_seq BIGINT",
+        """UPDATE orders SET confirmed_seq = nextval('orders_confirmed_seq')
+           WHERE status <> 'pending' AND confirmed_seq IS NULL""",
+        """CREATE UNIQUE INDEX IF NOT EXISTS ix_orders_confirmed_seq ON orders (confirmed_seq)
+           WHERE confirmed_seq IS NOT NULL""",
+        "DELETE FROM popularity_scores",
+        "DROP TABLE IF EXISTS popularity_checkpoint",
+        """CREATE TABLE popularity_checkpoint (
+            id INTEGER PRIMARY KEY,
+            last_confirmed_seq BIGINT NOT NULL,
+            checkpointed_at TIMESTAMP WITH TIME ZONE NOT NULL
+        )""",
+    ],
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+# 多个 worker 同时启动时只允许一个执行迁移
+MIGRATION_LOCK_KEY = 727_001
+
+def get_schema_version() -> int:
+    """读取数据库当前的结构版本，全新或旧库（没有 schema_version 表）返回 0"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar() or 0
+        except ProgrammingError:
+            return 0
+
+def migrate_schema():
+    """建表并执行尚未执行的迁移，返回迁移前的版本"""
+    with engine.begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                id SMALLINT PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        """))
+        # 拿到锁后重新读取，其他 worker 可能已经完成迁移
+        current = conn.execute(text("SELECT version FROM schema_version WHERE id = 1")).scalar() or 0
+        if current >= SCHEMA_VERSION:
+            return current
+        Base.metadata.create_all(bind=conn)
+        for version, statements in enumerate(MIGRATIONS[current:], start=current + 1):
+            for ddl in statements:
+                conn.execute(text(ddl))
+            logger.info(f"Applied schema migration {version}")
+        conn.execute(text("""
+            INSERT INTO schema_version (id, version) VALUES (1, :version)
+            ON CONFLICT (id) DO UPDATE SET version = EXCLUDED.version
+        """), {"version": SCHEMA_VERSION})
+    return current
 
 # 初始化管理员函数
 def create_initial_admin():
@@ -174,19 +444,40 @@ def create_initial_admin():
 async def lifespan(app: FastAPI) -> AsyncGenerator:
     logger.info("Starting up...")
     try:
-        # 检查表是否存在
-        inspector = inspect(engine)
-        if 'participants' not in inspector.get_table_names():
-            # 只有在表不存在时才创建表和初始管理员
-            Base.metadata.create_all(bind=engine)
-            create_initial_admin()
-            logger.info("Tables created and initialized")
+        # 正常情况下只需读取一行版本号；版本落后时才建表、迁移并初始化管理员
+        with startup_timer.phase("schema_check"):
+            version = get_schema_version()
+        if version < SCHEMA_VERSION:
+            with startup_timer.phase("migrate"):
+                previous = migrate_schema()
+                create_initial_admin()
+            logger.info(f"Schema migrated from version {previous} to {SCHEMA_VERSION}")
         logger.info("Database ready")
+        startup_timer.finish()
     except Exception as e:
         logger.error(f"Startup error: {e}")
         raise
+    settings = get_settings()
+    image_cache.ensure_directory()
+    background_tasks = [
+        asyncio.create_task(run_hot_stock_rebalancer(settings.HOT_STOCK_REBALANCE_INTERVAL)),
+        asyncio.create_task(run_sales_rollup(settings.SALES_ROLLUP_INTERVAL)),
+        asyncio.create_task(run_popularity_tracker(
+            settings.TRENDING_POLL_INTERVAL, settings.TRENDING_CHECKPOINT_INTERVAL
+        )),
+        asyncio.create_task(run_recommendation_refresher(
+            settings.RECOMMENDATION_RELOAD_INTERVAL, settings.RECOMMENDATION_REBUILD_INTERVAL
+        )),
+        # 宽限期不短于书籍缓存的 TTL，各 worker 缓存中的旧地址过期前文件一直可用
+        asyncio.create_task(run_cover_sweeper(
+            settings.COVER_SWEEP_INTERVAL, max(settings.COVER_RETIRE_GRACE, settings.BOOK_CACHE_TTL)
+        )),
+    ]
     yield
     logger.info("Shutting down...")
+    for task in background_tasks:
+        task.cancel()
+    shutdown_image_executor()
 
 # 创建 FastAPI 应用
 app = FastAPI(
@@ -202,11 +493,14 @@ app.include_router(routeruser, prefix="/user")
 
 app.include_router(routerbookorders, prefix="/bookorders")
 app.include_router(routercart, prefix="/cart")
+app.include_router(routeradmin, prefix="/admin")
+app.include_router(routerexport, prefix="/export")
+app.include_router(routersales, prefix="/sales")
 
 
 # API路由
 @app.post("/participants/", response_model=ParticipantResponse)
-async def create_participant(participant: ParticipantCreate, db: Session = Depends(get_db)):
+async def create_participant(participant: ParticipantCreate, db: AsyncSession = Depends(get_async_db)):
     """
     创建新用户
     - 检查昵称和邮箱是否已被使用
@@ -214,12 +508,16 @@ async def create_participant(participant: ParticipantCreate, db: Session = Depen
     """
     try:
         # 检查昵称是否已被使用
-        existing_name = db.query(ParticipantModel).filter_by(name=participant.name).first()
+        existing_name = (await db.execute(
+            select(ParticipantModel).filter_by(name=participant.name)
+        )).scalars().first()
         if existing_name:
             raise HTTPException(status_code=400, detail="Username already registered")
         
         # 检查 email 是否已注册
-        existing_email = db.query(ParticipantModel).filter_by(email=participant.email).first()
+        existing_email = (await db.execute(
+            select(ParticipantModel).filter_by(email=participant.email)
+        )).scalars().first()
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already registered")
         
@@ -233,15 +531,15 @@ async def create_participant(participant: ParticipantCreate, db: Session = Depen
         # 创建新用户
         new_participant = ParticipantModel(
             name=participant.name,
-            password=hash_password(participant.password),
+            password=await hash_password_async(participant.password),
             email=participant.email,
             address=participant.address,
             type=participant.type.value
         )
         
         db.add(new_participant)
-        db.commit()
-        db.refresh(new_participant)
+        await db.commit()
+        await db.refresh(new_participant)
         
         logger.info(f"New participant created: {new_participant.name}")
         return new_participant
@@ -250,7 +548,7 @@ async def create_participant(participant: ParticipantCreate, db: Session = Depen
         raise he
     except Exception as e:
         logger.error(f"Error creating participant: {e}")
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=500,
             detail="An error occurred while creating the participant"
@@ -260,16 +558,18 @@ async def create_participant(participant: ParticipantCreate, db: Session = Depen
 @app.post("/login/", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(), 
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """用户登录"""
     try:
         print(f"Login attempt for user: {form_data.username}")  # 日志
 
         # 通过昵称查找用户
-        user = db.query(ParticipantModel).filter(
-            ParticipantModel.name == form_data.username
-        ).first()
+        user = (await db.execute(
+            select(ParticipantModel).filter(
+                ParticipantModel.name == form_data.username
+            )
+        )).scalars().first()
         
         if not user:
             print(f"User not found: {form_data.username}")  # 日志
@@ -280,7 +580,7 @@ async def login(
             )
         
         # 验证密码
-        if not verify_password(form_data.password, user.password):
+        if not await verify_password_async(form_data.password, user.password):
             print("Password verification failed")  # 日志
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
@@ -298,7 +598,7 @@ async def login(
             )
         
         # 创建访问令牌
-        access_token = create_access_token(data={"sub": str(user.id)})
+        access_token = create_user_token(user)
         
         print(f"Login successful for user: {user.name}")  # 日志
         
@@ -348,72 +648,241 @@ app.add_middleware(
     max_age=3600,
 )
 #————————————————————————————————————————————————————————————————————
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, BackgroundTasks, Query, Request
+from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 import os
 import shutil
-import aiofiles
+import asyncio
+from db import AsyncSessionLocal
+from core.config import get_settings
+from core.images import (
+    DiskLRUCache, cache_control_for, content_hashed_name, cover_stem,
+    generate_variants, get_image_executor, resize_image, shutdown_image_executor, snap_width,
+)
+from core.uploads import check_content_length, receive_multipart_file
 # 创建上传目录
 UPLOAD_DIR = "uploads/books"
 if not os.path.exists(UPLOAD_DIR):
     os.makedirs(UPLOAD_DIR)
 os.makedirs(UPLOAD_DIR, exist_ok=True) 
+
+class CoverStaticFiles(StaticFiles):
+    """静态文件服务，按文件名是否带内容哈希设置 Cache-Control"""
+
+    def file_response(self, full_path, stat_result, scope, status_code=200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        response.headers["Cache-Control"] = cache_control_for(os.path.basename(full_path))
+        return response
+
 # 挂载静态文件目录
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
+app.mount("/uploads", CoverStaticFiles(directory="uploads"), name="uploads")
+
+# 按需缩放的封面缓存，目录在 lifespan 中创建
+image_cache = DiskLRUCache(get_settings().IMAGE_CACHE_DIR, get_settings().IMAGE_CACHE_MAX_BYTES)
 
 # 添加图片上传路由
-@app.post("/upload/{isbn}")
+MAX_UPLOAD_SIZE = 2 * 1024 * 1024  # 2MB
+ALLOWED_IMAGE_EXT = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
+
+# 封面地址的前缀，只有这个目录下的封面由本服务管理
+COVER_URL_PREFIX = "/uploads/books/"
+
+def local_cover_stem(image_url: Optional[str]) -> Optional[str]:
+    """本地封面地址对应的文件名前缀，外部地址返回 None"""
+    if not image_url or not image_url.startswith(COVER_URL_PREFIX):
+        return None
+    return cover_stem(os.path.basename(image_url))
+
+def remove_cover_files(stems: List[str]):
+    """删除这些封面的原图及其缩略图"""
+    stems = set(stems)
+    for name in os.listdir(UPLOAD_DIR):
+        if cover_stem(name) in stems:
+            try:
+                os.remove(os.path.join(UPLOAD_DIR, name))
+            except FileNotFoundError:
+                pass
+
+async def sweep_retired_covers(db: AsyncSession, grace: float) -> int:
+    """删除被替换超过 grace 秒、且不再被任何书籍引用的旧封面文件，返回删除的封面数
+
+    登记行的删除和文件的删除在同一事务中，文件删完才提交；重新上传相同内容的封面时，
+    上传事务会删除同一登记行，两者在这一行上排队，不会删掉刚上传的文件。
+    """
+    stems = list((await db.execute(text("""
+        DELETE FROM retired_covers
+        WHERE retired_at < now() - make_interval(secs => :grace)
+        RETURNING stem
+    """), {"grace": grace})).scalars())
+    if not stems:
+        return 0
+    # 批量导入或修改书籍时可能让其他书籍引用同一个封面
+    referenced = {
+        local_cover_stem(url) for url in (await db.execute(text("""
+            SELECT b.image_url FROM books b
+            WHERE EXISTS (
+                SELECT 1 FROM unnest(CAST(:stems AS VARCHAR[])) AS s(stem)
+                WHERE starts_with(b.image_url, :prefix || s.stem)
+            )
+        """), {"stems": stems, "prefix": COVER_URL_PREFIX})).scalars()
+    }
+    unused = [stem for stem in stems if stem not in referenced]
+    await run_in_threadpool(remove_cover_files, unused)
+    await db.commit()
+    return len(unused)
+
+async def run_cover_sweeper(interval: float, grace: float):
+    """后台任务：每隔 interval 秒删除一次超过宽限期的旧封面"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            async with AsyncSessionLocal() as db:
+                removed = await sweep_retired_covers(db, grace)
+            if removed:
+                logger.info(f"Removed {removed} retired covers")
+        except Exception as e:
+            logger.warning(f"Sweeping retired covers failed: {e}")
+
+async def build_image_variants(isbn: str, file_name: str):
+    """后台任务：在进程池中生成缩略图，完成后把 books.image_url 指向中等尺寸的 WebP"""
+    source_path = os.path.join(UPLOAD_DIR, file_name)
+    stem = os.path.splitext(file_name)[0]
+    loop = asyncio.get_running_loop()
+    try:
+        variants = await loop.run_in_executor(
+            get_image_executor(), generate_variants, source_path, UPLOAD_DIR, stem
+        )
+    except Exception as e:
+        # 无法解码的图片保留原图地址
+        logger.error(f"Error generating image variants for {isbn}: {e}")
+        return
+
+    image_url = f"{COVER_URL_PREFIX}{variants['medium']['webp']}"
+    async with AsyncSessionLocal() as db:
+        # 只有封面仍是本次上传的原图时才替换，避免覆盖之后的新上传
+        await db.execute(
+            text("UPDATE books SET image_url = :url WHERE isbn = :isbn AND image_url = :original"),
+            {"url": image_url, "isbn": isbn, "original": f"{COVER_URL_PREFIX}{file_name}"}
+        )
+        await db.commit()
+    book_cache.invalidate_books([isbn])
+    logger.info(f"Image variants ready for {isbn}")
+
+def check_image_part(filename: str, content_type: str):
+    """读取文件内容之前先校验类型和扩展名"""
+    if not content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="只能上传图片文件")
+    if os.path.splitext(filename)[1].lower() not in ALLOWED_IMAGE_EXT:
+        raise HTTPException(status_code=400, detail="不支持的文件格式")
+
+# 请求体由处理函数自己流式解析，在这里声明表单结构供 OpenAPI 文档使用
+UPLOAD_REQUEST_BODY = {
+    "required": True,
+    "content": {"multipart/form-data": {"schema": {
+        "type": "object",
+        "properties": {"file": {"type": "string", "format": "binary"}},
+        "required": ["file"],
+    }}},
+}
+
+@app.post("/upload/{isbn}", openapi_extra={"requestBody": UPLOAD_REQUEST_BODY})
 async def upload_book_image(
     isbn: str,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db)
+    request: Request,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
 ):
+    # Content-Length 超过上限时不读取请求体直接拒绝
+    check_content_length(request, MAX_UPLOAD_SIZE)
+    tmp_path = None
     try:
-        if not file.content_type.startswith('image/'):
-            raise HTTPException(status_code=400, detail="只能上传图片文件")
-
-        # 验证文件大小
-        MAX_SIZE = 2 * 1024 * 1024  # 2MB
-        file_size = 0
-        file_contents = bytearray()
-        
-        while chunk := await file.read(8192):
-            file_size += len(chunk)
-            if file_size > MAX_SIZE:
-                raise HTTPException(status_code=400, detail="文件大小超过限制")
-            file_contents.extend(chunk)
-
-        # 验证文件扩展名
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        allowed_ext = {'.jpg', '.jpeg', '.png', '.gif', '.webp'}
-        if file_ext not in allowed_ext:
-            raise HTTPException(status_code=400, detail="不支持的文件格式")
-
-        # 生成文件名和路径
-        file_name = f"{isbn}{file_ext}"
-        file_path = os.path.join(UPLOAD_DIR, file_name)
-
-        # 保存文件
-        async with aiofiles.open(file_path, 'wb') as f:
-            await f.write(file_contents)
-
-        # 更新数据库
-        image_url = f"/uploads/books/{file_name}"
-        db.execute(
-            text("UPDATE books SET image_url = :url WHERE isbn = :isbn"),
+        # 边接收边解析，文件内容分块写入临时文件并计算内容哈希，超过大小立即中止
+        import aiofiles.tempfile
+        async with aiofiles.tempfile.NamedTemporaryFile('wb', dir=UPLOAD_DIR, suffix='.part', delete=False) as tmp:
+            tmp_path = tmp.name
+            upload = await receive_multipart_file(request, "file", tmp.write, MAX_UPLOAD_SIZE, check_image_part)
+        file_ext = os.path.splitext(upload.filename)[1].lower()
+        digest = upload.sha256
+
+        # 文件名带内容哈希，新封面总是新 URL；先指向原图，缩略图生成后由后台任务更新
+        file_name = content_hashed_name(isbn, digest, file_ext)
+        image_url = f"{COVER_URL_PREFIX}{file_name}"
+        previous = (await db.execute(
+            text("""
+                UPDATE books b SET image_url = :url
+                FROM books old
+                WHERE b.isbn = :isbn AND old.isbn = b.isbn
+                RETURNING old.image_url
+            """),
             {"url": image_url, "isbn": isbn}
-        )
-        db.commit()
-
+        )).first()
+        if previous is None:
+            raise HTTPException(status_code=404, detail="Book not found")
+
+        # 其他 worker 的书籍缓存在 TTL 内仍会返回旧地址，旧封面只登记，超过宽限期后由后台任务删除；
+        # 新封面如果之前被登记过（重新上传了相同内容），取消登记
+        new_stem = os.path.splitext(file_name)[0]
+        old_stem = local_cover_stem(previous[0])
+        await db.execute(text("DELETE FROM retired_covers WHERE stem = :stem"), {"stem": new_stem})
+        if old_stem and old_stem != new_stem:
+            await db.execute(text("""
+                INSERT INTO retired_covers (stem, isbn, retired_at) VALUES (:stem, :isbn, now())
+                ON CONFLICT (stem) DO UPDATE SET retired_at = EXCLUDED.retired_at
+            """), {"stem": old_stem, "isbn": isbn})
+
+        # 书籍存在才原子替换旧文件，然后提交
+        os.replace(tmp_path, os.path.join(UPLOAD_DIR, file_name))
+        tmp_path = None
+        await db.commit()
+        book_cache.invalidate_books([isbn])
+
+        background_tasks.add_task(build_image_variants, isbn, file_name)
         return {"url": image_url}
 
     except HTTPException as he:
+        await db.rollback()
         raise he
     except Exception as e:
-        if 'db' in locals():
-            db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@app.get("/images/{file_name}")
+async def get_resized_image(
+    file_name: str,
+    w: int = Query(..., ge=1, le=4096, description="期望宽度，向上取整到预设宽度"),
+    fmt: str = Query("webp", pattern="^(webp|jpg)$"),
+):
+    """按需缩放封面，结果缓存在磁盘上（按大小做 LRU 淘汰）"""
+    # 只允许访问上传目录下的文件名，防止路径穿越
+    if os.path.basename(file_name) != file_name or file_name.startswith('.'):
+        raise HTTPException(status_code=404, detail="Image not found")
+    source_path = os.path.join(UPLOAD_DIR, file_name)
+    if not os.path.isfile(source_path):
+        raise HTTPException(status_code=404, detail="Image not found")
+
+    width = snap_width(w)
+    headers = {"Cache-Control": cache_control_for(file_name)}
+    cached_path = image_cache.path_for(f"{os.path.splitext(file_name)[0]}_w{width}.{fmt}")
+    if not await run_in_threadpool(image_cache.touch, cached_path):
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                get_image_executor(), resize_image, source_path, cached_path, width, fmt
+            )
+        except Exception as e:
+            logger.error(f"Error resizing image {file_name}: {e}")
+            raise HTTPException(status_code=415, detail="无法处理该图片")
+        await run_in_threadpool(image_cache.evict)
+
+    return FileResponse(cached_path, media_type=f"image/{'jpeg' if fmt == 'jpg' else fmt}", headers=headers)
 #————————————————————————————————————————————————————————————————————————————————————————————————————————————————————————
+startup_timer.record("imports", time.perf_counter() - startup_timer.started)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("main_sqlmodel:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""测试公用的夹具
+
+标记为 postgres 的测试需要 PostgreSQL：TEST_DATABASE_URL 指向一个专用的测试库（格式同 DATABASE_URL，
+需要能创建 pg_trgm 扩展），会话开始时清空 public schema 并执行全部迁移，每个测试前清空各表。
+未设置 TEST_DATABASE_URL 时这些测试跳过。
+"""
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+if TEST_DATABASE_URL:
+    # 在导入应用模块之前设置，应用自己的连接池直接连接测试库
+    os.environ["DATABASE_URL"] = TEST_DATABASE_URL
+
+
+def pytest_collection_modifyitems(config, items):
+    if TEST_DATABASE_URL:
+        return
+    skip = pytest.mark.skip(reason="TEST_DATABASE_URL is not set")
+    for item in items:
+        if "postgres" in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def schema():
+    from sqlalchemy import text
+
+    from main_sqlmodel import engine, migrate_schema
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP SCHEMA public CASCADE"))
+        conn.execute(text("CREATE SCHEMA public"))
+    migrate_schema()
+    return engine
+
+
+@pytest.fixture
+def database(schema):
+    """清空各表和进程内缓存，返回同步引擎，用于准备数据和检查结果"""
+    from sqlalchemy import text
+
+    from core.cache import book_cache, principal_cache, token_version_cache
+    from main_sqlmodel import Base
+
+    tables = ", ".join(table.name for table in Base.metadata.sorted_tables)
+    with schema.begin() as conn:
+        conn.execute(text(f"TRUNCATE {tables} RESTART IDENTITY CASCADE"))
+    book_cache.clear()
+    principal_cache.clear()
+    token_version_cache.clear()
+    return schema
+
+
+@pytest.fixture(scope="session")
+def session_client(schema):
+    """整个会话共用的测试客户端：应用的异步连接池绑定在它的事件循环上
+
+    不执行应用的 lifespan，迁移已由 schema 完成，后台任务（库存整理、汇总合并等）不运行，
+    测试中需要时直接调用对应的函数。
+    """
+    from fastapi.testclient import TestClient
+
+    from main_sqlmodel import app
+
+    @asynccontextmanager
+    async def lifespan(_):
+        yield
+
+    app.router.lifespan_context = lifespan
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def client(session_client, database):
+    return session_client
+
+
+@pytest.fixture
+def register(client):
+    """注册并登录一个用户，返回 (id, 认证头)"""
+    def register(name: str, user_type: str):
+        response = client.post("/participants/", json={
+            "name": name,
+            "password": "pw",
+            "email": f"{name}@example.com",
+            "address": "addr",
+            "type": user_type,
+        })
+        assert response.status_code == 200, response.text
+        token = client.post("/login/", data={"username": name, "password": "pw"}).json()["access_token"]
+        return response.json()["id"], {"Authorization": f"Bearer {token}"}
+    return register
+
+
+@pytest.fixture
+def admin(client, register, database):
+    """管理员不能直接注册：注册后在库中改为管理员再重新登录，返回 (id, 认证头)"""
+    from sqlalchemy import text
+
+    admin_id, _ = register("admin", "buyer")
+    with database.begin() as conn:
+        conn.execute(text("UPDATE participants SET type = 'administrator' WHERE id = :id"), {"id": admin_id})
+    token = client.post("/login/", data={"username": "admin", "password": "pw"}).json()["access_token"]
+    return admin_id, {"Authorization": f"Bearer {token}"}
@@ -0,0 +1,95 @@
+import pytest
+from sqlalchemy import text
+
+from app_design.dependencies.deps import create_access_token, decode_access_token
+from core.cache import principal_cache, token_version_cache
+
+pytestmark = pytest.mark.postgres
+
+
+def profile(client, headers):
+    return client.get("/user/me", headers=headers)
+
+
+def test_profile_update_refreshes_the_cached_principal(client, register):
+    user_id, headers = register("buyer", "buyer")
+    assert profile(client, headers).json()["address"] == "addr"
+    assert principal_cache[user_id].address == "addr"
+
+    response = client.put("/user/me", json={"address": "new"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert profile(client, headers).json()["address"] == "new"
+
+
+def test_admin_update_refreshes_the_cached_principal(client, register, admin):
+    user_id, headers = register("buyer", "buyer")
+    _, admin_headers = admin
+    profile(client, headers)
+    response = client.put(f"/user/{user_id}", json={"address": "moved"}, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert profile(client, headers).json()["address"] == "moved"
+
+
+def test_deleted_user_is_not_served_from_the_cache(client, register, admin):
+    _, headers = register("buyer", "buyer")
+    profile(client, headers)
+    assert client.delete("/user/me", headers=headers).status_code == 200
+    assert profile(client, headers).status_code == 401
+
+    user_id, headers = register("other", "buyer")
+    _, admin_headers = admin
+    profile(client, headers)
+    assert client.delete(f"/user/{user_id}", headers=admin_headers).status_code == 200
+    assert profile(client, headers).status_code == 401
+
+
+def login(client, name, password="pw"):
+    token = client.post("/login/", data={"username": name, "password": password}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+def test_token_carries_role_and_version(client, register):
+    user_id, headers = register("buyer", "buyer")
+    claims = decode_access_token(headers["Authorization"].removeprefix("Bearer "))
+    assert (claims["sub"], claims["role"], claims["ver"]) == (user_id, "buyer", 0)
+    assert client.get("/bookorders/my-orders", headers=headers).status_code == 200
+    assert client.get("/bookorders/", headers=headers).status_code == 403
+
+
+def test_password_change_revokes_issued_tokens(client, register):
+    _, headers = register("buyer", "buyer")
+    response = client.put("/user/me", json={"password": "new"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert client.get("/bookorders/my-orders", headers=headers).status_code == 401
+    assert profile(client, headers).status_code == 401
+    assert client.get("/bookorders/my-orders", headers=login(client, "buyer", "new")).status_code == 200
+
+
+def test_role_change_revokes_issued_tokens(client, register, admin):
+    user_id, headers = register("buyer", "buyer")
+    _, admin_headers = admin
+    response = client.put(f"/user/{user_id}", json={"type": "administrator"}, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    # 旧令牌中的 buyer 角色不再被接受，重新登录后按新角色授权
+    assert client.get("/bookorders/", headers=headers).status_code == 401
+    assert client.get("/bookorders/", headers=login(client, "buyer")).status_code == 200
+
+
+def test_version_bumped_on_another_worker_reloads_the_cached_principal(client, register, database):
+    user_id, headers = register("buyer", "buyer")
+    profile(client, headers)
+    # 其它 worker 修改了密码：本地的 principal 缓存仍是旧行，版本号缓存已过期
+    with database.begin() as conn:
+        conn.execute(text("UPDATE participants SET token_version = token_version + 1 WHERE id = :id"), {"id": user_id})
+    token_version_cache.pop(user_id)
+    assert profile(client, headers).status_code == 401
+    assert principal_cache[user_id].token_version == 1
+    assert profile(client, login(client, "buyer")).status_code == 200
+
+
+def test_tokens_without_role_claims_fall_back_to_the_participant_row(client, register, admin):
+    buyer_id, _ = register("buyer", "buyer")
+    admin_id, _ = admin
+    for user_id, status in [(buyer_id, 403), (admin_id, 200)]:
+        headers = {"Authorization": f"Bearer {create_access_token({'sub': str(user_id)})}"}
+        assert client.get("/bookorders/", headers=headers).status_code == status
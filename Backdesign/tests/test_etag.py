@@ -0,0 +1,80 @@
+import pytest
+
+from core.cache import book_cache
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def catalog(client, register):
+    store_id, store = register("store", "store")
+    for isbn in ("a", "b"):
+        response = client.post("/book/", json={
+            "isbn": isbn, "book_name": "n", "authors": "x", "category": "cs",
+            "inventory": 10, "price": 1, "store_id": store_id,
+        })
+        assert response.status_code == 200, response.text
+    return store_id, store
+
+
+def revalidate(client, url, etag, headers=None):
+    return client.get(url, headers={"If-None-Match": etag, **(headers or {})})
+
+
+@pytest.mark.parametrize("url", ["/book/a", "/book/category/cs", "/book/store/{store_id}", "/user/stores"])
+def test_unchanged_catalog_reads_answer_304(client, catalog, url):
+    store_id, _ = catalog
+    url = url.format(store_id=store_id)
+    response = client.get(url)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "no-cache"
+
+    response = revalidate(client, url, etag)
+    assert (response.status_code, response.content, response.headers["ETag"]) == (304, b"", etag)
+    # 弱比较、多个候选和 * 都能匹配
+    assert revalidate(client, url, f'"other", W/{etag}').status_code == 304
+    assert revalidate(client, url, "*").status_code == 304
+    assert revalidate(client, url, '"other"').status_code == 200
+
+
+@pytest.mark.parametrize("url", ["/book/a", "/book/category/cs", "/book/store/{store_id}"])
+def test_book_update_changes_the_etag(client, catalog, url):
+    store_id, _ = catalog
+    url = url.format(store_id=store_id)
+    etag = client.get(url).headers["ETag"]
+    assert client.put("/book/a", json={"price": 2}).status_code == 200
+    response = revalidate(client, url, etag)
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+@pytest.mark.parametrize("url", ["/book/a", "/book/category/cs"])
+def test_cache_miss_revalidates_from_row_versions(client, catalog, url):
+    etag = client.get(url).headers["ETag"]
+    # 缓存过期后只按行版本号判断，结果与完整读取一致
+    book_cache.clear()
+    assert revalidate(client, url, etag).status_code == 304
+    book_cache.clear()
+    assert client.get(url).headers["ETag"] == etag
+
+
+def test_store_list_etag_follows_store_rows(client, catalog, register):
+    etag = client.get("/user/stores").headers["ETag"]
+    register("other", "store")
+    response = revalidate(client, "/user/stores", etag)
+    assert response.status_code == 200
+    assert [store["name"] for store in response.json()] == ["store", "other"]
+
+
+def test_profile_read_answers_304_until_the_profile_changes(client, register):
+    _, headers = register("buyer", "buyer")
+    response = client.get("/user/me", headers=headers)
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert revalidate(client, "/user/me", etag, headers).status_code == 304
+
+    assert client.put("/user/me", json={"address": "new"}, headers=headers).status_code == 200
+    response = revalidate(client, "/user/me", etag, headers)
+    assert response.status_code == 200
+    assert response.json()["address"] == "new"
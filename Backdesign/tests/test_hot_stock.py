@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from app_design.inventory import claim_hot_stock, rebalance_hot_stock, set_hot_mode
+from app_design.orders import cancel_pending_orders
+from db import AsyncSessionLocal, async_engine
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def books(client, register):
+    store_id, _ = register("store", "store")
+    for isbn in ("A", "B"):
+        response = client.post("/book/", json={
+            "isbn": isbn, "book_name": "n", "authors": "x", "category": "cs",
+            "inventory": 10, "price": 1, "store_id": store_id,
+        })
+        assert response.status_code == 200, response.text
+    return store_id
+
+
+def slots(database, isbn):
+    with database.connect() as conn:
+        return list(conn.execute(
+            text("SELECT quantity FROM inventory_slots WHERE isbn = :isbn ORDER BY slot"), {"isbn": isbn}
+        ).scalars())
+
+
+def make_hot(client, isbn, count):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            await set_hot_mode(db, isbn, count)
+            await db.commit()
+    client.portal.call(run)
+
+
+def claim(client, requested):
+    async def run():
+        async with AsyncSessionLocal() as db:
+            claimed = await claim_hot_stock(db, requested)
+            await db.commit()
+            return claimed
+    return client.portal.call(run)
+
+
+def test_set_hot_mode_splits_and_folds_stock(client, books, database):
+    make_hot(client, "A", 4)
+    assert slots(database, "A") == [3, 3, 2, 2]
+    make_hot(client, "A", 3)
+    assert slots(database, "A") == [4, 3, 3]
+    make_hot(client, "A", None)
+    assert slots(database, "A") == []
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT inventory, hot_slots FROM books WHERE isbn = 'A'")).one() == (10, None)
+
+
+def test_claim_takes_one_slot_or_drains_in_order(client, books, database):
+    make_hot(client, "A", 4)
+    assert claim(client, {"A": 3}) == {"A"}
+    assert sum(slots(database, "A")) == 7
+    # 没有单个槽足够时按槽号顺序合并扣减
+    assert claim(client, {"A": 5}) == {"A"}
+    assert sum(slots(database, "A")) == 2
+    assert all(quantity >= 0 for quantity in slots(database, "A"))
+    # 总量不足时不扣减
+    assert claim(client, {"A": 3}) == set()
+    assert sum(slots(database, "A")) == 2
+
+
+def test_crossed_claims_do_not_deadlock(client, books, database):
+    make_hot(client, "A", 2)
+    make_hot(client, "B", 2)
+
+    async def run():
+        async def order(requested, delay):
+            await asyncio.sleep(delay)
+            async with AsyncSessionLocal() as db:
+                claimed = await claim_hot_stock(db, requested)
+                # 持有锁一段时间，让另一个订单在此期间尝试加锁
+                await asyncio.sleep(0.2)
+                await db.commit()
+                return claimed
+        # 每个订单有一本书只能合并扣减，快速路径锁定的槽回滚后再按 ISBN 顺序加锁
+        return await asyncio.gather(order({"A": 1, "B": 6}, 0), order({"B": 1, "A": 6}, 0.05))
+
+    assert client.portal.call(run) == [{"A", "B"}, {"A", "B"}]
+    assert sum(slots(database, "A")) == 3
+    assert sum(slots(database, "B")) == 3
+
+
+def test_rebalance_evens_slots_and_syncs_inventory(client, books, database):
+    make_hot(client, "A", 4)
+    with database.begin() as conn:
+        conn.execute(text("UPDATE inventory_slots SET quantity = CASE slot WHEN 0 THEN 6 ELSE 0 END WHERE isbn = 'A'"))
+
+    async def rebalance():
+        async with async_engine.begin() as conn:
+            return await rebalance_hot_stock(conn)
+
+    assert client.portal.call(rebalance) == ["A"]
+    assert slots(database, "A") == [2, 2, 1, 1]
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT inventory FROM books WHERE isbn = 'A'")).scalar() == 6
+    # 已经平均且已同步时没有变化
+    assert client.portal.call(rebalance) == []
+
+
+def test_cancel_during_hot_mode_switch_keeps_the_restock(client, register, books, database):
+    _, buyer = register("buyer", "buyer")
+    response = client.post("/bookorders/", json={
+        "store_id": books,
+        "items": [{"book_isbn": "A", "quantity": 4, "unit_price": 1}, {"book_isbn": "B", "quantity": 2, "unit_price": 1}],
+    }, headers=buyer)
+    assert response.status_code == 200, response.text
+    order_id = response.json()["order_id"]
+
+    async def run():
+        async def switch():
+            async with AsyncSessionLocal() as db:
+                await set_hot_mode(db, "A", 2)
+                # 持有书籍行锁，让取消在此期间等待
+                await asyncio.sleep(0.2)
+                await db.commit()
+
+        async def cancel():
+            await asyncio.sleep(0.05)
+            async with AsyncSessionLocal() as db:
+                cancelled, isbns = await cancel_pending_orders(db, order_ids=[order_id])
+                await db.commit()
+                return cancelled, sorted(isbns)
+
+        return (await asyncio.gather(switch(), cancel()))[1]
+
+    assert client.portal.call(run) == ([order_id], ["A", "B"])
+    # 切换提交后 A 已是热门书籍，归还的库存进入 0 号槽而不是丢失
+    assert slots(database, "A") == [7, 3]
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT inventory FROM books WHERE isbn = 'B'")).scalar() == 10
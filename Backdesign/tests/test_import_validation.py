@@ -0,0 +1,55 @@
+from decimal import Decimal
+
+import pytest
+
+from app_design.books import validate_import_record
+
+
+def record(**overrides):
+    values = {
+        "isbn": " 978-7 ",
+        "book_name": "书名",
+        "authors": "作者",
+        "category": "cs",
+        "inventory": "10",
+        "price": "12.50",
+        "store_id": "3",
+    }
+    values.update(overrides)
+    return values
+
+
+def test_valid_record():
+    assert validate_import_record(record(), None) == (
+        "978-7", "书名", "作者", "cs", 10, Decimal("12.50"), 3, None
+    )
+
+
+def test_store_import_overrides_store_id():
+    assert validate_import_record(record(store_id="99"), 5)[6] == 5
+    assert validate_import_record(record(store_id=None), 5)[6] == 5
+
+
+def test_json_numbers_and_image_url():
+    values = validate_import_record(record(inventory=7.0, price=3, store_id=2, image_url=" /img/a.png "), None)
+    assert values[4:] == (7, Decimal("3"), 2, "/img/a.png")
+
+
+@pytest.mark.parametrize("overrides, message", [
+    ({"isbn": "  "}, "isbn is required"),
+    ({"book_name": None}, "book_name is required"),
+    ({"isbn": "x" * 21}, "isbn exceeds 20 characters"),
+    ({"inventory": "ten"}, "inventory must be an integer"),
+    ({"inventory": 1.5}, "inventory must be an integer"),
+    ({"inventory": True}, "inventory must be an integer"),
+    ({"inventory": "-1"}, "inventory must not be negative"),
+    ({"price": "abc"}, "price must be a number"),
+    ({"price": "NaN"}, "price must be between"),
+    ({"price": "-0.01"}, "price must be between"),
+    ({"price": "100000000"}, "price must be between"),
+    ({"price": "1.001"}, "price must be between"),
+    ({"store_id": ""}, "store_id must be an integer"),
+])
+def test_invalid_record(overrides, message):
+    with pytest.raises(ValueError, match=message):
+        validate_import_record(record(**overrides), None)
@@ -0,0 +1,171 @@
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import text
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def store(client, register):
+    store_id, headers = register("store", "store")
+    for i in range(4):
+        response = client.post("/book/", json={
+            "isbn": f"b{i}", "book_name": "n", "authors": "a", "category": "cs",
+            "inventory": 10, "price": i + 1, "store_id": store_id,
+        })
+        assert response.status_code == 200, response.text
+    return store_id, headers
+
+
+def inventory(database):
+    with database.connect() as conn:
+        return dict(conn.execute(text("SELECT isbn, inventory FROM books ORDER BY isbn")).fetchall())
+
+
+def order_items(*items):
+    return [{"book_isbn": isbn, "quantity": quantity, "unit_price": 1} for isbn, quantity in items]
+
+
+def test_order_reserves_every_item(client, register, store, database):
+    store_id, _ = store
+    _, buyer = register("buyer", "buyer")
+    response = client.post("/bookorders/", json={
+        "store_id": store_id, "items": order_items(("b0", 2), ("b1", 3)),
+    }, headers=buyer)
+    assert response.status_code == 200, response.text
+    assert response.json()["total_price"] == 2 * 1 + 3 * 2
+    assert inventory(database) == {"b0": 8, "b1": 7, "b2": 10, "b3": 10}
+
+
+@pytest.mark.parametrize("items, status, detail", [
+    ((("b0", 2), ("b1", 11)), 400, "Insufficient inventory for books: b1"),
+    ((("b0", 2), ("nope", 1)), 404, "Books not found: nope"),
+])
+def test_failed_reservation_rolls_back_the_whole_order(client, register, store, database, items, status, detail):
+    store_id, _ = store
+    _, buyer = register("buyer", "buyer")
+    response = client.post("/bookorders/", json={"store_id": store_id, "items": order_items(*items)}, headers=buyer)
+    assert (response.status_code, response.json()["detail"]) == (status, detail)
+    # 已经扣减的 b0 随整个事务回滚
+    assert inventory(database) == {"b0": 10, "b1": 10, "b2": 10, "b3": 10}
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM orders")).scalar() == 0
+
+
+def test_books_of_another_store_are_not_found(client, register, store):
+    _, buyer = register("buyer", "buyer")
+    other_id, _ = register("other", "store")
+    response = client.post("/bookorders/", json={"store_id": other_id, "items": order_items(("b0", 1))}, headers=buyer)
+    assert response.status_code == 404
+
+
+def test_concurrent_overlapping_orders_all_succeed(client, register, store, database):
+    store_id, _ = store
+    _, buyer = register("buyer", "buyer")
+    rng = random.Random(0)
+    orders = []
+    for _ in range(16):
+        isbns = ["b0", "b1", "b2", "b3"]
+        rng.shuffle(isbns)
+        orders.append(order_items(*((isbn, 1) for isbn in isbns[:3])))
+
+    def place(items):
+        return client.post("/bookorders/", json={"store_id": store_id, "items": items}, headers=buyer).status_code
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        statuses = list(pool.map(place, orders))
+    # 库存只够 10 单，其余按库存不足拒绝，而不是死锁后返回 500
+    assert set(statuses) <= {200, 400}
+    taken = {isbn: sum(1 for items, status in zip(orders, statuses) if status == 200
+                       for item in items if item["book_isbn"] == isbn)
+             for isbn in ["b0", "b1", "b2", "b3"]}
+    assert inventory(database) == {isbn: 10 - count for isbn, count in taken.items()}
+
+
+def test_checkout_reserves_cart_and_rolls_back_on_shortage(client, register, store, database):
+    _, buyer = register("buyer", "buyer")
+    client.post("/cart/", json={"book_isbn": "b0", "quantity": 2}, headers=buyer)
+    client.post("/cart/", json={"book_isbn": "b1", "quantity": 3}, headers=buyer)
+    with database.begin() as conn:
+        conn.execute(text("UPDATE books SET inventory = 1 WHERE isbn = 'b1'"))
+    response = client.post("/cart/checkout", headers=buyer)
+    assert response.status_code == 400
+    assert inventory(database)["b0"] == 10
+
+    with database.begin() as conn:
+        conn.execute(text("UPDATE books SET inventory = 10 WHERE isbn = 'b1'"))
+    response = client.post("/cart/checkout", headers=buyer)
+    assert response.status_code == 200, response.text
+    assert len(response.json()["order_ids"]) == 1
+    assert inventory(database) == {"b0": 8, "b1": 7, "b2": 10, "b3": 10}
+
+
+def place(client, store_id, buyer, *items):
+    response = client.post("/bookorders/", json={"store_id": store_id, "items": order_items(*items)}, headers=buyer)
+    assert response.status_code == 200, response.text
+    return response.json()["order_id"]
+
+
+def test_cancel_restores_every_item(client, register, store, database):
+    store_id, _ = store
+    _, buyer = register("buyer", "buyer")
+    order_id = place(client, store_id, buyer, ("b0", 2), ("b1", 3))
+    assert client.delete(f"/bookorders/{order_id}", headers=buyer).status_code == 200
+    assert inventory(database) == {"b0": 10, "b1": 10, "b2": 10, "b3": 10}
+    with database.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM order_details")).scalar() == 0
+    # 已取消的订单不能再次取消
+    assert client.delete(f"/bookorders/{order_id}", headers=buyer).status_code == 404
+
+
+def test_only_pending_orders_of_the_caller_are_cancelled(client, register, store):
+    store_id, store_headers = store
+    _, buyer = register("buyer", "buyer")
+    _, other = register("other", "buyer")
+    order_id = place(client, store_id, buyer, ("b0", 1))
+    assert client.delete(f"/bookorders/{order_id}", headers=other).status_code == 404
+
+    response = client.put(f"/bookorders/{order_id}", json={"status": "shipped"}, headers=store_headers)
+    assert response.status_code == 200, response.text
+    assert client.delete(f"/bookorders/{order_id}", headers=buyer).status_code == 404
+
+
+def test_bulk_cancel_restocks_books_and_hot_slots(client, register, store, admin, database):
+    store_id, store_headers = store
+    _, buyer = register("buyer", "buyer")
+    response = client.put("/book/b1/hot-mode", json={"slots": 2}, headers=store_headers)
+    assert response.status_code == 200, response.text
+    first = place(client, store_id, buyer, ("b0", 2), ("b1", 1))
+    second = place(client, store_id, buyer, ("b0", 1), ("b1", 4), ("b2", 3))
+    kept = place(client, store_id, buyer, ("b3", 5))
+
+    _, admin_headers = admin
+    response = client.post("/bookorders/cancel", json={"order_ids": [first, second]}, headers=admin_headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["order_ids"] == [first, second]
+    # 热门书籍归还到 0 号槽，books.inventory 由后台任务同步
+    with database.connect() as conn:
+        slots = list(conn.execute(text("SELECT quantity FROM inventory_slots WHERE isbn = 'b1' ORDER BY slot")).scalars())
+        remaining = list(conn.execute(text("SELECT order_id FROM orders")).scalars())
+    assert sum(slots) == 10
+    assert remaining == [kept]
+    inventory_after = inventory(database)
+    assert (inventory_after["b0"], inventory_after["b2"], inventory_after["b3"]) == (10, 10, 5)
+
+
+def test_bulk_cancel_by_date_and_requires_admin(client, register, store, admin, database):
+    store_id, _ = store
+    _, buyer = register("buyer", "buyer")
+    old = place(client, store_id, buyer, ("b0", 2))
+    place(client, store_id, buyer, ("b0", 3))
+    with database.begin() as conn:
+        conn.execute(text("UPDATE orders SET order_date = '2020-01-01' WHERE order_id = :id"), {"id": old})
+
+    assert client.post("/bookorders/cancel", json={"pending_before": "2021-01-01"}, headers=buyer).status_code == 403
+    _, admin_headers = admin
+    assert client.post("/bookorders/cancel", json={}, headers=admin_headers).status_code == 400
+    response = client.post("/bookorders/cancel", json={"pending_before": "2021-01-01"}, headers=admin_headers)
+    assert response.json()["order_ids"] == [old]
+    assert inventory(database)["b0"] == 7
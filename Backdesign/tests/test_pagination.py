@@ -0,0 +1,37 @@
+from datetime import date
+
+import pytest
+from fastapi import HTTPException, Response
+
+from core.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, set_next_cursor
+
+
+def test_cursor_round_trip():
+    values = {"order_date": "2026-10-18", "order_id": 42}
+    cursor = encode_cursor(values)
+    assert "=" not in cursor
+    assert decode_cursor(cursor) == values
+
+
+def test_cursor_encodes_dates_as_strings():
+    assert decode_cursor(encode_cursor({"d": date(2026, 1, 2)})) == {"d": "2026-01-02"}
+
+
+# 依次为：不是 base64、内容不是 JSON（"not json"）、JSON 不是对象（"[1,2]"）
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGpzb24", "WzEsMl0"])
+def test_invalid_cursor_is_rejected(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_next_cursor_only_for_full_page():
+    response = Response()
+    rows = [{"id": 1}, {"id": 2}]
+    assert set_next_cursor(response, rows, 3, lambda row: row) is None
+    assert NEXT_CURSOR_HEADER not in response.headers
+    assert set_next_cursor(response, [], 3, lambda row: row) is None
+
+    cursor = set_next_cursor(response, rows, 2, lambda row: {"id": row["id"]})
+    assert response.headers[NEXT_CURSOR_HEADER] == cursor
+    assert decode_cursor(cursor) == {"id": 2}
@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from core.passwords import PasswordHasher
+
+
+async def occupy(hasher: PasswordHasher, release: threading.Event):
+    """让唯一的工作线程阻塞在 release 上，返回该任务"""
+    task = asyncio.ensure_future(hasher.run(release.wait))
+    while hasher.snapshot()["running"] == 0:
+        await asyncio.sleep(0.01)
+    return task
+
+
+def test_counts_queued_running_and_completed():
+    hasher = PasswordHasher(workers=1)
+    release = threading.Event()
+
+    async def main():
+        try:
+            first = await occupy(hasher, release)
+            second = asyncio.ensure_future(hasher.run(lambda: "done"))
+            await asyncio.sleep(0)
+            assert hasher.snapshot()["queued"] == 1
+        finally:
+            release.set()
+        return await first, await second
+
+    assert asyncio.run(main()) == (True, "done")
+    snapshot = hasher.snapshot()
+    assert (snapshot["queued"], snapshot["running"], snapshot["completed"]) == (0, 0, 2)
+
+
+def test_cancelled_queued_job_leaves_the_queue():
+    hasher = PasswordHasher(workers=1)
+    release = threading.Event()
+    calls = []
+
+    async def main():
+        try:
+            first = await occupy(hasher, release)
+            queued = asyncio.ensure_future(hasher.run(calls.append, "queued"))
+            await asyncio.sleep(0)
+            queued.cancel()
+            await asyncio.gather(queued, return_exceptions=True)
+            assert hasher.snapshot()["queued"] == 0
+        finally:
+            release.set()
+        await first
+
+    asyncio.run(main())
+    snapshot = hasher.snapshot()
+    assert (snapshot["queued"], snapshot["running"], snapshot["completed"]) == (0, 0, 1)
+    # 被取消的任务没有执行
+    assert calls == []
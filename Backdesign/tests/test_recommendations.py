@@ -0,0 +1,83 @@
+import csv
+import io
+import math
+
+import numpy as np
+import pytest
+
+from app_design.recommendations import (
+    MAX_ORDER_TITLES,
+    build_index_arrays,
+    co_purchase_neighbours,
+    recommendation_rows_csv,
+)
+
+
+def neighbours(pairs, n_items, top_n=20, min_support=1):
+    orders = np.array([order for order, _ in pairs], dtype=np.int64)
+    items = np.array([item for _, item in pairs], dtype=np.int32)
+    rows, cols, scores = co_purchase_neighbours(orders, items, n_items, top_n, min_support)
+    return [(int(r), int(c), float(s)) for r, c, s in zip(rows, cols, scores)]
+
+
+def test_cosine_similarity():
+    # 书 0 被 3 个订单购买，书 1 被 2 个订单购买，其中 2 个订单同时购买
+    result = neighbours([(1, 0), (1, 1), (2, 0), (2, 1), (3, 0)], 2)
+    expected = 2 / math.sqrt(3 * 2)
+    assert [(r, c) for r, c, _ in result] == [(0, 1), (1, 0)]
+    assert all(s == pytest.approx(expected, rel=1e-6) for _, _, s in result)
+
+
+def test_min_support_filters_rare_pairs():
+    pairs = [(1, 0), (1, 1), (2, 0), (2, 1), (3, 0), (3, 2)]
+    assert {(r, c) for r, c, _ in neighbours(pairs, 3, min_support=2)} == {(0, 1), (1, 0)}
+
+
+def test_duplicate_lines_count_once():
+    once = neighbours([(1, 0), (1, 1), (2, 0), (2, 1)], 2)
+    twice = neighbours([(1, 0), (1, 0), (1, 1), (2, 0), (2, 1), (2, 1)], 2)
+    assert once == twice
+    assert once[0][2] == pytest.approx(1.0)
+
+
+def test_large_orders_are_ignored():
+    bulk = [(1, item) for item in range(MAX_ORDER_TITLES + 1)]
+    assert neighbours(bulk, MAX_ORDER_TITLES + 1) == []
+    assert neighbours(bulk + [(2, 0), (2, 1)], MAX_ORDER_TITLES + 1) != []
+
+
+def test_top_n_keeps_best_neighbours_in_order():
+    # 书 0 与书 1 同时购买 3 次，与书 2 两次，与书 3 一次
+    pairs = [(o, 0) for o in range(6)] + [(0, 1), (1, 1), (2, 1), (3, 2), (4, 2), (5, 3)]
+    result = [(c, s) for r, c, s in neighbours(pairs, 4, top_n=2) if r == 0]
+    assert [c for c, _ in result] == [1, 2]
+    assert result[0][1] > result[1][1]
+
+
+def test_empty_input():
+    assert neighbours([], 5) == []
+
+
+def test_csv_rows_are_ranked_per_book():
+    rows = np.array([0, 0, 2], dtype=np.int32)
+    cols = np.array([1, 2, 0], dtype=np.int32)
+    scores = np.array([0.9, 0.5, 0.25], dtype=np.float32)
+    payload = recommendation_rows_csv(rows, cols, scores, ["a", "b", "c"])
+    records = list(csv.reader(io.StringIO(payload.decode())))
+    assert records == [["a", "1", "b", "0.8999999761581421"], ["a", "2", "c", "0.5"], ["c", "1", "a", "0.25"]]
+
+
+def test_index_lookup():
+    index = build_index_arrays(["a", "a", "c"], ["b", "c", "a"], [0.9, 0.5, 0.25], 123.0)
+    assert index.lookup("a", 10) == [("b", pytest.approx(0.9)), ("c", 0.5)]
+    assert index.lookup("a", 1) == [("b", pytest.approx(0.9))]
+    assert index.lookup("c", 10) == [("a", 0.25)]
+    # 只作为相似书籍出现的书没有自己的推荐
+    assert index.lookup("b", 10) == []
+    assert index.lookup("missing", 10) == []
+    assert index.built_at == 123.0
+
+
+def test_empty_index():
+    index = build_index_arrays([], [], [], None)
+    assert index.lookup("a", 10) == []
@@ -0,0 +1,110 @@
+import pytest
+from sqlalchemy import text
+
+from app_design.sales import ROLLUP_LOCK_KEY, fold_sales_deltas
+from db import async_engine
+
+pytestmark = pytest.mark.postgres
+
+
+@pytest.fixture
+def shop(client, register):
+    store_id, store = register("store", "store")
+    for isbn, category, price in [("a", "cs", 1), ("b", "math", 2)]:
+        response = client.post("/book/", json={
+            "isbn": isbn, "book_name": "n", "authors": "x", "category": category,
+            "inventory": 100, "price": price, "store_id": store_id,
+        })
+        assert response.status_code == 200, response.text
+    _, buyer = register("buyer", "buyer")
+    return store_id, store, buyer
+
+
+def fold(client):
+    async def run():
+        async with async_engine.begin() as conn:
+            return await fold_sales_deltas(conn)
+    return client.portal.call(run)
+
+
+def place(client, shop, *items):
+    store_id, _, buyer = shop
+    response = client.post("/bookorders/", json={
+        "store_id": store_id,
+        "items": [{"book_isbn": isbn, "quantity": quantity, "unit_price": unit_price}
+                  for isbn, quantity, unit_price in items],
+    }, headers=buyer)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def reports(client, shop, **params):
+    store_id, store, _ = shop
+    totals = client.get(f"/sales/store/{store_id}", params=params, headers=store).json()["totals"]
+    categories = client.get(f"/sales/store/{store_id}/categories", params=params, headers=store).json()
+    return totals, {row["category"]: row for row in categories}
+
+
+def test_order_prices_come_from_the_catalog(client, shop, database):
+    # 客户端提交的单价被忽略，订单明细、分类汇总和店铺汇总都按书籍价格计算
+    order = place(client, shop, ("a", 2, 999), ("b", 1, 0.01))
+    assert order["total_price"] == 4
+    assert sorted((d["book_isbn"], d["unit_price"]) for d in order["details"]) == [("a", 1), ("b", 2)]
+    totals, categories = reports(client, shop)
+    assert totals == {"revenue": 4, "units": 3, "order_count": 1}
+    assert categories["cs"]["revenue"] == 2 and categories["math"]["revenue"] == 2
+    assert sum(row["revenue"] for row in categories.values()) == totals["revenue"]
+
+
+def test_reports_include_unfolded_deltas(client, shop, database):
+    store_id, store, buyer = shop
+    first = place(client, shop, ("a", 1, 1), ("b", 2, 2))
+    place(client, shop, ("b", 2, 2))
+    shipped = place(client, shop, ("a", 2, 1))
+    assert client.put(f"/bookorders/{shipped['order_id']}", json={"status": "shipped"},
+                      headers=store).status_code == 200
+    assert client.delete(f"/bookorders/{first['order_id']}", headers=buyer).status_code == 200
+
+    before = reports(client, shop)
+    pending_before = reports(client, shop, status="pending")
+    with database.connect() as conn:
+        deltas = conn.execute(text("SELECT COUNT(*) FROM sales_deltas")).scalar()
+    assert deltas > 0
+    assert fold(client) == deltas
+    assert fold(client) == 0
+    # 合并前后报表一致
+    assert reports(client, shop) == before
+    assert reports(client, shop, status="pending") == pending_before
+
+    totals, categories = before
+    assert totals == {"revenue": 6, "units": 4, "order_count": 2}
+    assert {name: (row["revenue"], row["units"], row["order_count"]) for name, row in categories.items()} == {
+        "cs": (2, 2, 1), "math": (4, 2, 1),
+    }
+    assert pending_before[0] == {"revenue": 4, "units": 2, "order_count": 1}
+
+    # 汇总表与按订单重新计算的结果一致
+    with database.connect() as conn:
+        rollup = conn.execute(text("""
+            SELECT store_id, sales_date, status, revenue, units, order_count FROM store_sales_daily
+            WHERE order_count <> 0 ORDER BY 1, 2, 3
+        """)).fetchall()
+        recomputed = conn.execute(text("""
+            SELECT o.store_id, o.order_date, o.status, SUM(o.total_price),
+                   SUM((SELECT SUM(quantity) FROM order_details d WHERE d.order_id = o.order_id)), COUNT(*)
+            FROM orders o GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        """)).fetchall()
+    assert [tuple(row) for row in rollup] == [tuple(row) for row in recomputed]
+
+
+def test_fold_skips_while_another_worker_folds(client, shop, database):
+    place(client, shop, ("a", 1, 1))
+
+    async def run():
+        async with async_engine.begin() as holder:
+            await holder.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK_KEY})
+            async with async_engine.begin() as conn:
+                return await fold_sales_deltas(conn)
+
+    assert client.portal.call(run) == 0
+    assert fold(client) == 2
@@ -0,0 +1,64 @@
+from decimal import Decimal
+from typing import List
+
+from fastapi import APIRouter, FastAPI, Response
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from core.serialization import FastJSONRoute, dumps
+
+
+class Item(BaseModel):
+    name: str
+    price: float
+
+
+router = APIRouter(route_class=FastJSONRoute)
+
+
+@router.get("/items", response_model=List[Item])
+async def list_items(response: Response):
+    response.headers["X-Next-Cursor"] = "abc"
+    # 返回值不再按 response_model 校验，原样编码
+    return [{"name": "a", "price": Decimal("1.50"), "extra": 1}]
+
+
+@router.post("/items", response_model=Item, status_code=201)
+def create_item():
+    return Item(name="b", price=2)
+
+
+@router.get("/items/{name}")
+async def get_item(name: str, response: Response):
+    if name == "missing":
+        return Response(status_code=404)
+    response.status_code = 202
+    return {"name": name}
+
+
+app = FastAPI()
+app.include_router(router)
+client = TestClient(app)
+
+
+def test_dumps_supported_types():
+    assert dumps({"price": Decimal("2.25"), "item": Item(name="x", price=1), 1: None}) == \
+        b'{"price":2.25,"item":{"name":"x","price":1.0},"1":null}'
+
+
+def test_returned_data_is_encoded_without_revalidation():
+    response = client.get("/items")
+    assert response.status_code == 200
+    assert response.json() == [{"name": "a", "price": 1.5, "extra": 1}]
+    assert response.headers["x-next-cursor"] == "abc"
+
+
+def test_sync_endpoint_and_declared_status_code():
+    response = client.post("/items")
+    assert response.status_code == 201
+    assert response.json() == {"name": "b", "price": 2.0}
+
+
+def test_response_status_and_returned_response():
+    assert client.get("/items/a").status_code == 202
+    assert client.get("/items/missing").status_code == 404
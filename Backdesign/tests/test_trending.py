@@ -0,0 +1,72 @@
+import random
+
+import pytest
+
+from app_design.trending import MIN_SCORE, DecayedScores, TopK
+
+DAY = 24 * 3600
+
+
+def test_topk_matches_full_sort():
+    rng = random.Random(1)
+    top = TopK(5)
+    totals = {}
+    for _ in range(5000):
+        key = rng.randrange(50)
+        totals[key] = totals.get(key, 0.0) + rng.random()
+        top.offer(key, totals[key])
+        assert set(top.members) == set(sorted(totals, key=totals.get)[-5:])
+    # 惰性删除留下的旧记录不会无限增长
+    assert len(top._heap) <= 4 * top.k + 1
+
+
+def test_topk_ranked_and_scale():
+    top = TopK(3)
+    for key, score in [("a", 1.0), ("b", 3.0), ("c", 2.0), ("d", 0.5)]:
+        top.offer(key, score)
+    assert top.ranked(2) == [("b", 3.0), ("c", 2.0)]
+    top.scale(0.5)
+    assert top.ranked(3) == [("b", 1.5), ("c", 1.0), ("a", 0.5)]
+    top.offer("d", 0.75)
+    assert set(top.members) == {"b", "c", "d"}
+
+
+def test_scores_halve_every_half_life():
+    scores = DecayedScores(DAY, 10, epoch=0.0)
+    scores.add("a", "cs", 8, at=0.0)
+    assert scores.top_books(0.0, 10) == [("a", pytest.approx(8.0))]
+    assert scores.top_books(DAY, 10) == [("a", pytest.approx(4.0))]
+    assert scores.top_books(3 * DAY, 10) == [("a", pytest.approx(1.0))]
+
+
+def test_recent_sales_outrank_older_ones():
+    scores = DecayedScores(DAY, 10, epoch=0.0)
+    scores.add("old", "cs", 3, at=0.0)
+    scores.add("new", "math", 2, at=DAY)
+    now = DAY
+    assert [isbn for isbn, _ in scores.top_books(now, 10)] == ["new", "old"]
+    assert scores.top_books(now, 10, category="cs") == [("old", pytest.approx(1.5))]
+    assert scores.top_books(now, 10, category="missing") == []
+    assert [category for category, _ in scores.top_categories(now, 10)] == ["math", "cs"]
+
+
+def test_rescale_keeps_scores():
+    scores = DecayedScores(DAY, 10, epoch=0.0)
+    scores.add("a", "cs", 4, at=0.0)
+    scores.add("b", "cs", 1, at=2 * DAY)
+    before = scores.top_books(3 * DAY, 10)
+    scores.rescale(3 * DAY)
+    assert scores.epoch == 3 * DAY
+    after = scores.top_books(3 * DAY, 10)
+    assert [isbn for isbn, _ in after] == [isbn for isbn, _ in before]
+    assert [s for _, s in after] == pytest.approx([s for _, s in before])
+    assert scores.top_categories(3 * DAY, 1)[0][1] == pytest.approx(sum(s for _, s in before))
+
+
+def test_snapshot_drops_decayed_books():
+    scores = DecayedScores(DAY, 10, epoch=0.0)
+    scores.add("faded", "cs", 1, at=0.0)
+    scores.add("fresh", "cs", 1, at=30 * DAY)
+    snapshot = scores.snapshot(30 * DAY)
+    assert [(isbn, category) for isbn, category, _ in snapshot] == [("fresh", "cs")]
+    assert all(score >= MIN_SCORE for _, _, score in snapshot)